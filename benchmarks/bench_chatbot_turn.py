@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Benchmark del costo de CPU de un turno del chatbot de Óptica Solar
+
+Corre el pipeline completo de LLMChatbot sobre el backend de almacenamiento en
+memoria, con el LLM y los guardrails remotos reemplazados por respuestas fijas,
+así que mide solo el procesamiento propio sin Redis ni red.
+
+Uso: python benchmarks/bench_chatbot_turn.py
+"""
+
+import asyncio
+import contextlib
+import io
+import sys
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+# Agregar el path del proyecto
+sys.path.append(str(Path(__file__).parent.parent / "retailGPT" / "actions_server" / "src"))
+
+from LLMChatbot.chatbot import LLMChatbot
+from LLMChatbot.services.database import Database
+from LLMChatbot.services.guardrails.guardrails import Guardrails
+from LLMChatbot.services.llm_handler import LLMHandler
+
+USERS = 50
+TURNS = 20
+ANSWER = "Tenemos varias gafas de sol polarizadas que te pueden servir para conducir."
+
+
+async def stream_completions_api(messages, tools=None, **kwargs):
+    """Respuesta fija del LLM, en fragmentos como la real"""
+    for word in ANSWER.split(" "):
+        yield {"type": "content", "delta": word + " "}
+    yield {"type": "message", "message": {"role": "assistant", "content": ANSWER, "tool_calls": None}}
+
+
+async def passing_guardrails(text, timings=None):
+    return True
+
+
+async def run_turns() -> list[float]:
+    """Corre los turnos de todos los usuarios y devuelve la duración de cada uno, en segundos"""
+    durations = []
+    for turn in range(TURNS):
+        for user in range(USERS):
+            start = time.perf_counter()
+            await LLMChatbot.get_response(f"user{user}", "01000", f"Busco gafas de sol, mensaje {turn}", True)
+            durations.append(time.perf_counter() - start)
+    return durations
+
+
+def main():
+    with patch.object(Database, "_backend", "memory"), \
+         patch.object(Database, "_memory", None), \
+         patch.object(LLMHandler, "is_provider_unavailable", return_value=False), \
+         patch.object(LLMHandler, "stream_completions_api", stream_completions_api), \
+         patch.object(Guardrails, "run_input_guardrails", passing_guardrails), \
+         patch.object(Guardrails, "run_output_guardrails", passing_guardrails), \
+         contextlib.redirect_stdout(io.StringIO()):
+        # Los logs del chatbot se descartan para no medir la escritura en la terminal
+        durations = sorted(asyncio.run(run_turns()))
+
+    print(f"{USERS} usuarios x {TURNS} turnos")
+    print(f"media: {sum(durations) / len(durations) * 1e6:.1f} µs")
+    print(f"p50:   {durations[len(durations) // 2] * 1e6:.1f} µs")
+    print(f"p99:   {durations[int(len(durations) * 0.99)] * 1e6:.1f} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Benchmark de los codecs de almacenamiento de los datos de usuario de Óptica Solar
+
+Compara el tiempo de codificación y decodificación y los bytes guardados de cada
+combinación de serializador y compresión instalada, sobre documentos de usuario
+realistas: historial con las recomendaciones formateadas del catálogo, productos
+recomendados, carrito y tool calls en caché.
+
+Uso: python benchmarks/bench_database_codecs.py
+"""
+
+import json
+import sys
+import time
+from pathlib import Path
+
+# Agregar el path del proyecto
+sys.path.append(str(Path(__file__).parent.parent / "retailGPT" / "actions_server" / "src"))
+
+from LLMChatbot.services import serialization
+from LLMChatbot.services.catalog_store import CatalogStore
+from LLMChatbot.services.memory_handler import MemoryHandler
+from LLMChatbot.services.product_handler import ProductHandler
+from LLMChatbot.services.serialization import Codec
+
+CONVERSATION_TURNS = [1, 5, 20]
+COMPRESSION_THRESHOLD = 1024
+REPETITIONS = 200
+
+
+def build_user_data(turns: int) -> dict:
+    """Arma los campos de un usuario tras varios turnos de conversación con búsquedas"""
+    products = CatalogStore.get_products()
+    history = []
+    recommended_products = []
+
+    for turn in range(turns):
+        recommendation = [products[(turn * 5 + offset) % len(products)] for offset in range(5)]
+        recommended_products.extend(recommendation)
+        call_id = f"call_{turn}"
+        history += [
+            {"role": "user", "content": "Busco gafas de sol polarizadas para conducir"},
+            {
+                "role": "assistant",
+                "tool_calls": [
+                    {
+                        "id": call_id,
+                        "type": "function",
+                        "function": {
+                            "name": "search_product_recommendation",
+                            "arguments": json.dumps({"product_query": "gafas polarizadas para conducir"}),
+                        },
+                    }
+                ],
+            },
+            {
+                "role": "tool",
+                "content": ProductHandler._format_product_recommendation(recommendation),
+                "tool_call_id": call_id,
+            },
+            {"role": "assistant", "content": "Estas son algunas opciones que encontré para ti."},
+        ]
+
+    return {
+        "history": history[-MemoryHandler._history_length :],
+        "recommended_products": {
+            CatalogStore.normalize_key(product["product_name"]): product["row_id"]
+            for product in recommended_products
+        },
+        "cart": {"items": [[product["row_id"], 1] for product in recommended_products[:3]], "version": 3},
+        "tool_calls": [],
+        "should_send_cart_summary": True,
+    }
+
+
+def measure(codec: Codec, user_data: dict) -> tuple[float, float, int]:
+    """Mide el tiempo medio por documento (en microsegundos) y los bytes guardados"""
+    records = {}
+    start = time.perf_counter()
+    for _ in range(REPETITIONS):
+        records = {field: codec.encode(value) for field, value in user_data.items()}
+    encode_time = (time.perf_counter() - start) / REPETITIONS * 1e6
+
+    start = time.perf_counter()
+    for _ in range(REPETITIONS):
+        for record in records.values():
+            Codec.decode(record)
+    decode_time = (time.perf_counter() - start) / REPETITIONS * 1e6
+
+    size = sum(
+        len(record.encode("utf-8") if isinstance(record, str) else record)
+        for record in records.values()
+    )
+    return encode_time, decode_time, size
+
+
+def main():
+    codecs = [
+        (serializer, compression)
+        for serializer, entry in serialization._serializers.items()
+        if entry[3]
+        for compression, compression_entry in serialization._compressions.items()
+        if compression_entry[3]
+    ]
+
+    print(f"{'turnos':>6} {'serializador':>12} {'compresión':>10} {'codificar µs':>13} {'decodificar µs':>15} {'bytes':>9}")
+    for turns in CONVERSATION_TURNS:
+        user_data = build_user_data(turns)
+        for serializer, compression in codecs:
+            codec = Codec(serializer, compression, COMPRESSION_THRESHOLD)
+            encode_time, decode_time, size = measure(codec, user_data)
+            print(
+                f"{turns:>6} {serializer:>12} {compression:>10} "
+                f"{encode_time:>13.1f} {decode_time:>15.1f} {size:>9}"
+            )
+        print()
+
+
+if __name__ == "__main__":
+    main()
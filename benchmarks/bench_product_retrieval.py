@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Benchmark del tamaño del prompt de búsqueda de productos de Óptica Solar
+
+Compara el prompt con el catálogo completo contra el prompt con la lista corta
+del índice léxico, a medida que el catálogo crece.
+
+Uso: python benchmarks/bench_product_retrieval.py
+"""
+
+import sys
+import time
+from pathlib import Path
+
+# Agregar el path del proyecto
+sys.path.append(str(Path(__file__).parent.parent / "retailGPT" / "actions_server" / "src"))
+
+from LLMChatbot.prompts import product_search_prompt
+from LLMChatbot.services.catalog_store import CatalogStore
+from LLMChatbot.services.product_handler import ProductHandler
+
+CATALOG_SIZES = [20, 200, 2000, 10000]
+QUERIES = [
+    "aviator sunglasses beach UV protection",
+    "sport sunglasses running polarized",
+    "gafas negras de acetato",
+]
+ZIPCODE = "12345678"
+REPETITIONS = 50
+
+
+def build_catalog(base_products: list[dict], size: int) -> list[dict]:
+    """Replica el catálogo real hasta alcanzar el tamaño pedido"""
+    products = []
+    for index in range(size):
+        product = dict(base_products[index % len(base_products)])
+        product["row_id"] = index + 1
+        product["product_name"] = f"{product['product_name']} #{index}"
+        products.append(product)
+    return products
+
+
+def main():
+    base_products = CatalogStore.get_products()
+    top_k = ProductHandler._retrieval_top_k
+
+    print(f"K = {top_k}, {REPETITIONS} búsquedas por consulta")
+    print(f"{'productos':>10} {'prompt completo':>16} {'prompt lista corta':>19} {'ms/búsqueda':>12}")
+
+    try:
+        for size in CATALOG_SIZES:
+            CatalogStore.load_products(build_catalog(base_products, size))
+            full_prompt = product_search_prompt.format(
+                product_catalog=ProductHandler._get_product_catalog(ZIPCODE),
+                search=QUERIES[0],
+                purchase_history="",
+            )
+
+            # Construye el índice antes de medir
+            ProductHandler._get_lexical_index()
+
+            shortlist_sizes = []
+            start = time.perf_counter()
+            for _ in range(REPETITIONS):
+                for query in QUERIES:
+                    shortlist_sizes.append(len(ProductHandler._build_search_prompt(query, ZIPCODE)))
+            elapsed_ms = (time.perf_counter() - start) * 1000 / (REPETITIONS * len(QUERIES))
+
+            print(
+                f"{size:>10} {len(full_prompt):>16} {max(shortlist_sizes):>19} {elapsed_ms:>12.3f}"
+            )
+    finally:
+        CatalogStore.load_products(base_products)
+
+
+if __name__ == "__main__":
+    main()
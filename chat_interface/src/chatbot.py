@@ -18,6 +18,7 @@ def reset_chatbot_conversation(conversation_id: str) -> None:
     url = f"http://localhost:5005/conversations/{conversation_id}/tracker/events"
     requests.post(url, json={"event": "restart"})
 
-    # Reset conversation database:
+    # Reset conversation database, which stores each field of the conversation in its own key:
     redis_client = redis.StrictRedis(host="localhost", port=6379, db=0)
-    redis_client.delete(conversation_id)
+    keys = list(redis_client.scan_iter(match=f"{conversation_id}:*"))
+    redis_client.delete(conversation_id, *keys)
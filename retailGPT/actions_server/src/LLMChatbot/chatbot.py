@@ -2,6 +2,7 @@ import asyncio
 import json
 import os
 import sys
+from typing import AsyncIterator
 
 import aiohttp
 from colorama import Fore
@@ -10,12 +11,14 @@ from openai.types.chat import ChatCompletionMessageToolCall
 current_directory = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(current_directory)
 
-from .prompts import chatbot_prompt_tools, chatbot_system_prompt
+from .prompts import chatbot_prompt_tools, chatbot_system_prompt, conversation_summary_message
 from .schemas import ChatbotResponse
 from .services.cart_handler import CartHandler
 from .services.llm_handler import LLMHandler
 from .services.memory_handler import MemoryHandler
 from .services.product_handler import ProductHandler
+from .services.token_counter import TokenCounter
+from .services.user_session import UserSession
 from .services.guardrails.guardrails import Guardrails
 
 
@@ -41,6 +44,11 @@ class LLMChatbot:
         "Operation not performed. It is necessary to first confirm the desired product from those available in the catalog. Therefore, before editing the cart, confirm with the user if the desired product is among the results in the catalog below:\n"
     )
 
+    # When enabled, the first completion starts along with the input guardrails and is discarded if they trip
+    _speculative_completion: bool = (
+        os.environ.get("CHATBOT_SPECULATIVE_COMPLETION", "false").lower() == "true"
+    )
+
     @staticmethod
     async def _search_product_recommendation(
         user_id: str,
@@ -52,7 +60,7 @@ class LLMChatbot:
 
         Args:
 
-        session: The aiohttp session for concurrent searching.
+        session: The aiohttp session to use. Defaults to the LLMHandler's shared session.
         user_id: The user's ID.
         product_query: The user's demand for a product, e.g. 'Uma cerveja leve'.
         location_cep: The user's CEP.
@@ -67,26 +75,6 @@ class LLMChatbot:
 
         return recommendation
 
-    @staticmethod
-    def _edit_cart(user_id: str, operation: str, product: str, amount: str) -> str:
-        """Edits the user's cart based on the operation, product and amount.
-
-        Args:
-
-        operation: The operation to be performed on the cart, can be 'add' or 'remove'.
-        product: The product to be added or removed from the cart.
-        amount: The amount of the product to be added or removed from the cart.
-
-        Returns:
-
-        Summary of the operation result and the current state of the cart.
-        """
-
-        function_output = CartHandler.process_cart_operation(
-            user_id, operation, product, amount
-        )
-        return function_output
-
     @staticmethod
     def _tool_call_sorting(tool_call: ChatCompletionMessageToolCall) -> int:
         """Sorts the tool calls prioritizing removal operations.
@@ -127,19 +115,35 @@ class LLMChatbot:
         # Prioritize removal operations, as the removed products may block the addition of new ones due to the volume limit
         tool_calls.sort(key=LLMChatbot._tool_call_sorting)
 
+        # The cart operations are applied together, with a single write of the cart.
+        # The flag to send the cart summary is set along with it, as the summary is sent
+        # from outside the LLM, since avoiding hallucinations is crucial
+        cart_calls = [call for call in tool_calls if call.function.name == "edit_cart"]
+        cart_outputs = {}
+        if cart_calls:
+            cart_operations = []
+            for call in cart_calls:
+                function_arguments = json.loads(call.function.arguments)
+                cart_operations.append(
+                    (
+                        function_arguments["operation"],
+                        function_arguments["product"],
+                        function_arguments["amount"],
+                    )
+                )
+            cart_results = await CartHandler.process_cart_operations(user_id, cart_operations)
+            cart_outputs = {call.id: result for call, result in zip(cart_calls, cart_results)}
+
         for call in tool_calls:
 
             call_id = call.id
             function_arguments = json.loads(call.function.arguments)
             if call.function.name == "edit_cart":
-                operation = function_arguments["operation"]
                 product = function_arguments["product"]
-                amount = function_arguments["amount"]
+                function_output = cart_outputs[call_id]
 
-                if (
-                    operation == "add"
-                    and not ProductHandler.product_was_recommended(user_id, product)
-                ):
+                # Additions of products that were not recommended are not applied
+                if function_output is None:
 
                     print("Trying to add a product that was not recommended: ", product)
 
@@ -148,20 +152,10 @@ class LLMChatbot:
                         user_id, product, user_cep
                     )
 
-                else:
-
-                    function_output = LLMChatbot._edit_cart(
-                        user_id, operation, product, amount
-                    )
-
-                    # Sets the flag to send the cart summary to the user
-                    # This is sent from outside the LLM, as avoiding hallucinations is crucial
-                    CartHandler.set_should_send_cart_summary(user_id, True)
-
             else:
 
                 function_output = LLMChatbot._finish_purchase_function_message
-                CartHandler.set_should_finish_purchase(user_id, True)
+                await CartHandler.set_should_finish_purchase(user_id, True)
 
             output_messages.append(
                 {"role": "tool", "content": function_output, "tool_call_id": call_id}
@@ -196,30 +190,28 @@ class LLMChatbot:
             else:
                 sequential_tool_calls.append(tool_call)
 
-        async with aiohttp.ClientSession() as session:
-
-            if search_tool_calls:
-                for call in search_tool_calls:
-
-                    call_id = call.id
-                    function_arguments = json.loads(call.function.arguments)
-                    task = asyncio.create_task(
-                        LLMChatbot._search_product_recommendation(
-                            user_id,
-                            function_arguments["product_query"],
-                            user_cep,
-                            session
-                        )
+        # Searches run concurrently over the LLMHandler's shared connection pool
+        if search_tool_calls:
+            for call in search_tool_calls:
+
+                call_id = call.id
+                function_arguments = json.loads(call.function.arguments)
+                task = asyncio.create_task(
+                    LLMChatbot._search_product_recommendation(
+                        user_id,
+                        function_arguments["product_query"],
+                        user_cep,
                     )
-                    tasks.append(task)
-                    call_ids.append(call_id)
+                )
+                tasks.append(task)
+                call_ids.append(call_id)
 
-                results = await asyncio.gather(*tasks)
+            results = await asyncio.gather(*tasks)
 
-                for result, id in zip(results, call_ids):
-                    output_messages.append(
-                        {"role": "tool", "content": result, "tool_call_id": id}
-                    )
+            for result, id in zip(results, call_ids):
+                output_messages.append(
+                    {"role": "tool", "content": result, "tool_call_id": id}
+                )
 
         if sequential_tool_calls:
             sequential_calls_output = await LLMChatbot._process_sequential_tool_calls(
@@ -257,7 +249,7 @@ class LLMChatbot:
         return tool_call_message
 
     @staticmethod
-    def _response_post_processing(
+    async def _response_post_processing(
         user_id: str, final_answer: str
     ) -> list[ChatbotResponse]:
         """Processes the final answer before sending it to the user.
@@ -277,7 +269,7 @@ class LLMChatbot:
             "content": final_answer,
         }
 
-        MemoryHandler.add_message_to_history(user_id, final_answer_dict)
+        await MemoryHandler.add_message_to_history(user_id, final_answer_dict)
 
         # Prints the final answer for debugging purposes
         print(Fore.BLUE + "Final answer: ", final_answer)
@@ -287,9 +279,9 @@ class LLMChatbot:
         # so they are rendered after all the text
         buttons = []
 
-        if CartHandler.get_should_send_cart_summary(user_id):
+        if await CartHandler.get_should_send_cart_summary(user_id):
 
-            cart_summary = CartHandler.get_cart_summary(user_id)
+            cart_summary = await CartHandler.get_cart_summary(user_id)
             return_responses.append({"text": cart_summary, "buttons": None})
             confirmation_button = {
                 "title": "Finish purchase",
@@ -297,13 +289,35 @@ class LLMChatbot:
             }
             buttons.append(confirmation_button)
 
-            CartHandler.set_should_send_cart_summary(user_id, False)
+            await CartHandler.set_should_send_cart_summary(user_id, False)
 
         return_responses.append({"text": final_answer, "buttons": buttons})
 
         return return_responses
 
-    def _response_pre_processing(user_id: str, user_message: str) -> list[dict]:
+    @staticmethod
+    async def _get_system_messages(user_id: str) -> list[dict]:
+        """Gets the messages sent before the history: the system prompt and the summary of the
+        earlier conversation, if any.
+
+        Args:
+
+        user_id: The user's ID.
+
+        Returns:
+
+        List containing the system messages.
+        """
+
+        messages = [{"role": "system", "content": chatbot_system_prompt}]
+        summary = await MemoryHandler.get_summary(user_id)
+        if summary:
+            messages.append(
+                {"role": "system", "content": conversation_summary_message.format(summary=summary)}
+            )
+        return messages
+
+    async def _response_pre_processing(user_id: str, user_message: str) -> list[dict]:
         """Generate the array of messages that will be sent to the completions API.
 
         Args:
@@ -316,11 +330,10 @@ class LLMChatbot:
         List containing the messages that will be sent to the completions API.
         """
 
-        system_message_dict = {"role": "system", "content": chatbot_system_prompt}
         user_message_dict = {"role": "user", "content": user_message}
-        MemoryHandler.add_message_to_history(user_id, user_message_dict)
-        history = MemoryHandler.get_history(user_id)
-        messages = [system_message_dict] + history
+        await MemoryHandler.add_message_to_history(user_id, user_message_dict)
+        history = await MemoryHandler.get_history(user_id)
+        messages = await LLMChatbot._get_system_messages(user_id) + history
 
         return messages
 
@@ -339,10 +352,24 @@ class LLMChatbot:
         List containing one or more chatbot's responses to the user's message.
         """
 
-        tool_calls = MemoryHandler.get_cached_tool_calls(user_id)
+        async with UserSession.start(user_id):
+            responses = await LLMChatbot._get_response_from_cache(user_id, user_cep)
+        MemoryHandler.schedule_summary(user_id)
+        return responses
+
+    @staticmethod
+    async def _get_response_from_cache(
+        user_id: str, user_cep: str
+    ) -> list[ChatbotResponse]:
+        """Gets the chatbot's response from the cached tool calls, within the user's session."""
+
+        tool_calls = await MemoryHandler.get_cached_tool_calls(user_id)
         if not tool_calls:
             return None
 
+        if LLMHandler.is_provider_unavailable():
+            return [{"text": LLMHandler._provider_unavailable_message, "buttons": None}]
+
         print("Running get response from cache")
         print("Cached tool calls ", tool_calls)
 
@@ -350,22 +377,93 @@ class LLMChatbot:
             user_id, user_cep, tool_calls
         )
         tool_call_message = LLMChatbot._build_tool_call_message(tool_calls)
-        history = MemoryHandler.get_history(user_id)
-        history.extend([tool_call_message] + tools_output_messages)
+        # Stored so the next turns know what the tools returned
+        await MemoryHandler.add_messages_to_history(user_id, [tool_call_message] + tools_output_messages)
+        history = await MemoryHandler.get_history(user_id)
 
-        messages = [{"role": "system", "content": chatbot_system_prompt}] + history
+        messages = await LLMChatbot._get_system_messages(user_id) + history
         completion_response = await LLMHandler.call_completions_api(messages)
 
         final_answer = completion_response["content"]
 
-        return_responses = LLMChatbot._response_post_processing(user_id, final_answer)
+        return_responses = await LLMChatbot._response_post_processing(user_id, final_answer)
         return return_responses
 
     @staticmethod
-    async def get_response(
-        user_id: str, user_cep: str | None, user_message: str, is_of_legal_age: bool | None, debug_mode: bool = False
-    ) -> list[ChatbotResponse] | dict:
-        """Gets the chatbot's response to the user's message.
+    async def _stream_completion(
+        messages: list[dict], tools: list[dict] | None = None, speculative: bool = False
+    ) -> AsyncIterator[dict]:
+        """Streams a completion, relaying its text as it is generated.
+
+        Args:
+
+        messages: The messages to be sent to the completions API.
+        tools: The tools the model can call, if any.
+        speculative: Whether the completion may be discarded, so its tokens are refunded if it's cancelled.
+
+        Returns:
+
+        An async iterator over {"type": "delta", "text": str} events, followed by a last
+        {"type": "message", "message": dict, "prompt_tokens": int} event with the complete response message.
+        """
+
+        prompt_tokens = TokenCounter.count_messages(messages)
+        print(Fore.YELLOW + "Prompt tokens: ", prompt_tokens)
+
+        async for event in LLMHandler.stream_completions_api(
+            messages, tools, speculative=speculative
+        ):
+            if event["type"] == "content":
+                yield {"type": "delta", "text": event["delta"]}
+            else:
+                yield {**event, "prompt_tokens": prompt_tokens}
+
+    @staticmethod
+    def _start_completion(
+        messages: list[dict], tools: list[dict] | None = None, speculative: bool = False
+    ) -> tuple[asyncio.Task, asyncio.Queue]:
+        """Starts streaming a completion in the background, buffering its events.
+
+        Args:
+
+        messages: The messages to be sent to the completions API.
+        tools: The tools the model can call, if any.
+        speculative: Whether the completion may be discarded, so its tokens are refunded if it's cancelled.
+
+        Returns:
+
+        The task running the completion, which can be cancelled to discard it, and the
+        queue receiving the events of LLMChatbot._stream_completion. If the completion
+        fails, a last {"type": "error", "error": Exception} event is put on the queue.
+        """
+
+        events = asyncio.Queue()
+
+        async def pump():
+            try:
+                async for event in LLMChatbot._stream_completion(messages, tools, speculative):
+                    await events.put(event)
+            except Exception as e:
+                # Otherwise the consumer would wait for events forever
+                await events.put({"type": "error", "error": e})
+
+        return asyncio.create_task(pump()), events
+
+    @staticmethod
+    async def get_response_stream(
+        user_id: str, user_cep: str | None, user_message: str, is_of_legal_age: bool | None
+    ) -> AsyncIterator[dict]:
+        """Streams the chatbot's response to the user's message.
+
+        The text of the final answer is relayed as soon as the model generates it. The last
+        event holds the responses to be sent, which replace the streamed text, as the cart
+        summary is added and the output guardrails run after the answer is complete.
+
+        The streamed text has NOT passed the output guardrails: unsafe text may reach the client
+        before the last event replaces it with the guardrails' fallback answer. Clients that must
+        never show such text should only display the last event's responses.
+
+        The user's data is read once and written back in a single round-trip, before the last event.
 
         Args:
 
@@ -373,24 +471,89 @@ class LLMChatbot:
         user_cep: The user's CEP.
         user_message: The user's message to the chatbot.
         is_of_legal_age: Boolean indicating if the user is over legal age.
-        debug_mode: When activated, the chatbot will return a dict containing processing data and also the list of responses
 
         Returns:
 
-        List containing one or more chatbot's responses to the user's message.
-        Each response is a dict containing the keys "text" and "buttons".
+        An async iterator over {"type": "delta", "text": str} events with partial text, followed by
+        a last {"type": "responses", "responses": list[ChatbotResponse], "tool_calls": list | None} event.
+        The last event also has the "prompt_tokens" sent in the turn's completions, if any was made.
         """
 
+        async with UserSession.start(user_id) as session:
+            async for event in LLMChatbot._get_response_stream(
+                user_id, user_cep, user_message, is_of_legal_age
+            ):
+                if event["type"] == "responses":
+                    # The caller may read the stored state as soon as it gets the responses
+                    await session.flush()
+                    MemoryHandler.schedule_summary(user_id)
+                yield event
+
+    @staticmethod
+    async def _get_response_stream(
+        user_id: str, user_cep: str | None, user_message: str, is_of_legal_age: bool | None
+    ) -> AsyncIterator[dict]:
+        """Streams the chatbot's response to the user's message, within the user's session."""
+
         # Prints the user message for debugging purposes
         print(Fore.BLUE + "User message: ", Fore.BLUE + user_message)
 
-        # Guardrails checks for the input before processing the message and adding it to the history:
-        if not await Guardrails.run_input_guardrails(user_message):
-            return [{"text": LLMChatbot._guardrails_warning, "buttons": None}]
+        # Fails fast while the LLM provider is degraded, instead of holding the action worker
+        if LLMHandler.is_provider_unavailable():
+            yield {
+                "type": "responses",
+                "responses": [{"text": LLMHandler._provider_unavailable_message, "buttons": None}],
+                "tool_calls": None,
+            }
+            return
 
-        messages = LLMChatbot._response_pre_processing(user_id, user_message)
         tools = chatbot_prompt_tools
-        completion_response = await LLMHandler.call_completions_api(messages, tools)
+        completion = None
+        if LLMChatbot._speculative_completion:
+            # Nothing is stored nor executed until the guardrails pass
+            history = await MemoryHandler.get_history_with_message(
+                user_id, {"role": "user", "content": user_message}
+            )
+            messages = await LLMChatbot._get_system_messages(user_id) + history
+            # Its tokens don't count against the budget if the guardrails discard it
+            completion = LLMChatbot._start_completion(messages, tools, speculative=True)
+
+        # Guardrails checks for the input before processing the message and adding it to the history:
+        guardrail_timings = {}
+        input_is_safe = False
+        try:
+            input_is_safe = await Guardrails.run_input_guardrails(user_message, guardrail_timings)
+        finally:
+            if completion is not None and not input_is_safe:
+                completion[0].cancel()
+        print(Fore.YELLOW + "Input guardrails timings: ", guardrail_timings)
+        if not input_is_safe:
+            yield {
+                "type": "responses",
+                "responses": [{"text": LLMChatbot._guardrails_warning, "buttons": None}],
+                "tool_calls": None,
+            }
+            return
+
+        messages = await LLMChatbot._response_pre_processing(user_id, user_message)
+        if completion is None:
+            completion = LLMChatbot._start_completion(messages, tools)
+
+        # When the model answers directly, this first completion is already the final answer
+        task, events = completion
+        try:
+            while True:
+                event = await events.get()
+                if event["type"] == "error":
+                    raise event["error"]
+                if event["type"] == "message":
+                    completion_response = event["message"]
+                    prompt_tokens = event.get("prompt_tokens", 0)
+                    break
+                yield event
+        finally:
+            # The stream consumer may stop early
+            task.cancel()
 
         tool_calls = completion_response.get("tool_calls", None)
 
@@ -401,11 +564,17 @@ class LLMChatbot:
             ]
 
             if user_cep is None:
-                MemoryHandler.add_cached_tool_calls(user_id, tool_calls)
+                await MemoryHandler.add_cached_tool_calls(user_id, tool_calls)
                 response = LLMChatbot._cache_warning_cep
                 if is_of_legal_age is None:
                     response = LLMChatbot._cache_warning_cep_age
-                return LLMChatbot._response_post_processing(user_id, response)
+                yield {
+                    "type": "responses",
+                    "responses": await LLMChatbot._response_post_processing(user_id, response),
+                    "tool_calls": tool_calls,
+                    "prompt_tokens": prompt_tokens,
+                }
+                return
 
             # Prints the tool calls for debugging purposes
             print(
@@ -418,25 +587,71 @@ class LLMChatbot:
             )
 
             tool_call_message = LLMChatbot._build_tool_call_message(tool_calls)
-            history = MemoryHandler.get_history(user_id)
-            history.extend([tool_call_message] + tools_output_messages)
+            # Stored so the next turns know what the tools returned
+            await MemoryHandler.add_messages_to_history(user_id, [tool_call_message] + tools_output_messages)
+            history = await MemoryHandler.get_history(user_id)
 
             # Call the completions API without tools, as we want a final response:
-            messages = [{"role": "system", "content": chatbot_system_prompt}] + history
-            completion_response = await LLMHandler.call_completions_api(messages)
+            messages = await LLMChatbot._get_system_messages(user_id) + history
+            async for event in LLMChatbot._stream_completion(messages):
+                if event["type"] == "message":
+                    completion_response = event["message"]
+                    prompt_tokens += event.get("prompt_tokens", 0)
+                else:
+                    yield event
 
         final_answer = completion_response["content"]
 
         # Guardrails checks for the output before sending the response or adding it to the history:
-        if not Guardrails.run_output_guardrails(user_message):
-            return [{"text": LLMChatbot._guardrails_warning, "buttons": None}]
+        if not await Guardrails.run_output_guardrails(user_message):
+            yield {
+                "type": "responses",
+                "responses": [{"text": LLMChatbot._guardrails_warning, "buttons": None}],
+                "tool_calls": tool_calls,
+                "prompt_tokens": prompt_tokens,
+            }
+            return
+
+        yield {
+            "type": "responses",
+            "responses": await LLMChatbot._response_post_processing(user_id, final_answer),
+            "tool_calls": tool_calls,
+            "prompt_tokens": prompt_tokens,
+        }
+
+    @staticmethod
+    async def get_response(
+        user_id: str, user_cep: str | None, user_message: str, is_of_legal_age: bool | None, debug_mode: bool = False
+    ) -> list[ChatbotResponse] | dict:
+        """Gets the chatbot's response to the user's message.
+
+        Args:
 
-        return_responses = LLMChatbot._response_post_processing(user_id, final_answer)
+        user_id: The user's ID.
+        user_cep: The user's CEP.
+        user_message: The user's message to the chatbot.
+        is_of_legal_age: Boolean indicating if the user is over legal age.
+        debug_mode: When activated, the chatbot will return a dict containing processing data and also the list of responses
+
+        Returns:
+
+        List containing one or more chatbot's responses to the user's message.
+        Each response is a dict containing the keys "text" and "buttons".
+        """
+
+        async for event in LLMChatbot.get_response_stream(
+            user_id, user_cep, user_message, is_of_legal_age
+        ):
+            if event["type"] == "responses":
+                return_responses = event["responses"]
+                tool_calls = event["tool_calls"]
+                prompt_tokens = event.get("prompt_tokens", 0)
 
         if debug_mode:
             return {
                 "tool_calls": tool_calls,
+                "prompt_tokens": prompt_tokens,
                 "responses": return_responses,
             }
-        
+
         return return_responses
@@ -0,0 +1,241 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from enum import IntEnum
+
+
+class RequestPriority(IntEnum):
+    """Priority classes of the outbound LLM requests. Lower values are admitted first."""
+
+    USER_FACING = 0  # Completions whose output is the answer the user is waiting for
+    GUARDRAIL = 1  # Moderation and prompt hack checks
+    SEARCH = 2  # Product searches, possibly speculative
+    BACKGROUND = 3  # Work no user is waiting for, e.g. conversation summaries
+
+
+class AdmissionController:
+    """Bounds the outbound LLM requests of the process.
+
+    A request is admitted when there is a free in-flight slot and the tokens it is
+    expected to use fit in the budget of the last minute. Waiting requests are
+    admitted strictly by priority class, and in arrival order within a class.
+    """
+
+    _window_seconds: float = 60
+
+    def __init__(self, max_in_flight: int, tokens_per_minute: int = 0):
+        """
+        Args:
+
+        max_in_flight: Maximum number of requests running at the same time.
+        tokens_per_minute: Maximum number of tokens admitted in any 60-second window. 0 disables the budget.
+        """
+
+        self.max_in_flight = max_in_flight
+        self.tokens_per_minute = tokens_per_minute
+
+        self._in_flight = 0
+        # Heap of (priority, arrival sequence, future, tokens, enqueue time)
+        self._waiters: list[tuple[int, int, asyncio.Future, int, float]] = []
+        self._sequence = itertools.count()
+        # Entries are [admission time, tokens], so a refund can zero its entry
+        self._token_window: deque[list] = deque()
+        self._window_tokens = 0
+        self._wakeup: asyncio.TimerHandle | None = None
+        self._wakeup_loop: asyncio.AbstractEventLoop | None = None
+
+        self._admitted = {priority: 0 for priority in RequestPriority}
+        self._total_wait = {priority: 0.0 for priority in RequestPriority}
+        self._max_wait = {priority: 0.0 for priority in RequestPriority}
+
+    def _expire_tokens(self, now: float) -> None:
+        """Drops the token usage older than the budget window."""
+
+        while self._token_window and now - self._token_window[0][0] >= self._window_seconds:
+            _, tokens = self._token_window.popleft()
+            self._window_tokens -= tokens
+
+    def _can_admit(self, tokens: int) -> bool:
+        """Checks if a request fits in the in-flight limit and in the token budget."""
+
+        if self._in_flight >= self.max_in_flight:
+            return False
+        if self.tokens_per_minute <= 0:
+            return True
+        self._expire_tokens(time.monotonic())
+        # A request larger than the whole budget is still admitted on an empty window
+        return not self._token_window or self._window_tokens + tokens <= self.tokens_per_minute
+
+    def _admit(self, priority: RequestPriority, tokens: int, wait: float) -> list | None:
+        """Takes an in-flight slot and the tokens of an admitted request.
+
+        Returns:
+
+        The request's entry in the token window, None if the budget is disabled.
+        """
+
+        self._in_flight += 1
+        entry = None
+        if self.tokens_per_minute > 0:
+            entry = [time.monotonic(), tokens]
+            self._token_window.append(entry)
+            self._window_tokens += tokens
+
+        self._admitted[priority] += 1
+        self._total_wait[priority] += wait
+        self._max_wait[priority] = max(self._max_wait[priority], wait)
+        return entry
+
+    def _refund(self, entry: list | None) -> None:
+        """Gives back the tokens of an admitted request to the budget."""
+
+        if entry is None or entry[1] == 0:
+            return
+        # Already dropped if it's older than the window
+        if any(window_entry is entry for window_entry in self._token_window):
+            self._window_tokens -= entry[1]
+        entry[1] = 0
+
+    def _dispatch(self) -> None:
+        """Admits the waiting requests that fit, highest priority first."""
+
+        while self._waiters:
+            priority, _, future, tokens, enqueued_at = self._waiters[0]
+            if future.done():
+                # Cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+            if not self._can_admit(tokens):
+                break
+            heapq.heappop(self._waiters)
+            future.set_result(
+                self._admit(RequestPriority(priority), tokens, time.monotonic() - enqueued_at)
+            )
+
+        self._schedule_wakeup()
+
+    def _schedule_wakeup(self) -> None:
+        """Retries the dispatch when the token budget frees up, if requests are blocked only by the budget."""
+
+        loop = asyncio.get_running_loop()
+        if self._wakeup is not None and self._wakeup_loop is loop:
+            return
+        if not self._waiters or not self._token_window:
+            return
+        if self._in_flight >= self.max_in_flight:
+            # A release will dispatch them
+            return
+
+        delay = self._token_window[0][0] + self._window_seconds - time.monotonic()
+        self._wakeup = loop.call_later(max(delay, 0), self._on_wakeup)
+        self._wakeup_loop = loop
+
+    def _on_wakeup(self) -> None:
+        self._wakeup = None
+        self._dispatch()
+
+    async def acquire(self, priority: RequestPriority, tokens: int = 0) -> float:
+        """Waits until the request is admitted.
+
+        Args:
+
+        priority: The priority class of the request.
+        tokens: The number of tokens the request is expected to use.
+
+        Returns:
+
+        The time the request waited in the queue, in seconds.
+        """
+
+        wait, _ = await self._acquire(priority, tokens)
+        return wait
+
+    async def _acquire(self, priority: RequestPriority, tokens: int) -> tuple[float, list | None]:
+        """Waits until the request is admitted, returning its wait and its entry in the token window."""
+
+        if not self._waiters and self._can_admit(tokens):
+            return 0.0, self._admit(priority, tokens, 0.0)
+
+        future = asyncio.get_running_loop().create_future()
+        enqueued_at = time.monotonic()
+        heapq.heappush(
+            self._waiters, (int(priority), next(self._sequence), future, tokens, enqueued_at)
+        )
+        self._schedule_wakeup()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Admitted right before being cancelled
+                self.release()
+            else:
+                # Lets the requests queued behind it be admitted
+                self._dispatch()
+            raise
+
+        return time.monotonic() - enqueued_at, future.result()
+
+    def release(self) -> None:
+        """Frees the in-flight slot of a finished request."""
+
+        self._in_flight -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def admit(self, priority: RequestPriority, tokens: int = 0, refund_on_cancel: bool = False):
+        """Holds an in-flight slot for the duration of the context.
+
+        Args:
+
+        priority: The priority class of the request.
+        tokens: The number of tokens the request is expected to use.
+        refund_on_cancel: Whether the tokens are given back to the budget if the context is cancelled,
+            for speculative requests whose result may be discarded.
+        """
+
+        _, entry = await self._acquire(priority, tokens)
+        try:
+            yield
+        except asyncio.CancelledError:
+            if refund_on_cancel:
+                self._refund(entry)
+            raise
+        finally:
+            self.release()
+
+    def get_metrics(self) -> dict:
+        """Gets the queue metrics.
+
+        Returns:
+
+        A dict with the in-flight count, the queue depth (total and per priority class),
+        the tokens used in the current window and, per priority class, the number of
+        admitted requests and their average and maximum queue wait in seconds.
+        """
+
+        self._expire_tokens(time.monotonic())
+        queued = [waiter for waiter in self._waiters if not waiter[2].done()]
+
+        return {
+            "in_flight": self._in_flight,
+            "queue_depth": len(queued),
+            "queue_depth_by_priority": {
+                priority.name: sum(1 for waiter in queued if waiter[0] == priority)
+                for priority in RequestPriority
+            },
+            "window_tokens": self._window_tokens,
+            "admitted": {priority.name: self._admitted[priority] for priority in RequestPriority},
+            "average_wait": {
+                priority.name: (
+                    self._total_wait[priority] / self._admitted[priority]
+                    if self._admitted[priority]
+                    else 0.0
+                )
+                for priority in RequestPriority
+            },
+            "max_wait": {priority.name: self._max_wait[priority] for priority in RequestPriority},
+        }
@@ -0,0 +1,252 @@
+from typing import Iterator
+
+from ..schemas import Product
+from .catalog_store import CatalogStore
+from .product_handler import ProductHandler
+
+
+class CartItem:
+    """A line of the cart: a catalog product and its number of units."""
+
+    __slots__ = ("row_id", "product_name", "number_of_units", "price_per_unit", "volume_per_unit")
+
+    def __init__(self, product: Product, number_of_units: int):
+        """
+        Args:
+
+        product: The catalog product.
+        number_of_units: The number of units of the product.
+        """
+        self.row_id: int = product["row_id"]
+        self.product_name: str = product["product_name"]
+        self.number_of_units: int = number_of_units
+        self.price_per_unit: float = round(product["full_price"], 2)
+        self.volume_per_unit: float = ProductHandler._unit_volume_liters
+
+    def to_dict(self) -> dict:
+        """Gets the item with its product's data.
+
+        Returns:
+
+        Dict with the product_name, number_of_units, price_per_unit and volume_per_unit of the item.
+        """
+        return {
+            "product_name": self.product_name,
+            "number_of_units": self.number_of_units,
+            "price_per_unit": self.price_per_unit,
+            "volume_per_unit": self.volume_per_unit,
+        }
+
+
+class Cart:
+    """The user's cart, with its items keyed by row_id.
+
+    The total units, volume and price are kept up to date as items are added and removed,
+    so limit checks and summaries don't go over the items. Only the row_id and the number
+    of units of each item are stored; the products' data is resolved against the catalog
+    when the cart is loaded.
+
+    Every change bumps the cart's version. The rendered summary is stored along with the
+    cart and dropped when the version changes, so it's only rendered again after a change.
+    """
+
+    __slots__ = ("_items", "_total_units", "_total_volume", "_total_price", "_version", "_summary")
+
+    def __init__(self):
+        self._items: dict[int, CartItem] = {}
+        self._total_units: int = 0
+        self._total_volume: float = 0
+        self._total_price: float = 0
+        self._version: int = 0
+        # (catalog fingerprint, text) of the summary rendered for the current version
+        self._summary: tuple[str, str] | None = None
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self) -> Iterator[CartItem]:
+        return iter(self._items.values())
+
+    def __contains__(self, row_id: int) -> bool:
+        return row_id in self._items
+
+    @property
+    def total_units(self) -> int:
+        return self._total_units
+
+    @property
+    def total_volume(self) -> float:
+        return self._total_volume
+
+    @property
+    def total_price(self) -> float:
+        return self._total_price
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def get_summary(self) -> str | None:
+        """Gets the summary rendered for the current version of the cart.
+
+        Returns:
+
+        The summary or None, if it was not rendered yet or the catalog changed since.
+        """
+        return Cart._get_valid_summary(self._summary)
+
+    def set_summary(self, summary: str) -> None:
+        """Sets the summary rendered for the current version of the cart.
+
+        Args:
+
+        summary: The rendered summary.
+        """
+        self._summary = (CatalogStore.get_fingerprint(), summary)
+
+    @staticmethod
+    def _get_valid_summary(summary: tuple[str, str] | list | None) -> str | None:
+        # Prices come from the catalog, so summaries rendered from another catalog are stale.
+        # Its fingerprint is stored, as the stored cart outlives the process and is read by every worker.
+        if summary is None or summary[0] != CatalogStore.get_fingerprint():
+            return None
+        return summary[1]
+
+    @staticmethod
+    def get_stored_summary(data: dict | list) -> str | None:
+        """Gets the summary stored along with a cart, without loading the cart.
+
+        Args:
+
+        data: The stored cart.
+
+        Returns:
+
+        The summary or None, if it was not rendered for the current version of the cart and catalog.
+        """
+
+        if not isinstance(data, dict):
+            return None
+        return Cart._get_valid_summary(data.get("summary"))
+
+    def _changed(self) -> None:
+        self._version += 1
+        self._summary = None
+
+    def get_units(self, row_id: int) -> int:
+        """Gets the number of units of a product in the cart, 0 if it's not in the cart."""
+
+        item = self._items.get(row_id)
+        return item.number_of_units if item is not None else 0
+
+    def _update_totals(self, item: CartItem, number_of_units: int) -> None:
+        self._total_units += number_of_units
+        self._total_volume += item.volume_per_unit * number_of_units
+        self._total_price += item.price_per_unit * number_of_units
+
+    def add(self, product: Product, number_of_units: int) -> None:
+        """Adds units of a product to the cart.
+
+        Args:
+
+        product: The catalog product.
+        number_of_units: The number of units to add.
+        """
+
+        item = self._items.get(product["row_id"])
+        if item is None:
+            item = self._items[product["row_id"]] = CartItem(product, 0)
+        item.number_of_units += number_of_units
+        self._update_totals(item, number_of_units)
+        self._changed()
+
+    def remove(self, row_id: int, number_of_units: int) -> int:
+        """Removes units of a product from the cart, removing its item if no units are left.
+
+        Args:
+
+        row_id: The row_id of the product.
+        number_of_units: The number of units to remove.
+
+        Returns:
+
+        The number of units removed, which is less than the requested if the cart had fewer.
+        """
+
+        item = self._items.get(row_id)
+        if item is None or number_of_units <= 0:
+            return 0
+
+        removed_units = min(number_of_units, item.number_of_units)
+        item.number_of_units -= removed_units
+        self._update_totals(item, -removed_units)
+
+        if item.number_of_units <= 0:
+            del self._items[row_id]
+        if not self._items:
+            # Avoids float errors accumulated over the additions and removals
+            self._total_volume = 0
+            self._total_price = 0
+
+        self._changed()
+        return removed_units
+
+    def to_dict(self) -> dict:
+        """Gets the cart as it's stored.
+
+        Returns:
+
+        Dict with the [row_id, number_of_units] pairs of the items, in the order they were added,
+        the cart's version and its summary, if it was rendered.
+        """
+
+        data = {
+            "items": [[item.row_id, item.number_of_units] for item in self._items.values()],
+            "version": self._version,
+        }
+        if self._summary is not None:
+            data["summary"] = list(self._summary)
+        return data
+
+    @staticmethod
+    def from_dict(data: dict | list) -> "Cart":
+        """Loads a stored cart, resolving its products against the catalog.
+
+        Args:
+
+        data: The stored cart. Lists of items stored by older versions, as row_id references
+        or with the products' data, are converted too.
+
+        Returns:
+
+        The cart. Items whose product is no longer in the catalog are left out.
+        """
+
+        if isinstance(data, dict):
+            items = data.get("items", [])
+        else:
+            items = [
+                (item["row_id"], item["number_of_units"])
+                if "row_id" in item
+                else (item["product_name"], item["number_of_units"])
+                for item in data
+            ]
+
+        cart = Cart()
+        for product_key, number_of_units in items:
+            if isinstance(product_key, str):
+                product = CatalogStore.get_by_name(product_key)
+            else:
+                product = CatalogStore.get_by_row_id(product_key)
+            if product is not None and number_of_units > 0:
+                cart.add(product, number_of_units)
+
+        # Loading is not a change
+        if isinstance(data, dict):
+            cart._version = data.get("version", 0)
+            summary = data.get("summary")
+            cart._summary = tuple(summary) if summary is not None else None
+        else:
+            cart._version = 0
+
+        return cart
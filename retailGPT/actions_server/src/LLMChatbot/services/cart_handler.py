@@ -1,12 +1,16 @@
 from typing import List
 
+from ..schemas import Product
+from .cart import Cart
+from .catalog_store import CatalogStore
 from .database import Database
 from .product_handler import ProductHandler
 
 
 class CartHandler:
     """
-    Manages the user's cart, which is a list of products.
+    Manages the user's cart, which holds references to catalog products by row_id.
+    Product names and prices are resolved against the catalog when the cart is read.
     """
 
     _max_volume_liters: float = 5  # Reduced for sunglasses (5 pairs max)
@@ -19,9 +23,10 @@ class CartHandler:
         "The number of units to remove is greater than the number of units in the cart. Therefore, this operation only completely removed the product."
     )
     _successful_addition_message: str = "Product successfully added to the cart!"
+    _not_recommended_message: str = "The product was not recommended to the user, so it was not added to the cart."
 
     @staticmethod
-    def _set_cart(user_id: str, cart: dict) -> None:
+    async def _set_cart(user_id: str, cart: Cart) -> None:
         """
         Sets the user's cart.
 
@@ -30,12 +35,10 @@ class CartHandler:
         user_id: The user's ID.
         cart: The user's cart.
         """
-        user_data = Database.get_data(user_id)
-        user_data["cart"] = cart
-        Database.set_data(user_id, user_data)
+        await Database.set_field(user_id, "cart", cart.to_dict())
 
     @staticmethod
-    def _get_cart(user_id: str) -> List:
+    async def _get_cart(user_id: str) -> Cart:
         """
         Gets the user's cart.
 
@@ -45,45 +48,83 @@ class CartHandler:
 
         Returns:
 
-        List of Products representing the user's cart.
+        The user's cart.
         """
-        user_data = Database.get_data(user_id)
-        cart = []
-        if "cart" in user_data:
-            cart = user_data["cart"]
-        return cart
+        return Cart.from_dict(await Database.get_field(user_id, "cart", {}))
 
     @staticmethod
-    def get_cart_summary(user_id: str) -> str:
-        """Formats the cart's dict into a string summary.
+    async def get_resolved_cart(user_id: str) -> List[dict]:
+        """
+        Gets the user's cart with the products' data resolved from the catalog.
 
         Args:
 
-        cart: The user's cart.
+        user_id: The user's ID.
+
+        Returns:
+
+        List with the product_name, number_of_units, price_per_unit and volume_per_unit of each item.
+        """
+
+        cart = await CartHandler._get_cart(user_id)
+        return [item.to_dict() for item in cart]
+
+    @staticmethod
+    async def get_cart_summary(user_id: str) -> str:
+        """Gets the cart's summary, rendering it only if the cart changed since it was last rendered.
+
+        Args:
+
+        user_id: The user's ID.
 
         Returns:
 
         Summary of the cart's content.
         """
 
-        cart_total_price = 0
-        cart_total_volume_liters = 0
-        summary = "Your cart summary:\n"
+        stored_cart = await Database.get_field(user_id, "cart", {})
+        summary = Cart.get_stored_summary(stored_cart)
+        if summary is not None:
+            return summary
 
-        cart = CartHandler._get_cart(user_id)
-        for product in cart:
+        cart = Cart.from_dict(stored_cart)
+        summary = CartHandler._render_cart_summary(cart)
 
-            # TODO: Retrieve product by ID instead of name
-            product_name = product["product_name"]
-            number_of_units = product["number_of_units"]
-            price_per_unit = product["price_per_unit"]
-            volume_per_unit = product["volume_per_unit"]
+        # Empty carts are not worth storing
+        if len(cart) > 0:
+            version = cart.version
 
-            product_volume = volume_per_unit * number_of_units
-            cart_total_volume_liters += product_volume
+            def store_summary(stored_cart: dict | list) -> dict | list:
+                stored_cart = Cart.from_dict(stored_cart)
+                # Unless the cart changed meanwhile, as the summary would be stale
+                if stored_cart.version == version:
+                    stored_cart.set_summary(summary)
+                return stored_cart.to_dict()
 
-            total_product_price = price_per_unit * number_of_units
-            cart_total_price += total_product_price
+            await Database.update_field(user_id, "cart", store_summary, {})
+
+        return summary
+
+    @staticmethod
+    def _render_cart_summary(cart: Cart) -> str:
+        """Formats the cart into a string summary.
+
+        Args:
+
+        cart: The user's cart.
+
+        Returns:
+
+        Summary of the cart's content.
+        """
+
+        summary = "Your cart summary:\n"
+
+        for item in cart:
+
+            product_name = item.product_name
+            number_of_units = item.number_of_units
+            price_per_unit = item.price_per_unit
 
             summary += f"- {product_name}, "
             if number_of_units > 1:
@@ -92,14 +133,14 @@ class CartHandler:
             else:
                 summary += f"1 unit, at R${price_per_unit:.2f}  \n"
 
-        summary += f"Total cart value: R${cart_total_price:.2f}  \n"
-        summary += f"Total cart volume: {round(cart_total_volume_liters, 3)}L (máximo {CartHandler._max_volume_liters} pares)\n"
+        summary += f"Total cart value: R${cart.total_price:.2f}  \n"
+        summary += f"Total cart volume: {round(cart.total_volume, 3)}L (máximo {CartHandler._max_volume_liters} pares)\n"
         summary += f"💳 Métodos de pago disponibles: MercadoPago, Tarjeta de Crédito, Débito, Efectivo"
 
         return summary
 
     @staticmethod
-    def get_should_send_cart_summary(user_id: str) -> bool:
+    async def get_should_send_cart_summary(user_id: str) -> bool:
         """
         Gets the flag that indicates if the cart summary should be sent to the user.
 
@@ -111,14 +152,10 @@ class CartHandler:
 
         The flag that indicates if the cart summary should be sent to the user.
         """
-        user_data = Database.get_data(user_id)
-        should_send_cart_summary = False
-        if "should_send_cart_summary" in user_data:
-            should_send_cart_summary = user_data["should_send_cart_summary"]
-        return should_send_cart_summary
+        return await Database.get_field(user_id, "should_send_cart_summary", False)
 
     @staticmethod
-    def set_should_send_cart_summary(
+    async def set_should_send_cart_summary(
         user_id: str, should_send_cart_summary: bool
     ) -> None:
         """
@@ -129,15 +166,13 @@ class CartHandler:
         user_id: The user's ID.
         should_send_cart_summary: The flag that indicates if the cart summary should be sent to the user.
         """
-        user_data = Database.get_data(user_id)
-        user_data["should_send_cart_summary"] = should_send_cart_summary
-        Database.set_data(user_id, user_data)
+        await Database.set_field(user_id, "should_send_cart_summary", should_send_cart_summary)
 
     @staticmethod
-    def process_cart_operation(
+    async def process_cart_operation(
         user_id: str, operation: str, product_name: str, number_of_units: int
     ) -> str:
-        """Processes a cart operation.
+        """Processes a cart operation, as a batch of one operation of process_cart_operations.
 
         Args:
 
@@ -148,61 +183,73 @@ class CartHandler:
 
         Returns:
 
-        Summary of the operation result and the current state of the cart.
+        Summary of the operation result.
         """
 
-        cart = CartHandler._get_cart(user_id)
-
-        if operation == "add":
-            output_string = CartHandler._process_addition(
-                user_id, cart, product_name, number_of_units
-            )
-        elif operation == "remove":
-            output_string = CartHandler._process_removal(
-                cart, product_name, number_of_units
-            )
-        else:
-            output_string = "Invalid operation"
-
-        CartHandler._set_cart(user_id, cart)
-
-        return output_string
+        results = await CartHandler.process_cart_operations(
+            user_id, [(operation, product_name, number_of_units)]
+        )
+        if results[0] is None:
+            return CartHandler._not_recommended_message
+        return results[0]
 
     @staticmethod
-    def _add_to_cart(
-        cart: List[dict],
-        product_name: str,
-        number_of_units: int,
-        price_per_unit: float,
-        volume_per_unit: float,
-    ) -> None:
-        """Updates the cart list with the addition of a product.
+    async def process_cart_operations(
+        user_id: str, operations: List[tuple[str, str, int]]
+    ) -> List[str | None]:
+        """Processes a sequence of cart operations, in order, writing the cart once.
+        Additions are checked against the products recommended to the user, and the ones
+        that were not recommended are not applied. If any operation is applied, the flag
+        to send the cart summary is set in the same write.
 
         Args:
 
-        cart: The user's cart.
-        product_name: The product to be added to the cart.
-        number_of_units: The amount of the product to be added to the cart.
-        price_per_unit: The price of the product per unit.
-        volume_per_unit: The volume of the product per unit.
+        user_id: The user's ID.
+        operations: The (operation, product_name, number_of_units) of each operation.
+
+        Returns:
+
+        Summary of the result of each operation, or None for additions of products that were not recommended.
         """
 
-        if any(product_name == product["product_name"] for product in cart):
-            for product in cart:
-                if product["product_name"] == product_name:
-                    product["number_of_units"] += number_of_units
-        else:
-            cart.append(
-                {
-                    "product_name": product_name,
-                    "number_of_units": number_of_units,
-                    "price_per_unit": price_per_unit,
-                    "volume_per_unit": volume_per_unit,
-                }
-            )
+        results = []
+
+        def apply_operations(data: dict) -> dict:
+            # Runs again if the cart changes concurrently, so the results match the stored cart
+            nonlocal results
+            results = []
+            cart = Cart.from_dict(data.get("cart", {}))
+            stored_recommendations = data.get("recommended_products", {})
+            recommended_products = ProductHandler.index_recommendations(stored_recommendations)
+
+            for operation, product_name, number_of_units in operations:
+                if operation == "add":
+                    product = ProductHandler.find_recommended_product(recommended_products, product_name)
+                    if product is None:
+                        results.append(None)
+                    else:
+                        results.append(CartHandler._add_product(cart, product, number_of_units))
+                elif operation == "remove":
+                    results.append(CartHandler._process_removal(cart, product_name, number_of_units))
+                else:
+                    results.append("Invalid operation")
+
+            if all(result is None for result in results):
+                return {}
+            fields = {"cart": cart.to_dict(), "should_send_cart_summary": True}
+            if recommended_products is not stored_recommendations:
+                # Converted from an older version's format, so it's only converted once
+                fields["recommended_products"] = recommended_products
+            return fields
+
+        await Database.update_fields(
+            user_id, ["cart", "recommended_products", "should_send_cart_summary"], apply_operations
+        )
+
+        return results
 
     @staticmethod
-    def _max_volume_exceeded(cart: List[dict], additional_volume: float) -> bool:
+    def _max_volume_exceeded(cart: Cart, additional_volume: float) -> bool:
         """
         Checks if the addition of a product to the cart would exceed the maximum volume allowed.
 
@@ -215,17 +262,10 @@ class CartHandler:
 
         True if the addition would exceed the maximum volume allowed, False otherwise.
         """
-        total_volume = additional_volume
-
-        for product in cart:
-            total_volume += product["volume_per_unit"] * product["number_of_units"]
-
-        return total_volume > CartHandler._max_volume_liters
+        return cart.total_volume + additional_volume > CartHandler._max_volume_liters
 
     @staticmethod
-    def _get_max_allowed_units(
-        cart: List[dict], additional_volume_per_unit: float
-    ) -> int:
+    def _get_max_allowed_units(cart: Cart, additional_volume_per_unit: float) -> int:
         """
         Gets the maximum number of units of a product that can be added to the cart.
 
@@ -239,25 +279,19 @@ class CartHandler:
         The maximum number of units of a product that can be added to the cart.
         """
 
-        current_volume = 0
-        for product in cart:
-            current_volume += product["volume_per_unit"] * product["number_of_units"]
-        remaining_volume = CartHandler._max_volume_liters - current_volume
+        remaining_volume = CartHandler._max_volume_liters - cart.total_volume
         max_units = remaining_volume // additional_volume_per_unit
         return int(max_units)
 
     @staticmethod
-    def _process_addition(
-        user_id: str, cart: dict, product_name: str, number_of_units: int
-    ) -> str:
+    def _add_product(cart: Cart, product: Product, number_of_units: int) -> str:
         """
-        Processes the addition of a product to the user's cart.
+        Adds a product to the cart, adjusting the number of units to the volume limit.
 
         Args:
 
-        user_id: The user's ID.
         cart: The user's cart.
-        product_name: The product to be added to the cart.
+        product: The catalog product to be added to the cart.
         number_of_units: The amount of the product to be added to the cart.
 
         Returns:
@@ -265,8 +299,7 @@ class CartHandler:
         Summary of the operation result.
         """
 
-        price_per_unit = ProductHandler.get_product_unit_price(user_id, product_name)
-        volume_per_unit = ProductHandler.get_product_unit_volume(user_id, product_name)
+        volume_per_unit = ProductHandler._unit_volume_liters
 
         additional_volume = volume_per_unit * number_of_units
 
@@ -284,14 +317,12 @@ class CartHandler:
             output_string = CartHandler._successful_addition_message
 
         if number_of_units > 0:
-            CartHandler._add_to_cart(
-                cart, product_name, number_of_units, price_per_unit, volume_per_unit
-            )
+            cart.add(product, number_of_units)
 
         return output_string
 
     @staticmethod
-    def _process_removal(cart: dict, product_name: str, number_of_units: int) -> str:
+    def _process_removal(cart: Cart, product_name: str, number_of_units: int) -> str:
         """
         Processes the removal of a product from the user's cart.
 
@@ -306,21 +337,18 @@ class CartHandler:
         Summary of the operation result.
         """
 
-        output_string = "Product not found in the cart."
-        for product in cart:
-            if product["product_name"] == product_name:
-                product["number_of_units"] -= number_of_units
-                if product["number_of_units"] <= 0:
-                    cart.remove(product)
-                if product["number_of_units"] < 0:
-                    output_string = CartHandler._below_zero_removal_message
-                else:
-                    output_string = CartHandler._successful_removal_message
+        product = CatalogStore.get_by_name(product_name)
+        if product is None or product["row_id"] not in cart:
+            return "Product not found in the cart."
 
-        return output_string
+        removed_units = cart.remove(product["row_id"], number_of_units)
+        if removed_units < number_of_units:
+            return CartHandler._below_zero_removal_message
+
+        return CartHandler._successful_removal_message
 
     @staticmethod
-    def set_should_finish_purchase(user_id: str, should_finish_purchase: bool) -> None:
+    async def set_should_finish_purchase(user_id: str, should_finish_purchase: bool) -> None:
         """
         Sets the flag that indicates if the purchase should be finished.
 
@@ -329,12 +357,10 @@ class CartHandler:
         user_id: The user's ID.
         should_finish_purchase: The flag that indicates if the purchase should be finished.
         """
-        user_data = Database.get_data(user_id)
-        user_data["should_finish_purchase"] = should_finish_purchase
-        Database.set_data(user_id, user_data)
+        await Database.set_field(user_id, "should_finish_purchase", should_finish_purchase)
 
     @staticmethod
-    def get_should_finish_purchase(user_id: str) -> bool:
+    async def get_should_finish_purchase(user_id: str) -> bool:
         """
         Gets the flag that indicates if the purchase should be finished.
 
@@ -346,8 +372,4 @@ class CartHandler:
 
         The flag that indicates if the purchase should be finished.
         """
-        user_data = Database.get_data(user_id)
-        should_finish_purchase = False
-        if "should_finish_purchase" in user_data:
-            should_finish_purchase = user_data["should_finish_purchase"]
-        return should_finish_purchase
+        return await Database.get_field(user_id, "should_finish_purchase", False)
@@ -0,0 +1,201 @@
+import hashlib
+import json
+from pathlib import Path
+
+from ..schemas import Product
+
+
+class CatalogStore:
+    """Process-wide, in-memory store of the sunglasses catalog.
+
+    The catalog is read from disk once and kept in memory along with lookup
+    indexes, so the search, formatting and cart paths never touch the
+    dataset file on the request path.
+    """
+
+    _catalog_path: Path = (
+        Path(__file__).resolve().parent.parent.parent.parent.parent
+        / "datasets"
+        / "sunglasses_products.json"
+    )
+
+    _products: list[Product] = []
+    _by_row_id: dict[int, Product] = {}
+    _by_name: dict[str, Product] = {}
+    _by_brand: dict[str, list[Product]] = {}
+    _by_style: dict[str, list[Product]] = {}
+
+    # Dataset file the catalog was loaded from, None if the products were given directly
+    _source_path: Path | None = None
+
+    # Incremented every time the catalog is (re)loaded, so derived caches can be invalidated.
+    _version: int = 0
+    # Hash of the catalog's content, the same in every process that loads the same products.
+    _fingerprint: str = ""
+
+    @staticmethod
+    def normalize_key(value: str) -> str:
+        """Normalizes a lookup key (product name, brand or style).
+
+        Args:
+
+        value: The raw key.
+
+        Returns:
+
+        The lower-cased, stripped key.
+        """
+        return value.strip().lower()
+
+    @staticmethod
+    def load_products(products: list[Product]) -> None:
+        """Replaces the catalog with the given products and rebuilds every index.
+
+        Args:
+
+        products: The products that make up the catalog, in catalog order.
+        """
+
+        by_row_id = {}
+        by_name = {}
+        by_brand = {}
+        by_style = {}
+
+        for product in products:
+            by_row_id[product["row_id"]] = product
+            by_name[CatalogStore.normalize_key(product["product_name"])] = product
+            by_brand.setdefault(
+                CatalogStore.normalize_key(product["brand"]), []
+            ).append(product)
+            by_style.setdefault(
+                CatalogStore.normalize_key(product["style"]), []
+            ).append(product)
+
+        CatalogStore._products = list(products)
+        CatalogStore._by_row_id = by_row_id
+        CatalogStore._by_name = by_name
+        CatalogStore._by_brand = by_brand
+        CatalogStore._by_style = by_style
+        CatalogStore._source_path = None
+        CatalogStore._version += 1
+        CatalogStore._fingerprint = hashlib.sha256(
+            json.dumps(products, sort_keys=True).encode("utf-8")
+        ).hexdigest()[:16]
+
+    @staticmethod
+    def load(path: Path | str | None = None) -> None:
+        """Loads the catalog from the products dataset.
+
+        Args:
+
+        path: Path of the products dataset. Defaults to the sunglasses dataset.
+        """
+
+        if path is None:
+            path = CatalogStore._catalog_path
+
+        with open(path, "r", encoding="utf-8") as file:
+            dataset = json.load(file)
+
+        CatalogStore.load_products(dataset["products"])
+        CatalogStore._source_path = Path(path)
+
+    @staticmethod
+    def get_version() -> int:
+        """Gets the version of the loaded catalog.
+
+        Returns:
+
+        A counter that changes every time the catalog is reloaded.
+        """
+        return CatalogStore._version
+
+    @staticmethod
+    def get_fingerprint() -> str:
+        """Gets the fingerprint of the loaded catalog's content.
+
+        Returns:
+
+        A hash that only changes when the products change, unlike the version it survives restarts
+        and is shared by every worker, so it can key data stored outside the process.
+        """
+        return CatalogStore._fingerprint
+
+    @staticmethod
+    def get_source_path() -> Path | None:
+        """Gets the dataset file the catalog was loaded from.
+
+        Returns:
+
+        The path of the dataset or None, if the products were loaded directly.
+        """
+        return CatalogStore._source_path
+
+    @staticmethod
+    def get_products() -> list[Product]:
+        """Gets all the products in the catalog.
+
+        Returns:
+
+        The list of products, in catalog order.
+        """
+        return CatalogStore._products
+
+    @staticmethod
+    def get_by_row_id(row_id: int) -> Product | None:
+        """Gets a product by its ID.
+
+        Args:
+
+        row_id: The ID of the product.
+
+        Returns:
+
+        The product or None, if it doesn't exist in the catalog.
+        """
+        return CatalogStore._by_row_id.get(row_id)
+
+    @staticmethod
+    def get_by_name(product_name: str) -> Product | None:
+        """Gets a product by its name, ignoring case.
+
+        Args:
+
+        product_name: The name of the product.
+
+        Returns:
+
+        The product or None, if it doesn't exist in the catalog.
+        """
+        return CatalogStore._by_name.get(CatalogStore.normalize_key(product_name))
+
+    @staticmethod
+    def get_by_brand(brand: str) -> list[Product]:
+        """Gets all the products of a brand, ignoring case.
+
+        Args:
+
+        brand: The brand of the sunglasses.
+
+        Returns:
+
+        The list of products of the brand, in catalog order.
+        """
+        return CatalogStore._by_brand.get(CatalogStore.normalize_key(brand), [])
+
+    @staticmethod
+    def get_by_style(style: str) -> list[Product]:
+        """Gets all the products of a style, ignoring case.
+
+        Args:
+
+        style: The style of the sunglasses.
+
+        Returns:
+
+        The list of products of the style, in catalog order.
+        """
+        return CatalogStore._by_style.get(CatalogStore.normalize_key(style), [])
+
+
+CatalogStore.load()
@@ -1,41 +1,685 @@
-import json
+import asyncio
+import inspect
+import os
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Iterable
 
-import redis
+import redis.asyncio as redis
+from redis.asyncio.client import Pipeline
+from redis.exceptions import ResponseError, WatchError
+
+from .memory_backend import InMemoryBackend
+from .serialization import Codec
+
+# Takes the stored fields and returns the changed ones
+FieldsUpdate = Callable[[dict], dict | Awaitable[dict]]
+
+
+class ConcurrentUpdateError(Exception):
+    """Raised when an atomic update keeps conflicting with concurrent writes."""
 
 
 class Database:
     """Class that handles the interaction with the database."""
 
-    _redis = redis.Redis(host="localhost", port=6379, decode_responses=True)
+    # "redis", or "memory" to keep the data in the process, e.g. for tests, benchmarks and single-node deployments
+    _backend: str = os.environ.get("DATABASE_BACKEND", "redis")
+    # Limits of the in-memory backend: maximum keys before evicting the least recently used ones (0 = no limit)
+    # and path of its append-only snapshot file (empty = no snapshot)
+    _memory_max_keys: int = int(os.environ.get("DATABASE_MEMORY_MAX_KEYS", 0))
+    _memory_snapshot_path: str | None = os.environ.get("DATABASE_MEMORY_SNAPSHOT_PATH") or None
+    _redis_url: str | None = os.environ.get("REDIS_URL")
+    _redis_host: str = os.environ.get("REDIS_HOST", "localhost")
+    _redis_port: int = int(os.environ.get("REDIS_PORT", 6379))
+    _redis_db: int = int(os.environ.get("REDIS_DB", 0))
+    _pool_size: int = int(os.environ.get("REDIS_POOL_SIZE", 50))
+    # Maximum time waiting for a free connection when the pool is exhausted, in seconds
+    _pool_timeout: float = float(os.environ.get("REDIS_POOL_TIMEOUT", 5))
+    # Encoding of the stored values. Records written with any other codec can still be read.
+    _codec: Codec = Codec(
+        serializer=os.environ.get("DATABASE_CODEC", "json"),
+        compression=os.environ.get("DATABASE_COMPRESSION", "none"),
+        compression_threshold=int(os.environ.get("DATABASE_COMPRESSION_THRESHOLD", 1024)),
+    )
+    # Seconds each field is kept after the user's last activity. 0 keeps the field forever.
+    _default_ttl: int = int(os.environ.get("DATABASE_TTL_DEFAULT", 7 * 24 * 60 * 60))
+    _field_ttls: dict[str, int] = {
+        "tool_calls": int(os.environ.get("DATABASE_TTL_TOOL_CALLS", 60 * 60)),
+        "history": int(os.environ.get("DATABASE_TTL_HISTORY", 7 * 24 * 60 * 60)),
+        "summary": int(os.environ.get("DATABASE_TTL_HISTORY", 7 * 24 * 60 * 60)),
+        "recommended_products": int(os.environ.get("DATABASE_TTL_RECOMMENDED_PRODUCTS", 7 * 24 * 60 * 60)),
+        "cart": int(os.environ.get("DATABASE_TTL_CART", 30 * 24 * 60 * 60)),
+        "should_send_cart_summary": int(os.environ.get("DATABASE_TTL_FLAGS", 24 * 60 * 60)),
+        "should_finish_purchase": int(os.environ.get("DATABASE_TTL_FLAGS", 24 * 60 * 60)),
+    }
+
+    # Fields stored as a Redis list with one record per item, so items can be appended without rewriting them
+    _list_fields: frozenset[str] = frozenset({"history"})
+
+    # Attempts of an atomic update before giving up on concurrent writes
+    _max_update_attempts: int = int(os.environ.get("REDIS_MAX_UPDATE_ATTEMPTS", 10))
+
+    # Connections are bound to the event loop they were opened on, so the client is created lazily
+    _redis: redis.Redis | None = None
+    _redis_loop: asyncio.AbstractEventLoop | None = None
+    # The in-memory backend outlives the client closing, as a server's data would
+    _memory: InMemoryBackend | None = None
+
+    # UserSession of the running turn, see user_session.py
+    _session: ContextVar = ContextVar("user_session", default=None)
+
+    @staticmethod
+    def _create_pool() -> redis.BlockingConnectionPool:
+        """Creates the connection pool from the environment configuration.
+        REDIS_URL takes precedence over REDIS_HOST, REDIS_PORT and REDIS_DB.
+
+        Returns:
+
+        A pool that makes callers wait for a free connection instead of failing when it's exhausted.
+        """
+
+        if Database._redis_url:
+            return redis.BlockingConnectionPool.from_url(
+                Database._redis_url,
+                max_connections=Database._pool_size,
+                timeout=Database._pool_timeout,
+                decode_responses=False,
+            )
+
+        return redis.BlockingConnectionPool(
+            host=Database._redis_host,
+            port=Database._redis_port,
+            db=Database._redis_db,
+            max_connections=Database._pool_size,
+            timeout=Database._pool_timeout,
+            decode_responses=False,
+        )
+
+    @staticmethod
+    def get_client() -> redis.Redis | InMemoryBackend:
+        """Gets the process-wide Redis client, creating it lazily on the running loop.
+
+        Returns:
+
+        The shared client, backed by the connection pool, or the in-memory backend if configured.
+        """
+
+        if Database._backend == "memory":
+            if Database._memory is None:
+                Database._memory = InMemoryBackend(
+                    max_keys=Database._memory_max_keys,
+                    snapshot_path=Database._memory_snapshot_path,
+                )
+            return Database._memory
+
+        loop = asyncio.get_running_loop()
+
+        if Database._redis is None or Database._redis_loop is not loop:
+            Database._redis = redis.Redis(connection_pool=Database._create_pool())
+            Database._redis_loop = loop
+
+        return Database._redis
+
+    @staticmethod
+    async def close() -> None:
+        """Closes the Redis client and disconnects its connection pool."""
+
+        if Database._memory is not None:
+            await Database._memory.aclose()
+
+        client = Database._redis
+        Database._redis = None
+        Database._redis_loop = None
+        if client is not None:
+            await client.aclose(close_connection_pool=True)
+
+    @staticmethod
+    def _field_key(user_id: str, field: str) -> str:
+        """Gets the key where a field of the user's data is stored.
+
+        Args:
+
+        user_id: The user's ID.
+        field: The name of the field, e.g. 'cart' or 'history'.
+
+        Returns:
+
+        The Redis key of the field.
+        """
+        return f"{user_id}:{field}"
+
+    @staticmethod
+    def get_ttl(field: str) -> int:
+        """Gets how long a field is kept after the user's last activity.
+
+        Args:
+
+        field: The name of the field.
+
+        Returns:
+
+        The TTL in seconds, 0 if the field never expires.
+        """
+        return Database._field_ttls.get(field, Database._default_ttl)
+
+    @staticmethod
+    def _queue_set(
+        pipeline: Pipeline, user_id: str, field: str, value: Any, nx: bool = False
+    ) -> None:
+        """Queues the write of a field, along with its expiration.
+        List fields are rewritten as a Redis list with one record per item.
+
+        Args:
+
+        pipeline: The pipeline.
+        user_id: The user's ID.
+        field: The name of the field.
+        value: The value of the field.
+        nx: Only write the field if it doesn't exist. Not supported by list fields.
+        """
+
+        key = Database._field_key(user_id, field)
+        ttl = Database.get_ttl(field)
+
+        if field in Database._list_fields:
+            pipeline.delete(key)
+            if value:
+                pipeline.rpush(key, *[Database._codec.encode(item) for item in value])
+                if ttl:
+                    pipeline.expire(key, ttl)
+            return
+
+        pipeline.set(key, Database._codec.encode(value), ex=ttl or None, nx=nx)
 
     @staticmethod
-    def set_data(user_id: str, data: dict) -> None:
+    def _queue_append(
+        pipeline: Pipeline, user_id: str, field: str, items: list, max_length: int = 0
+    ) -> None:
+        """Queues the append of some items to a list field, trimming it to its last items.
+
+        Args:
+
+        pipeline: The pipeline.
+        user_id: The user's ID.
+        field: The name of the list field.
+        items: The items to append.
+        max_length: Number of items to keep. 0 keeps every item.
         """
-        Sets the user's cart.
+
+        key = Database._field_key(user_id, field)
+        pipeline.rpush(key, *[Database._codec.encode(item) for item in items])
+        if max_length:
+            pipeline.ltrim(key, -max_length, -1)
+        ttl = Database.get_ttl(field)
+        if ttl:
+            pipeline.expire(key, ttl)
+
+    @staticmethod
+    def _queue_touch(pipeline: Pipeline, user_id: str, fields: Iterable[str]) -> None:
+        """Queues the renewal of the expiration of some fields, on the user's activity.
 
         Args:
 
-        user_id: The user's id.
-        data: The user's data.
+        pipeline: The pipeline.
+        user_id: The user's ID.
+        fields: The names of the fields.
+        """
+        for field in fields:
+            ttl = Database.get_ttl(field)
+            if ttl:
+                pipeline.expire(Database._field_key(user_id, field), ttl)
+
+    @staticmethod
+    def _queue_legacy_migration(
+        pipeline: Pipeline, user_id: str, legacy_data: dict, stored_lists: Iterable[str] = ()
+    ) -> None:
+        """Queues the commands that move the user's data from the legacy single-key JSON document
+        to one key per field. Fields already stored in the new layout are kept, as they are more recent.
+
+        Args:
+
+        pipeline: The pipeline, in transaction mode.
+        user_id: The user's ID.
+        legacy_data: The parsed legacy document.
+        stored_lists: List fields known to be stored in the new layout, which can't be written only if they don't exist.
         """
-        data = json.dumps(data)
-        Database._redis.set(user_id, data)
+
+        for field, value in legacy_data.items():
+            if field not in stored_lists:
+                Database._queue_set(pipeline, user_id, field, value, nx=True)
+        pipeline.delete(user_id)
 
     @staticmethod
-    def get_data(user_id: str) -> dict:
+    async def _migrate_legacy_data(
+        client: redis.Redis, user_id: str, legacy_data: dict, stored_lists: Iterable[str] = ()
+    ) -> None:
+        """Moves the user's data from the legacy single-key JSON document to one key per field.
+
+        Args:
+
+        client: The Redis client.
+        user_id: The user's ID.
+        legacy_data: The parsed legacy document.
+        stored_lists: List fields known to be stored in the new layout.
         """
-        Gets the user's cart.
+
+        stored_lists = set(stored_lists)
+        for field in Database._list_fields:
+            if field in legacy_data and field not in stored_lists:
+                if await client.exists(Database._field_key(user_id, field)):
+                    stored_lists.add(field)
+
+        async with client.pipeline(transaction=True) as pipeline:
+            Database._queue_legacy_migration(pipeline, user_id, legacy_data, stored_lists)
+            await pipeline.execute()
+
+        print(f"Migrated the data of user {user_id} to the per-field layout")
+
+    @staticmethod
+    def _is_wrong_type(error: Exception) -> bool:
+        """Checks if a Redis error comes from a list field still stored as a single record."""
+        return isinstance(error, ResponseError) and "WRONGTYPE" in str(error)
+
+    @staticmethod
+    async def _migrate_list_field(client: redis.Redis, user_id: str, field: str) -> list:
+        """Converts a list field stored as a single record, as written before it was a list, into a Redis list.
 
         Args:
 
+        client: The Redis client.
         user_id: The user's ID.
+        field: The name of the list field.
 
         Returns:
 
-        User's data stored in the database. If the user has no data, returns an empty dict.
+        The value of the field.
         """
-        data_stringified = Database._redis.get(user_id)
-        if data_stringified is None:
-            return {}
-        data = json.loads(data_stringified)
+
+        key = Database._field_key(user_id, field)
+        async with client.pipeline(transaction=True) as pipeline:
+            for _ in range(Database._max_update_attempts):
+                try:
+                    await pipeline.watch(key)
+                    try:
+                        return Database._decode_list(await pipeline.lrange(key, 0, -1))
+                    except ResponseError as e:
+                        if not Database._is_wrong_type(e):
+                            raise
+
+                    value = Database._codec.decode(await pipeline.get(key))
+                    pipeline.multi()
+                    Database._queue_set(pipeline, user_id, field, value)
+                    await pipeline.execute()
+                    return value
+
+                except WatchError:
+                    continue
+
+        raise ConcurrentUpdateError(f"Could not migrate the {field} of user {user_id}")
+
+    @staticmethod
+    def _decode_list(records: list) -> list:
+        return [Database._codec.decode(record) for record in records]
+
+    @staticmethod
+    async def _transact_fields(
+        user_id: str,
+        fields: list[str],
+        update: FieldsUpdate,
+        touched_fields: Iterable[str] = (),
+        appends: dict[str, tuple[list, int]] | None = None,
+    ) -> dict:
+        """
+        Atomically updates some fields of the user's data in Redis, with optimistic locking.
+        The fields are watched while read and updated, and the update is run again
+        if any of them changed before the write.
+
+        Args:
+
+        user_id: The user's ID.
+        fields: The names of the fields read and written by the update.
+        update: Function, sync or async, that takes a dict with the stored fields and
+            returns a dict with the changed ones. It may run more than once.
+        touched_fields: Other fields whose expiration is renewed in the same transaction.
+        appends: Items appended to list fields in the same transaction, as field: (items, max_length).
+
+        Returns:
+
+        Dict with the changed fields written by the successful attempt.
+
+        Raises:
+
+        ConcurrentUpdateError: If the fields kept changing during every attempt.
+        """
+
+        client = Database.get_client()
+        string_fields = [field for field in fields if field not in Database._list_fields]
+        list_fields = [field for field in fields if field in Database._list_fields]
+        keys = [Database._field_key(user_id, field) for field in fields]
+
+        async with client.pipeline(transaction=True) as pipeline:
+            for _ in range(Database._max_update_attempts):
+                try:
+                    await pipeline.watch(*keys, user_id)
+                    *values, legacy_value = await pipeline.mget(
+                        [Database._field_key(user_id, field) for field in string_fields] + [user_id]
+                    )
+
+                    stored = {}
+                    # List fields still stored as a single record, which are rewritten as lists
+                    single_record_lists = []
+                    for field in list_fields:
+                        key = Database._field_key(user_id, field)
+                        try:
+                            records = await pipeline.lrange(key, 0, -1)
+                        except ResponseError as e:
+                            if not Database._is_wrong_type(e):
+                                raise
+                            stored[field] = Database._codec.decode(await pipeline.get(key))
+                            single_record_lists.append(field)
+                            continue
+                        if records:
+                            stored[field] = Database._decode_list(records)
+
+                    if legacy_value is not None:
+                        # Migrated first, which deletes the watched legacy key, so the fields are read again
+                        await Database._migrate_legacy_data(
+                            client, user_id, Database._codec.decode(legacy_value), stored
+                        )
+                        await pipeline.reset()
+                        continue
+
+                    data = {}
+                    for field, value in zip(string_fields, values):
+                        if value is not None:
+                            data[field] = Database._codec.decode(value)
+                    data.update(stored)
+
+                    changes = update(data)
+                    if inspect.isawaitable(changes):
+                        changes = await changes
+                    changes = changes or {}
+
+                    pipeline.multi()
+                    for field in single_record_lists:
+                        if field not in changes:
+                            Database._queue_set(pipeline, user_id, field, stored[field])
+                    for field, value in changes.items():
+                        Database._queue_set(pipeline, user_id, field, value)
+                    for field, (items, max_length) in (appends or {}).items():
+                        Database._queue_append(pipeline, user_id, field, items, max_length)
+                    Database._queue_touch(pipeline, user_id, touched_fields)
+                    await pipeline.execute()
+                    return changes
+
+                except WatchError:
+                    print(f"Concurrent update of the data of user {user_id}, retrying")
+                    continue
+
+        raise ConcurrentUpdateError(
+            f"Could not update the data of user {user_id} after {Database._max_update_attempts} attempts"
+        )
+
+    @staticmethod
+    def _get_session(user_id: str):
+        """Gets the unit of work of the running turn, if it belongs to the user.
+
+        Args:
+
+        user_id: The user's ID.
+
+        Returns:
+
+        The active UserSession or None, if the storage should be accessed directly.
+        """
+        session = Database._session.get()
+        if session is not None and session.user_id == user_id:
+            return session
+        return None
+
+    @staticmethod
+    async def _read_fields(user_id: str, fields: list[str]) -> dict:
+        """
+        Reads some fields of the user's data from Redis, in a single round-trip.
+
+        Args:
+
+        user_id: The user's ID.
+        fields: The names of the fields.
+
+        Returns:
+
+        Dict with the stored fields. Fields the user has no data for are left out.
+        """
+
+        client = Database.get_client()
+        string_fields = [field for field in fields if field not in Database._list_fields]
+        list_fields = [field for field in fields if field in Database._list_fields]
+
+        async with client.pipeline(transaction=False) as pipeline:
+            # The legacy document is read along, so migrating users costs no extra round-trip
+            pipeline.mget([Database._field_key(user_id, field) for field in string_fields] + [user_id])
+            for field in list_fields:
+                pipeline.lrange(Database._field_key(user_id, field), 0, -1)
+            (*values, legacy_value), *list_records = await pipeline.execute(raise_on_error=False)
+
+        data = {}
+        stored_lists = {}
+        for field, records in zip(list_fields, list_records):
+            if Database._is_wrong_type(records):
+                stored_lists[field] = await Database._migrate_list_field(client, user_id, field)
+            elif isinstance(records, Exception):
+                raise records
+            elif records:
+                stored_lists[field] = Database._decode_list(records)
+
+        if legacy_value is not None:
+            legacy_data = Database._codec.decode(legacy_value)
+            await Database._migrate_legacy_data(client, user_id, legacy_data, stored_lists)
+            data = {field: legacy_data[field] for field in fields if field in legacy_data}
+
+        for field, value in zip(string_fields, values):
+            if value is not None:
+                data[field] = Database._codec.decode(value)
+        data.update(stored_lists)
+
         return data
+
+    @staticmethod
+    async def _write_fields(
+        user_id: str,
+        data: dict,
+        touched_fields: Iterable[str] = (),
+        appends: dict[str, tuple[list, int]] | None = None,
+    ) -> None:
+        """
+        Writes some fields of the user's data to Redis, in a single round-trip.
+        Each written field expires after its TTL.
+
+        Args:
+
+        user_id: The user's ID.
+        data: Dict with the values of the fields to be written.
+        touched_fields: Other fields whose expiration is renewed in the same round-trip.
+        appends: Items appended to list fields in the same round-trip, as field: (items, max_length).
+        """
+
+        async with Database.get_client().pipeline(transaction=True) as pipeline:
+            for field, value in data.items():
+                Database._queue_set(pipeline, user_id, field, value)
+            for field, (items, max_length) in (appends or {}).items():
+                Database._queue_append(pipeline, user_id, field, items, max_length)
+            Database._queue_touch(pipeline, user_id, touched_fields)
+            await pipeline.execute()
+
+    @staticmethod
+    async def get_fields(user_id: str, fields: list[str]) -> dict:
+        """
+        Gets some fields of the user's data.
+        Inside a UserSession of the user, the values come from the session instead of Redis.
+
+        Args:
+
+        user_id: The user's ID.
+        fields: The names of the fields.
+
+        Returns:
+
+        Dict with the stored fields. Fields the user has no data for are left out.
+        """
+
+        session = Database._get_session(user_id)
+        if session is not None:
+            return await session.get_fields(fields)
+        return await Database._read_fields(user_id, fields)
+
+    @staticmethod
+    async def get_field(user_id: str, field: str, default: Any = None) -> Any:
+        """
+        Gets a field of the user's data.
+
+        Args:
+
+        user_id: The user's ID.
+        field: The name of the field.
+        default: The value returned if the user has no data for the field.
+
+        Returns:
+
+        The stored value of the field or the default value.
+        """
+        data = await Database.get_fields(user_id, [field])
+        return data.get(field, default)
+
+    @staticmethod
+    async def set_fields(user_id: str, data: dict) -> None:
+        """
+        Sets some fields of the user's data.
+        Inside a UserSession of the user, the values are written when the session is flushed.
+
+        Args:
+
+        user_id: The user's ID.
+        data: Dict with the values of the fields to be set.
+        """
+
+        session = Database._get_session(user_id)
+        if session is not None:
+            session.set_fields(data)
+        else:
+            await Database._write_fields(user_id, data)
+
+    @staticmethod
+    async def set_field(user_id: str, field: str, value: Any) -> None:
+        """
+        Sets a field of the user's data.
+
+        Args:
+
+        user_id: The user's ID.
+        field: The name of the field.
+        value: The value of the field, which must be JSON serializable.
+        """
+        await Database.set_fields(user_id, {field: value})
+
+    @staticmethod
+    async def touch(user_id: str, fields: Iterable[str] | None = None) -> None:
+        """
+        Renews the expiration of the user's fields, e.g. when the user is active without changing them.
+
+        Args:
+
+        user_id: The user's ID.
+        fields: The names of the fields. Defaults to every field with a TTL.
+        """
+
+        if fields is None:
+            fields = Database._field_ttls
+        async with Database.get_client().pipeline(transaction=False) as pipeline:
+            Database._queue_touch(pipeline, user_id, fields)
+            await pipeline.execute()
+
+    @staticmethod
+    async def update_fields(user_id: str, fields: list[str], update: FieldsUpdate) -> dict:
+        """
+        Atomically updates some fields of the user's data, e.g. to edit the cart or append to the history.
+        Inside a UserSession of the user, the update is applied to the session and run again,
+        atomically, over the stored data when the session is flushed.
+
+        Args:
+
+        user_id: The user's ID.
+        fields: The names of the fields read and written by the update.
+        update: Function, sync or async, that takes a dict with the stored fields and
+            returns a dict with the changed ones. It may run more than once, so it should
+            have no side effects other than what it returns.
+
+        Returns:
+
+        Dict with the changed fields.
+        """
+
+        session = Database._get_session(user_id)
+        if session is not None:
+            return await session.update_fields(fields, update)
+        return await Database._transact_fields(user_id, fields, update)
+
+    @staticmethod
+    async def update_field(
+        user_id: str, field: str, update: Callable[[Any], Any], default: Any = None
+    ) -> Any:
+        """
+        Atomically updates a field of the user's data.
+
+        Args:
+
+        user_id: The user's ID.
+        field: The name of the field.
+        update: Function, sync or async, that takes the stored value of the field and returns the new one.
+        default: The value given to the update if the user has no data for the field.
+
+        Returns:
+
+        The new value of the field.
+        """
+
+        async def update_value(data: dict) -> dict:
+            value = update(data.get(field, default))
+            if inspect.isawaitable(value):
+                value = await value
+            return {field: value}
+
+        changes = await Database.update_fields(user_id, [field], update_value)
+        return changes[field]
+
+    @staticmethod
+    async def append_to_list(user_id: str, field: str, items: list, max_length: int = 0) -> None:
+        """
+        Appends some items to a list field of the user's data, keeping only its last items.
+        The items are pushed and the list trimmed in a single round-trip, without reading it.
+
+        Args:
+
+        user_id: The user's ID.
+        field: The name of the list field, e.g. 'history'.
+        items: The items to append, which must be JSON serializable.
+        max_length: Number of items to keep. 0 keeps every item.
+        """
+
+        if field not in Database._list_fields:
+            raise ValueError(f"{field} is not a list field")
+
+        session = Database._get_session(user_id)
+        if session is not None:
+            await session.append_to_list(field, items, max_length)
+            return
+
+        appends = {field: (items, max_length)}
+        try:
+            await Database._write_fields(user_id, {}, appends=appends)
+        except ResponseError as e:
+            if not Database._is_wrong_type(e):
+                raise
+            # Stored as a single record before the field was a list
+            await Database._migrate_list_field(Database.get_client(), user_id, field)
+            await Database._write_fields(user_id, {}, appends=appends)
@@ -0,0 +1,228 @@
+import hashlib
+import json
+import zlib
+from pathlib import Path
+from typing import Collection
+
+import numpy as np
+
+from ..schemas import Product
+from .lexical_index import normalize_words, product_text
+
+
+class HashingEmbedder:
+    """Deterministic local embedder based on hashed character n-grams.
+
+    It needs no model files nor network access, so the same text always gets the same
+    vector in every process, which allows the product embeddings to be cached on disk.
+    """
+
+    def __init__(self, dimensions: int = 512, ngram_sizes: tuple[int, ...] = (3, 4, 5)):
+        """
+        Args:
+
+        dimensions: The size of the embedding vectors.
+        ngram_sizes: The sizes of the character n-grams hashed into the vectors.
+        """
+        self.dimensions = dimensions
+        self.ngram_sizes = ngram_sizes
+
+    @property
+    def signature(self) -> str:
+        """Identifies the embedder configuration, so cached embeddings from another configuration are not reused."""
+        return f"hashing-crc32-{self.dimensions}-{'.'.join(map(str, self.ngram_sizes))}"
+
+    def embed(self, text: str) -> np.ndarray:
+        """Embeds a text.
+
+        Args:
+
+        text: The text to be embedded.
+
+        Returns:
+
+        The L2-normalized float32 embedding of the text.
+        """
+
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for word in normalize_words(text):
+            padded = f" {word} "
+            for size in self.ngram_sizes:
+                for start in range(max(len(padded) - size + 1, 1)):
+                    hashed = zlib.crc32(padded[start : start + size].encode("utf-8"))
+                    # The highest bit chooses the sign, which keeps collisions from only adding up
+                    sign = 1.0 if hashed & 0x80000000 else -1.0
+                    vector[hashed % self.dimensions] += sign
+
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+    def embed_many(self, texts: list[str]) -> np.ndarray:
+        """Embeds a list of texts.
+
+        Args:
+
+        texts: The texts to be embedded.
+
+        Returns:
+
+        A contiguous (len(texts), dimensions) float32 matrix.
+        """
+
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            matrix[row] = self.embed(text)
+        return matrix
+
+
+class EmbeddingIndex:
+    """Semantic index that keeps the product embeddings in a single contiguous matrix.
+
+    Rows follow the order of the products used to build the index.
+    """
+
+    def __init__(self, matrix: np.ndarray, embedder: HashingEmbedder):
+        """
+        Args:
+
+        matrix: The (number of products, dimensions) embedding matrix. Can be memory-mapped.
+        embedder: The embedder used to build the matrix, used to embed the queries.
+        """
+        self._matrix = matrix
+        self._embedder = embedder
+
+    def __len__(self) -> int:
+        return self._matrix.shape[0]
+
+    @staticmethod
+    def product_text(product: Product) -> str:
+        """Gets the text of a product that is embedded.
+
+        Args:
+
+        product: The product.
+
+        Returns:
+
+        The concatenation of the product's searchable fields.
+        """
+        return product_text(product)
+
+    @staticmethod
+    def _fingerprint(products: list[Product], embedder: HashingEmbedder) -> str:
+        """Fingerprints the products and embedder configuration of an embedding matrix."""
+
+        digest = hashlib.sha256(embedder.signature.encode("utf-8"))
+        for product in products:
+            digest.update(EmbeddingIndex.product_text(product).encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    @staticmethod
+    def build(products: list[Product], embedder: HashingEmbedder | None = None) -> "EmbeddingIndex":
+        """Builds the index in memory.
+
+        Args:
+
+        products: The products to be indexed.
+        embedder: The embedder to use. Defaults to a HashingEmbedder.
+
+        Returns:
+
+        The embedding index.
+        """
+
+        embedder = embedder or HashingEmbedder()
+        matrix = embedder.embed_many([EmbeddingIndex.product_text(product) for product in products])
+        return EmbeddingIndex(matrix, embedder)
+
+    @staticmethod
+    def load_or_build(
+        products: list[Product],
+        cache_path: Path,
+        embedder: HashingEmbedder | None = None,
+    ) -> "EmbeddingIndex":
+        """Loads the index from its offline cache, building and caching it if it's missing or stale.
+
+        The matrix is stored in a .npy file and memory-mapped when loaded. A .json file with the
+        same name holds the fingerprint of the products it was built from.
+
+        Args:
+
+        products: The products to be indexed.
+        cache_path: Path of the .npy cache file.
+        embedder: The embedder to use. Defaults to a HashingEmbedder.
+
+        Returns:
+
+        The embedding index.
+        """
+
+        embedder = embedder or HashingEmbedder()
+        cache_path = Path(cache_path)
+        metadata_path = cache_path.with_suffix(".json")
+        fingerprint = EmbeddingIndex._fingerprint(products, embedder)
+
+        try:
+            with open(metadata_path, "r") as file:
+                metadata = json.load(file)
+            if metadata.get("fingerprint") == fingerprint:
+                matrix = np.load(cache_path, mmap_mode="r")
+                if matrix.shape == (len(products), embedder.dimensions):
+                    return EmbeddingIndex(matrix, embedder)
+        except (OSError, ValueError):
+            pass
+
+        index = EmbeddingIndex.build(products, embedder)
+
+        try:
+            np.save(cache_path, index._matrix)
+            with open(metadata_path, "w") as file:
+                json.dump({"fingerprint": fingerprint, "rows": len(products)}, file)
+        except OSError as e:
+            print(f"Could not write the embedding cache to {cache_path}: {e}")
+
+        return index
+
+    def search(
+        self, query: str, k: int, candidates: Collection[int] | None = None
+    ) -> list[tuple[int, float]]:
+        """Searches the products closest to the query.
+
+        Args:
+
+        query: The free-text product query.
+        k: The maximum number of results.
+        candidates: Rows allowed in the results. All rows are allowed if None.
+
+        Returns:
+
+        Up to k (row, cosine similarity) pairs, most similar first.
+        """
+
+        query_vector = self._embedder.embed(query)
+
+        if candidates is None:
+            rows = None
+            scores = self._matrix @ query_vector
+        elif isinstance(candidates, range):
+            # Regional catalogs are ranges, which slice the matrix without copying it
+            rows = np.arange(candidates.start, candidates.stop, candidates.step, dtype=np.intp)
+            matrix = self._matrix[candidates.start : candidates.stop : candidates.step]
+            scores = matrix @ query_vector
+        else:
+            rows = np.fromiter(candidates, dtype=np.intp)
+            scores = self._matrix[rows] @ query_vector
+
+        k = min(k, scores.shape[0])
+        if k <= 0:
+            return []
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        if rows is not None:
+            return [(int(rows[i]), float(scores[i])) for i in top]
+        return [(int(i), float(scores[i])) for i in top]
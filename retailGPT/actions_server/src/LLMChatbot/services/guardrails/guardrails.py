@@ -1,17 +1,17 @@
-import os
+import asyncio
 import re
-from openai import OpenAI
+import time
+from typing import Awaitable
 
 from dotenv import load_dotenv
 
 from ...prompts import prompt_hack
+from ..admission_controller import RequestPriority
 from ..llm_handler import LLMHandler
 from .words_to_be_filtered import words_to_be_filtered
 
 load_dotenv()
 
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY", None))
-
 _credit_cards_patterns = {
     "Visa": re.compile(
         r"\b(?<!\-|\.)4(\d{3})(?!\1{3})([\ \-]?)(?<!\d\ \d{4}\ )(?!(\d)\3{3})(\d{4})\2(?!\4|(\d)\5{3}|1234|2345|3456|5678|7890)(\d{4})(?!\ \d{4}\ \d)\2(?!\6|(\d)\7{3}|1234|3456)\d{4}(?!\-)(?!\.\d)\b"  # noqa: E501
@@ -42,7 +42,7 @@ _all_sensitive_fields = {
 class Guardrails:
 
     @staticmethod
-    def check_moderations(text: str):
+    async def check_moderations(text: str):
         """Checks the text for moderation.
 
         Args:
@@ -51,8 +51,7 @@ class Guardrails:
         Returns:
             True if Open AI moderations identify problems, otherwise False.
         """
-        response = client.moderations.create(input=text)
-        return response.results[0].flagged
+        return await LLMHandler.call_moderations_api(text)
 
     @staticmethod
     async def check_prompt_hack(text: str):
@@ -75,6 +74,7 @@ class Guardrails:
             temperature=0,
             top_p=1.0,
             logit_bias={56: 100, 45: 100},
+            priority=RequestPriority.GUARDRAIL,
         )
 
         content = response["content"]
@@ -114,36 +114,82 @@ class Guardrails:
                 return True
 
     @staticmethod
-    async def run_input_guardrails(text: str):
+    async def _timed_check(name: str, check: Awaitable[bool], timings: dict) -> bool:
+        """Awaits a remote check, recording how long it took.
+
+        Args:
+            name: The name of the check, used as key in the timings.
+            check: The awaitable check.
+            timings: Dict where the duration of the check is stored, in seconds.
+
+        Returns:
+            The result of the check.
+        """
+        start = time.perf_counter()
+        try:
+            return await check
+        finally:
+            timings[name] = time.perf_counter() - start
+
+    @staticmethod
+    async def run_input_guardrails(text: str, timings: dict | None = None):
         """Checks the text for various input guardrails and returns True if none are activated.
 
+        The local checks run first, as they are cheap. Then the remote checks run concurrently,
+        and the outstanding ones are cancelled as soon as any of them is activated.
+
         Args:
             text: The text to be checked.
+            timings: Optional dict filled with the duration of each check that ran, in seconds.
+                Remote checks cancelled before finishing are recorded with the time they ran for.
 
         Returns:
             True if no guardrails are activated and the text is safe, otherwise False.
         """
-        
-        if Guardrails.check_moderations(text):
-            print("OpenAI moderation triggered")
-            return False
-
-        if await Guardrails.check_prompt_hack(text):
-            print("Prompt hack triggered")
-            return False
 
-        if Guardrails.check_sensitive_fields(text):
-            print("Sensitive fields triggered")
-            return False
-
-        if Guardrails.check_profanity(text):
-            print("Profanity triggered")
-            return False
+        if timings is None:
+            timings = {}
+
+        local_checks = {
+            "sensitive_fields": Guardrails.check_sensitive_fields,
+            "profanity": Guardrails.check_profanity,
+        }
+        for name, check in local_checks.items():
+            start = time.perf_counter()
+            triggered = check(text)
+            timings[name] = time.perf_counter() - start
+            if triggered:
+                print(f"Guardrail triggered: {name}")
+                return False
+
+        remote_checks = {
+            "moderation": Guardrails.check_moderations(text),
+            "prompt_hack": Guardrails.check_prompt_hack(text),
+        }
+        pending = {
+            asyncio.create_task(Guardrails._timed_check(name, check, timings)): name
+            for name, check in remote_checks.items()
+        }
+
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = pending.pop(task)
+                    if task.result():
+                        print(f"Guardrail triggered: {name}")
+                        return False
+        finally:
+            # Also reached when a check fails or the caller is cancelled
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
 
         return True
-    
+
     @staticmethod
-    def run_output_guardrails(text: str):
+    async def run_output_guardrails(text: str):
         """Checks the text for various output guardrails and returns True if none are activated.
 
         Args:
@@ -153,7 +199,7 @@ class Guardrails:
             True if no guardrails are activated and the text is safe, otherwise False.
         """
         
-        if Guardrails.check_moderations(text):
+        if await Guardrails.check_moderations(text):
             return False
 
         if Guardrails.check_sensitive_fields(text):
@@ -0,0 +1,218 @@
+import heapq
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Collection
+
+from ..schemas import Product
+
+_token_pattern = re.compile(r"[a-z0-9]+")
+
+# Very frequent Spanish and English words that carry no signal for product search
+_stopwords = {
+    "a", "al", "an", "and", "con", "de", "del", "el", "en", "for", "i", "la",
+    "las", "lo", "los", "me", "mi", "my", "o", "of", "or", "para", "por", "que",
+    "quiero", "se", "su", "the", "to", "un", "una", "uno", "unos", "want", "with",
+    "y",
+}
+
+# The chatbot usually phrases queries in English while the catalog is in Spanish,
+# so the most common product attributes are mapped to their catalog terms.
+_query_synonyms = {
+    "aviator": "aviador",
+    "beach": "playa",
+    "black": "negro",
+    "blue": "azul",
+    "brown": "marron",
+    "classic": "clasico",
+    "driving": "conducir",
+    "gold": "dorado",
+    "glasses": "gafas",
+    "gradient": "degradada",
+    "green": "verde",
+    "mirrored": "espejada",
+    "polarized": "polarizada",
+    "protection": "proteccion",
+    "red": "rojo",
+    "round": "redondo",
+    "running": "deportiva",
+    "silver": "plateado",
+    "sport": "deportiva",
+    "sports": "deportiva",
+    "sunglasses": "gafas",
+    "tortoise": "carey",
+    "white": "blanco",
+}
+
+_product_fields = (
+    "product_name",
+    "brand",
+    "model",
+    "color",
+    "style",
+    "lens_type",
+    "frame_material",
+    "description",
+)
+
+# Fields repeated in the document text, so matches on them weigh more than matches in the description
+_boosted_fields = ("product_name", "brand", "style")
+
+
+def fold_accents(text: str) -> str:
+    """Lower-cases the text and removes its accents.
+
+    Args:
+
+    text: The text to be folded.
+
+    Returns:
+
+    The folded text, e.g. 'Protección' becomes 'proteccion'.
+    """
+    return "".join(
+        c
+        for c in unicodedata.normalize("NFD", text)
+        if unicodedata.category(c) != "Mn"
+    ).lower()
+
+
+def stem(token: str) -> str:
+    """Light Spanish stemmer that removes plural and gender suffixes.
+
+    Args:
+
+    token: An accent-folded, lower-cased token.
+
+    Returns:
+
+    The stemmed token, e.g. both 'polarizadas' and 'polarizado' become 'polarizad'.
+    """
+    if len(token) > 4 and token.endswith("es"):
+        token = token[:-2]
+    elif len(token) > 3 and token.endswith("s"):
+        token = token[:-1]
+    if len(token) > 4 and token[-1] in "aoe":
+        token = token[:-1]
+    return token
+
+
+def normalize_words(text: str) -> list[str]:
+    """Splits a text into accent-folded words, mapping English product attributes to the catalog terms.
+
+    Args:
+
+    text: The text to be normalized.
+
+    Returns:
+
+    The list of words, with stopwords removed.
+    """
+    return [
+        _query_synonyms.get(token, token)
+        for token in _token_pattern.findall(fold_accents(text))
+        if token not in _stopwords
+    ]
+
+
+def analyze(text: str) -> list[str]:
+    """Splits a text into normalized search terms.
+
+    Args:
+
+    text: The text to be analyzed.
+
+    Returns:
+
+    The list of stemmed terms, with stopwords removed.
+    """
+    return [stem(word) for word in normalize_words(text)]
+
+
+def product_text(product: Product) -> str:
+    """Gets the searchable text of a product, shared by the lexical and the embedding indexes.
+
+    Args:
+
+    product: The product.
+
+    Returns:
+
+    The concatenation of the product's searchable fields.
+    """
+    return " ".join(str(product.get(field, "")) for field in _product_fields)
+
+
+class LexicalIndex:
+    """BM25 index over the searchable fields of a list of products.
+
+    Documents are identified by their position in the list used to build the index.
+    """
+
+    _k1: float = 1.5
+    _b: float = 0.75
+
+    def __init__(self, products: list[Product]):
+        """Builds the inverted index.
+
+        Args:
+
+        products: The products to be indexed.
+        """
+
+        self._postings: dict[str, list[tuple[int, int]]] = {}
+        document_lengths = []
+
+        for index, product in enumerate(products):
+            text = product_text(product)
+            text += " " + " ".join(str(product.get(field, "")) for field in _boosted_fields)
+            terms = analyze(text)
+            document_lengths.append(len(terms))
+            for term, frequency in Counter(terms).items():
+                self._postings.setdefault(term, []).append((index, frequency))
+
+        self._size = len(products)
+        # Guarded, as every document may be empty
+        average_length = (sum(document_lengths) / self._size if self._size else 0) or 1
+        self._length_norms = [
+            self._k1 * (1 - self._b + self._b * length / average_length)
+            for length in document_lengths
+        ]
+        self._idf = {
+            term: math.log(1 + (self._size - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self._postings.items()
+        }
+
+    def __len__(self) -> int:
+        return self._size
+
+    def search(
+        self, query: str, k: int, candidates: Collection[int] | None = None
+    ) -> list[tuple[int, float]]:
+        """Searches the products that best match the query.
+
+        Args:
+
+        query: The free-text product query.
+        k: The maximum number of results.
+        candidates: Positions of the documents allowed in the results. All documents are allowed if None.
+
+        Returns:
+
+        Up to k (position, score) pairs with positive score, best match first.
+        """
+
+        scores: dict[int, float] = {}
+        for term in set(analyze(query)):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            idf = self._idf[term]
+            for index, frequency in postings:
+                if candidates is not None and index not in candidates:
+                    continue
+                score = idf * frequency * (self._k1 + 1) / (frequency + self._length_norms[index])
+                scores[index] = scores.get(index, 0.0) + score
+
+        return heapq.nlargest(k, scores.items(), key=lambda item: (item[1], -item[0]))
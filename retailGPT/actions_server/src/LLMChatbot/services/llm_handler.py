@@ -1,10 +1,25 @@
 import asyncio
+import json
 import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
 
 import aiohttp
 from dotenv import load_dotenv
 from openai import BadRequestError
 
+from .admission_controller import AdmissionController, RequestPriority
+from .resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceededError,
+    ProviderUnavailableError,
+    RetriesExhaustedError,
+    RetryPolicy,
+)
+from .streaming import StreamedCompletion, iter_sse_data
+from .token_counter import TokenCounter
+
 load_dotenv()
 
 
@@ -23,16 +38,162 @@ class LLMHandler:
     _openai_api_key: str = os.environ.get("OPENAI_API_KEY", None)
     _openai_model: str = "gpt-4o"
 
+    # Connection pool shared by every request of the process, bound to the loop it was created on
+    _session: aiohttp.ClientSession | None = None
+    _session_loop: asyncio.AbstractEventLoop | None = None
+    _connection_limit: int = int(os.environ.get("LLM_CONNECTION_LIMIT", 100))
+    _connection_limit_per_host: int = int(
+        os.environ.get("LLM_CONNECTION_LIMIT_PER_HOST", 30)
+    )
+    _keepalive_timeout: float = 30  # seconds
+    _dns_cache_ttl: int = 300  # seconds
+
+    # Bounds the requests sent to the provider at once and the tokens sent per minute
+    _admission: AdmissionController = AdmissionController(
+        max_in_flight=int(os.environ.get("LLM_MAX_IN_FLIGHT", 16)),
+        tokens_per_minute=int(os.environ.get("LLM_TOKENS_PER_MINUTE", 0)),
+    )
+    _default_completion_tokens: int = 512  # Expected completion size when max_tokens isn't set
+
+    # Retries transient failures within a deadline, and fails fast while the provider is degraded
+    _retry_policy: RetryPolicy = RetryPolicy(
+        max_attempts=int(os.environ.get("LLM_MAX_ATTEMPTS", 5)),
+        max_delay=float(os.environ.get("LLM_MAX_RETRY_DELAY", 20)),
+        deadline=float(os.environ.get("LLM_REQUEST_DEADLINE", 60)),
+    )
+    _circuit_breaker: CircuitBreaker = CircuitBreaker(
+        failure_threshold=int(os.environ.get("LLM_CIRCUIT_FAILURE_THRESHOLD", 5)),
+        reset_timeout=float(os.environ.get("LLM_CIRCUIT_RESET_TIMEOUT", 30)),
+    )
+    # Moderation runs in the guardrails of every turn, so it gets a shorter deadline than completions
+    _moderation_deadline: float = float(os.environ.get("LLM_MODERATION_DEADLINE", 10))
+    _provider_unavailable_message: str = (
+        "Our assistant is temporarily unavailable. Please try again in a few moments."
+    )
+
     @staticmethod
-    async def _post_completion_request(
-        session: aiohttp.ClientSession,
-        headers: dict,
-        messages: list,
-        tools: list = None,
-        use_azure: bool = False,
-        **kwargs,
-    ) -> dict:
-        """Posts a completion request to the OpenAI or Azure completions API."""
+    async def get_session() -> aiohttp.ClientSession:
+        """Gets the process-wide aiohttp session, creating it lazily on the running loop.
+
+        Returns:
+
+        The shared session, which keeps connections alive between requests.
+        """
+
+        loop = asyncio.get_running_loop()
+        session = LLMHandler._session
+
+        if session is None or session.closed or LLMHandler._session_loop is not loop:
+            session_loop = LLMHandler._session_loop
+            connector = aiohttp.TCPConnector(
+                limit=LLMHandler._connection_limit,
+                limit_per_host=LLMHandler._connection_limit_per_host,
+                keepalive_timeout=LLMHandler._keepalive_timeout,
+                ttl_dns_cache=LLMHandler._dns_cache_ttl,
+            )
+            LLMHandler._session = aiohttp.ClientSession(connector=connector)
+            LLMHandler._session_loop = loop
+            await LLMHandler._close_replaced_session(session, session_loop)
+
+        return LLMHandler._session
+
+    @staticmethod
+    async def _close_replaced_session(
+        session: aiohttp.ClientSession | None, session_loop: asyncio.AbstractEventLoop | None
+    ) -> None:
+        """Closes a session replaced because the event loop changed, so its connections are not leaked.
+
+        Args:
+
+        session: The replaced session.
+        session_loop: The event loop the session was created on.
+        """
+
+        if session is None or session.closed:
+            return
+        if session_loop is not None and session_loop.is_running():
+            # Its connections belong to a loop still running in another thread, so it's closed there
+            asyncio.run_coroutine_threadsafe(session.close(), session_loop)
+            return
+        try:
+            await session.close()
+        except RuntimeError as e:
+            # The connections of a closed loop can't be closed gracefully
+            print(f"Could not close the replaced aiohttp session: {e}")
+
+    @staticmethod
+    async def close_session() -> None:
+        """Closes the process-wide aiohttp session and its connection pool."""
+
+        session = LLMHandler._session
+        LLMHandler._session = None
+        LLMHandler._session_loop = None
+        if session is not None and not session.closed:
+            await session.close()
+
+    @staticmethod
+    def _estimate_tokens(messages: list, tools: list | None, max_tokens: int | None) -> int:
+        """Estimates the tokens used by a completion request, to charge it against the token budget.
+
+        Args:
+
+        messages: The messages of the request.
+        tools: The tools of the request.
+        max_tokens: The maximum number of completion tokens of the request, if set.
+
+        Returns:
+
+        The estimated number of prompt and completion tokens.
+        """
+
+        prompt_tokens = TokenCounter.count_messages(messages)
+        if tools:
+            prompt_tokens += TokenCounter.count_text(json.dumps(tools, ensure_ascii=False))
+
+        if max_tokens is None:
+            max_tokens = LLMHandler._default_completion_tokens
+
+        return prompt_tokens + max_tokens
+
+    @staticmethod
+    def is_provider_unavailable() -> bool:
+        """Checks if the circuit breaker is refusing completion requests.
+
+        Returns:
+
+        True if the provider is degraded and requests would fail fast, otherwise False.
+        """
+        return LLMHandler._circuit_breaker.is_open()
+
+    @staticmethod
+    def get_admission_metrics() -> dict:
+        """Gets the metrics of the outbound requests queue.
+
+        Returns:
+
+        The queue depth, in-flight count, token usage and wait times per priority class.
+        """
+        return LLMHandler._admission.get_metrics()
+
+    @staticmethod
+    def _get_headers(use_azure: bool = False) -> dict:
+        """Gets the headers of a request to the OpenAI or Azure completions API."""
+
+        if use_azure:
+            return {
+                "Content-Type": "application/json",
+                "api-key": f"{LLMHandler._azure_openai_api_key}",
+            }
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {LLMHandler._openai_api_key}",
+        }
+
+    @staticmethod
+    def _get_completion_request(
+        messages: list, tools: list | None, use_azure: bool, **kwargs
+    ) -> tuple[str, dict]:
+        """Gets the URL and payload of a request to the OpenAI or Azure completions API."""
 
         if use_azure:
             url = f"https://{LLMHandler._azure_resource}.openai.azure.com/openai/deployments/{LLMHandler._azure_model_deployment}/chat/completions?api-version={LLMHandler._api_version}"
@@ -51,36 +212,147 @@ class LLMHandler:
                 **kwargs,
             }
 
+        return url, payload
+
+    @staticmethod
+    @asynccontextmanager
+    async def _open_completion_response(
+        session: aiohttp.ClientSession,
+        url: str,
+        headers: dict,
+        payload: dict,
+        priority: RequestPriority,
+        tokens: int,
+        deadline: float | None = None,
+        stream: bool = False,
+        refund_on_cancel: bool = False,
+    ) -> AsyncIterator[aiohttp.ClientResponse]:
+        """Opens a successful response of the provider's API, for completions and moderations.
+        Transient failures are retried according to the retry policy, until the request deadline.
+        The admission slot is held while the response is open.
+
+        For streamed responses the deadline bounds the connection and each read, i.e. the time
+        to the first byte and the pauses between chunks, but not the length of the whole stream.
+
+        With refund_on_cancel, the request's tokens are given back to the budget if it's cancelled.
+
+        Raises:
+
+        CircuitOpenError: If the provider is degraded and the circuit breaker refused the request.
+        DeadlineExceededError: If the request couldn't complete before its deadline.
+        RetriesExhaustedError: If every attempt allowed by the retry policy failed.
+        """
+
+        policy = LLMHandler._retry_policy
+        breaker = LLMHandler._circuit_breaker
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (policy.deadline if deadline is None else deadline)
         attempt = 0
-        max_attempts = 100
-        backoff_factor = 2  # seconds
-
-        while attempt < max_attempts:
-            async with session.post(url, json=payload, headers=headers) as response:
-
-                # Rate limit exceeded
-                if response.status == 429:
-                    # Exponential backoff
-                    retry_after = backoff_factor * (2**attempt)
-                    print(f"Rate limit exceeded. Retrying in {retry_after} seconds...")
-                    await asyncio.sleep(retry_after)
-                    attempt += 1
-                    continue
-                elif response.status != 200:
-                    response_text = await response.text()
-                    print(
-                        f"Error: Received status code {response.status} with response {response_text}"
-                    )
-                    response.raise_for_status()
-
-                response_json = await response.json()
-                if "choices" not in response_json:
-                    print(f"'choices' not in response JSON: {response_json}")
-                    raise ValueError("'choices' not in response JSON")
-
-                return response_json["choices"][0]["message"]
-
-        raise Exception("Max retries exceeded for API requests")
+
+        while True:
+            is_probe = breaker.state == CircuitBreaker.HALF_OPEN
+            if not breaker.allow_request():
+                raise CircuitOpenError("The completions provider is degraded")
+
+            recorded = False
+            retry_after = None
+            try:
+                # The in-flight slot is only held during the request, not during the backoff
+                async with LLMHandler._admission.admit(priority, tokens, refund_on_cancel):
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        raise DeadlineExceededError("Deadline exceeded while queued")
+
+                    async with session.post(
+                        url,
+                        json=payload,
+                        headers=headers,
+                        timeout=(
+                            aiohttp.ClientTimeout(total=None, connect=remaining, sock_read=remaining)
+                            if stream
+                            else aiohttp.ClientTimeout(total=remaining)
+                        ),
+                    ) as response:
+
+                        if response.status == 200:
+                            breaker.record_success()
+                            recorded = True
+                            yield response
+                            return
+
+                        response_text = await response.text()
+                        print(
+                            f"Error: Received status code {response.status} with response {response_text}"
+                        )
+                        if not policy.should_retry_status(response.status):
+                            # The provider is up, the request itself is invalid
+                            breaker.record_success()
+                            recorded = True
+                            response.raise_for_status()
+
+                        retry_after = response.headers.get("Retry-After")
+
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if recorded:
+                    # Raised while the caller was reading the response, which can't be retried
+                    raise
+                print(f"Connection error on request to {url}: {e!r}")
+
+            finally:
+                if is_probe and not recorded:
+                    breaker.release_probe()
+
+            # The breaker counts failed requests, not attempts, so the retries of a single
+            # request can't open the circuit for everyone. A failed probe reopens it at once.
+            if is_probe:
+                breaker.record_failure()
+            attempt += 1
+
+            if attempt >= policy.max_attempts:
+                if not is_probe:
+                    breaker.record_failure()
+                raise RetriesExhaustedError(f"Max retries exceeded after {attempt} attempts")
+
+            delay = policy.get_delay(attempt, retry_after)
+            if loop.time() + delay >= deadline:
+                if not is_probe:
+                    breaker.record_failure()
+                raise DeadlineExceededError(
+                    f"Deadline exceeded after {attempt} attempts"
+                )
+
+            print(f"Request to {url} failed. Retrying in {delay:.2f} seconds...")
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    async def _post_completion_request(
+        session: aiohttp.ClientSession,
+        headers: dict,
+        messages: list,
+        tools: list = None,
+        use_azure: bool = False,
+        priority: RequestPriority = RequestPriority.USER_FACING,
+        deadline: float | None = None,
+        **kwargs,
+    ) -> dict:
+        """Posts a completion request to the OpenAI or Azure completions API."""
+
+        url, payload = LLMHandler._get_completion_request(
+            messages, tools, use_azure, **kwargs
+        )
+        tokens = LLMHandler._estimate_tokens(messages, tools, kwargs.get("max_tokens"))
+
+        async with LLMHandler._open_completion_response(
+            session, url, headers, payload, priority, tokens, deadline
+        ) as response:
+            response_json = await response.json()
+
+        if "choices" not in response_json:
+            print(f"'choices' not in response JSON: {response_json}")
+            raise ValueError("'choices' not in response JSON")
+
+        return response_json["choices"][0]["message"]
 
     @staticmethod
     async def call_completions_api(
@@ -88,6 +360,8 @@ class LLMHandler:
         tools: list | None = None,
         session: aiohttp.ClientSession | None = None,
         use_azure: bool = False,
+        priority: RequestPriority = RequestPriority.USER_FACING,
+        deadline: float | None = None,
         **kwargs,
     ) -> dict:
         """Calls the OpenAI completions API to generate a response to the user's message.
@@ -98,29 +372,42 @@ class LLMHandler:
 
         tools: A list of tools that the chatbot can use to perform specific actions, in the Open AI's tool's definition schema.
 
+        session: The aiohttp session to use. Defaults to the process-wide shared session.
+
+        priority: The priority class of the request when the provider is saturated.
+
+        deadline: Maximum time of the request including retries, in seconds. Defaults to the retry policy's deadline.
+
         Returns:
 
-        The response message dict.
+        The response message dict. If the provider is degraded or the deadline is exceeded, a canned reply.
 
         """
 
-        if use_azure:
-            headers = {
-                "Content-Type": "application/json",
-                "api-key": f"{LLMHandler._azure_openai_api_key}",
-            }
-        else:
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {LLMHandler._openai_api_key}",
-            }
+        headers = LLMHandler._get_headers(use_azure)
 
         try:
-            async with aiohttp.ClientSession() as session:
-                return await LLMHandler._post_completion_request(
-                    session, headers, messages, tools, use_azure=use_azure, **kwargs
-                )
+            if session is None:
+                session = await LLMHandler.get_session()
+            return await LLMHandler._post_completion_request(
+                session,
+                headers,
+                messages,
+                tools,
+                use_azure=use_azure,
+                priority=priority,
+                deadline=deadline,
+                **kwargs,
+            )
 
+        except ProviderUnavailableError as e:
+            print(f"Completion request failed fast: {e}")
+            return {
+                "role": "assistant",
+                "content": LLMHandler._provider_unavailable_message,
+                "function_call": None,
+                "tool_calls": None,
+            }
         except BadRequestError as e:
             error_json = await e.response.json()
             inner_error_type = (
@@ -145,6 +432,133 @@ class LLMHandler:
                 "tool_calls": None,
             }
         
+    @staticmethod
+    async def stream_completions_api(
+        messages: list,
+        tools: list | None = None,
+        session: aiohttp.ClientSession | None = None,
+        use_azure: bool = False,
+        priority: RequestPriority = RequestPriority.USER_FACING,
+        deadline: float | None = None,
+        speculative: bool = False,
+        **kwargs,
+    ) -> AsyncIterator[dict]:
+        """Streaming variant of call_completions_api, which yields the answer as it's generated.
+
+        Args:
+
+        messages: A list of messages exchanged between the user and the chatbot, in the Open AI's role-content dict style.
+
+        tools: A list of tools that the chatbot can use to perform specific actions, in the Open AI's tool's definition schema.
+
+        session: The aiohttp session to use. Defaults to the process-wide shared session.
+
+        priority: The priority class of the request when the provider is saturated.
+
+        deadline: Maximum time until the stream starts, including retries, in seconds. Defaults to the retry policy's deadline.
+
+        speculative: Whether the completion may be discarded before it's used. Its tokens are given back to the budget if it's cancelled.
+
+        Returns:
+
+        An async iterator over the events of the completion: {"type": "content", "delta": str} for each
+        piece of text, and a last {"type": "message", "message": dict} with the complete response message dict,
+        including the tool calls assembled from their streamed fragments.
+        """
+
+        headers = LLMHandler._get_headers(use_azure)
+        url, payload = LLMHandler._get_completion_request(
+            messages, tools, use_azure, stream=True, **kwargs
+        )
+        tokens = LLMHandler._estimate_tokens(messages, tools, kwargs.get("max_tokens"))
+        completion = StreamedCompletion()
+
+        try:
+            if session is None:
+                session = await LLMHandler.get_session()
+
+            async with LLMHandler._open_completion_response(
+                session,
+                url,
+                headers,
+                payload,
+                priority,
+                tokens,
+                deadline,
+                stream=True,
+                refund_on_cancel=speculative,
+            ) as response:
+                async for chunk in iter_sse_data(response.content):
+                    text = completion.add_chunk(chunk)
+                    if text:
+                        yield {"type": "content", "delta": text}
+
+            message = completion.get_message()
+
+        except ProviderUnavailableError as e:
+            print(f"Streamed completion request failed fast: {e}")
+            message = {
+                "role": "assistant",
+                "content": LLMHandler._provider_unavailable_message,
+                "function_call": None,
+                "tool_calls": None,
+            }
+            yield {"type": "content", "delta": message["content"]}
+        except Exception as e:
+            print(f"Unexpected error in stream completions api: {e}")
+            message = {
+                "role": "assistant",
+                "content": "An unexpected error occurred.",
+                "function_call": None,
+                "tool_calls": None,
+            }
+            yield {"type": "content", "delta": message["content"]}
+
+        yield {"type": "message", "message": message}
+
+    @staticmethod
+    async def call_moderations_api(
+        text: str, session: aiohttp.ClientSession | None = None, deadline: float | None = None
+    ) -> bool:
+        """Calls the OpenAI moderations API to check if a text is inappropriate.
+        The request goes through the same retries, deadline and circuit breaker as the completions.
+
+        Args:
+
+        text: The text to be checked.
+
+        session: The aiohttp session to use. Defaults to the process-wide shared session.
+
+        deadline: Maximum time for the request, including retries, in seconds. Defaults to the moderation deadline.
+
+        Returns:
+
+        True if the text was flagged by the moderation, otherwise False.
+
+        Raises:
+
+        ProviderUnavailableError: If the provider is degraded or the request couldn't complete before its deadline.
+        """
+
+        headers = LLMHandler._get_headers()
+
+        if session is None:
+            session = await LLMHandler.get_session()
+
+        tokens = len(text) // 4
+        async with LLMHandler._open_completion_response(
+            session,
+            "https://api.openai.com/v1/moderations",
+            headers,
+            {"input": text},
+            RequestPriority.GUARDRAIL,
+            tokens,
+            LLMHandler._moderation_deadline if deadline is None else deadline,
+        ) as response:
+            response_json = await response.json()
+
+        return response_json["results"][0]["flagged"]
+
     @staticmethod
     def call_completions_api_sync(
         messages: list,
@@ -152,22 +566,14 @@ class LLMHandler:
         use_azure: bool = False,
         **kwargs,
     ) -> dict:
-        """Synchronous wrapper for the asynchronous call_completions_api."""
-        loop = asyncio.get_event_loop()
-        if loop.is_running():
-            new_loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(new_loop)
-            loop = new_loop
-        else:
-            new_loop = loop
+        """Synchronous wrapper for the asynchronous call_completions_api, for code outside an event loop.
+        It runs on a temporary event loop with its own session, both closed when the call returns,
+        so the process-wide session is left untouched."""
 
-        result = loop.run_until_complete(
-            LLMHandler.call_completions_api(
-                messages, tools=tools, use_azure=use_azure, **kwargs
-            )
-        )
+        async def call() -> dict:
+            async with aiohttp.ClientSession() as session:
+                return await LLMHandler.call_completions_api(
+                    messages, tools=tools, session=session, use_azure=use_azure, **kwargs
+                )
 
-        if new_loop != loop:
-            new_loop.close()
-        
-        return result
+        return asyncio.run(call())
@@ -0,0 +1,466 @@
+import base64
+import fnmatch
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator
+
+from redis.exceptions import ResponseError, WatchError
+
+_wrong_type_message = "WRONGTYPE Operation against a key holding the wrong kind of value"
+
+
+class InMemoryBackend:
+    """In-process storage with the semantics of the Redis commands used by Database.
+
+    It serves the same subset of the redis.asyncio client interface, so Database runs
+    unchanged over it: string and list values, per-key TTLs, WATCH/MULTI transactions and
+    non-transactional pipelines. Being single-threaded, each command and each transaction
+    runs without interleaving.
+
+    Optionally, the least recently used keys are evicted above a maximum number of keys,
+    and every write is appended to a snapshot file that is replayed on startup.
+    """
+
+    def __init__(self, max_keys: int = 0, snapshot_path: str | None = None):
+        """
+        Args:
+
+        max_keys: Maximum number of keys before evicting the least recently used ones. 0 disables eviction.
+        snapshot_path: Path of the append-only snapshot file. None keeps the data in memory only.
+        """
+
+        self.max_keys = max_keys
+        self.snapshot_path = snapshot_path
+
+        # Key: bytes value or list of bytes values, from least to most recently used
+        self._data: OrderedDict[str, bytes | list[bytes]] = OrderedDict()
+        # Key: expiration time as a UNIX timestamp
+        self._expirations: dict[str, float] = {}
+        # Key: number of pipelines watching it, and number of writes since it's watched.
+        # Only watched keys are tracked, so the versions don't outlive the watches.
+        self._watchers: dict[str, int] = {}
+        self._versions: dict[str, int] = {}
+        self._snapshot_file = None
+        self._snapshot_entries = 0
+
+        if snapshot_path and os.path.exists(snapshot_path):
+            self._load_snapshot()
+
+    @staticmethod
+    def _key(key: str | bytes) -> str:
+        return key.decode("utf-8") if isinstance(key, bytes) else key
+
+    @staticmethod
+    def _value(value: str | bytes | int | float) -> bytes:
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode("utf-8")
+
+    def _lookup(self, key: str) -> bytes | list[bytes] | None:
+        """Gets the value of a key, dropping it if it expired, and marks it as recently used."""
+
+        expiration = self._expirations.get(key)
+        if expiration is not None and expiration <= time.time():
+            self._remove(key)
+            return None
+
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def _store(self, key: str, value: bytes | list[bytes], expiration: float | None) -> None:
+        """Writes a key, evicting the least recently used keys if needed."""
+
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if expiration is None:
+            self._expirations.pop(key, None)
+        else:
+            self._expirations[key] = expiration
+        self._changed(key)
+
+        while self.max_keys and len(self._data) > self.max_keys:
+            evicted_key = next(iter(self._data))
+            self._remove(evicted_key)
+
+    def _remove(self, key: str) -> bool:
+        if key not in self._data:
+            return False
+        del self._data[key]
+        self._expirations.pop(key, None)
+        self._changed(key)
+        return True
+
+    def _changed(self, key: str) -> None:
+        """Invalidates the watches of a key and appends its new state to the snapshot."""
+
+        if key in self._watchers:
+            self._versions[key] += 1
+        if self.snapshot_path:
+            self._append_to_snapshot(key)
+
+    def _watch(self, key: str) -> int:
+        """Starts tracking the writes of a key for a pipeline, returning its current version."""
+
+        self._watchers[key] = self._watchers.get(key, 0) + 1
+        return self._versions.setdefault(key, 0)
+
+    def _unwatch(self, key: str) -> None:
+        """Stops tracking the writes of a key once no pipeline watches it."""
+
+        self._watchers[key] -= 1
+        if self._watchers[key] <= 0:
+            del self._watchers[key]
+            del self._versions[key]
+
+    # Snapshot
+
+    def _get_snapshot_entry(self, key: str) -> str:
+        """Gets the snapshot line with the current state of a key, whose value is null if it was removed."""
+
+        value = self._data.get(key)
+        if isinstance(value, list):
+            encoded = [base64.b64encode(item).decode("ascii") for item in value]
+        elif value is not None:
+            encoded = base64.b64encode(value).decode("ascii")
+        else:
+            encoded = None
+
+        return json.dumps({"key": key, "value": encoded, "expiration": self._expirations.get(key)}) + "\n"
+
+    def _append_to_snapshot(self, key: str) -> None:
+        if self._snapshot_file is None:
+            self._snapshot_file = open(self.snapshot_path, "a", encoding="utf-8")
+        self._snapshot_file.write(self._get_snapshot_entry(key))
+        self._snapshot_file.flush()
+        self._snapshot_entries += 1
+
+        # Rewritten once most of its entries are outdated, so it doesn't grow forever
+        if self._snapshot_entries > 2 * len(self._data) + 1000:
+            self._rewrite_snapshot()
+
+    def _load_snapshot(self) -> None:
+        """Replays the snapshot file. Later entries of a key override the earlier ones."""
+
+        with open(self.snapshot_path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Entry cut short by a crash while it was written
+                    continue
+
+                key, value = entry["key"], entry["value"]
+                self._snapshot_entries += 1
+                if value is None:
+                    self._data.pop(key, None)
+                    self._expirations.pop(key, None)
+                    continue
+
+                if isinstance(value, list):
+                    self._data[key] = [base64.b64decode(item) for item in value]
+                else:
+                    self._data[key] = base64.b64decode(value)
+                self._data.move_to_end(key)
+                if entry["expiration"] is None:
+                    self._expirations.pop(key, None)
+                else:
+                    self._expirations[key] = entry["expiration"]
+
+        for key in [key for key, expiration in self._expirations.items() if expiration <= time.time()]:
+            self._data.pop(key, None)
+            self._expirations.pop(key, None)
+
+    def _rewrite_snapshot(self) -> None:
+        """Replaces the snapshot file with one entry per live key."""
+
+        if self._snapshot_file is not None:
+            self._snapshot_file.close()
+            self._snapshot_file = None
+
+        temporary_path = f"{self.snapshot_path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            for key in self._data:
+                file.write(self._get_snapshot_entry(key))
+        os.replace(temporary_path, self.snapshot_path)
+        self._snapshot_entries = len(self._data)
+
+    # Commands. Each one runs without awaiting, so it's atomic.
+
+    def _run(self, command: str, *args, **kwargs) -> Any:
+        return getattr(self, f"_command_{command}")(*args, **kwargs)
+
+    def _command_get(self, key) -> bytes | None:
+        value = self._lookup(self._key(key))
+        if isinstance(value, list):
+            raise ResponseError(_wrong_type_message)
+        return value
+
+    def _command_mget(self, keys, *args) -> list[bytes | None]:
+        keys = (list(keys) if isinstance(keys, (list, tuple)) else [keys]) + list(args)
+        values = []
+        for key in keys:
+            value = self._lookup(self._key(key))
+            values.append(None if isinstance(value, list) else value)
+        return values
+
+    def _command_set(self, key, value, ex: int | None = None, nx: bool = False) -> bool | None:
+        key = self._key(key)
+        if nx and self._lookup(key) is not None:
+            return None
+        self._store(key, self._value(value), time.time() + ex if ex else None)
+        return True
+
+    def _command_mset(self, mapping: dict) -> bool:
+        for key, value in mapping.items():
+            self._store(self._key(key), self._value(value), None)
+        return True
+
+    def _command_delete(self, *keys) -> int:
+        return sum(self._remove(self._key(key)) for key in keys if self._lookup(self._key(key)) is not None)
+
+    def _command_exists(self, *keys) -> int:
+        return sum(self._lookup(self._key(key)) is not None for key in keys)
+
+    def _command_expire(self, key, seconds: int, nx: bool = False) -> bool:
+        key = self._key(key)
+        if self._lookup(key) is None or (nx and key in self._expirations):
+            return False
+        self._expirations[key] = time.time() + seconds
+        self._changed(key)
+        return True
+
+    def _command_ttl(self, key) -> int:
+        key = self._key(key)
+        if self._lookup(key) is None:
+            return -2
+        expiration = self._expirations.get(key)
+        if expiration is None:
+            return -1
+        return round(expiration - time.time())
+
+    def _command_strlen(self, key) -> int:
+        value = self._lookup(self._key(key))
+        if isinstance(value, list):
+            raise ResponseError(_wrong_type_message)
+        return len(value or b"")
+
+    def _command_memory_usage(self, key) -> int | None:
+        key = self._key(key)
+        value = self._lookup(key)
+        if value is None:
+            return None
+        if isinstance(value, list):
+            return len(key) + sum(len(item) for item in value)
+        return len(key) + len(value)
+
+    def _command_type(self, key) -> bytes:
+        value = self._lookup(self._key(key))
+        if value is None:
+            return b"none"
+        return b"list" if isinstance(value, list) else b"string"
+
+    def _command_rpush(self, key, *values) -> int:
+        key = self._key(key)
+        stored = self._lookup(key)
+        if stored is not None and not isinstance(stored, list):
+            raise ResponseError(_wrong_type_message)
+        items = (stored or []) + [self._value(value) for value in values]
+        self._store(key, items, self._expirations.get(key))
+        return len(items)
+
+    def _command_ltrim(self, key, start: int, end: int) -> bool:
+        key = self._key(key)
+        stored = self._lookup(key)
+        if stored is None:
+            return True
+        if not isinstance(stored, list):
+            raise ResponseError(_wrong_type_message)
+        items = stored[self._slice(len(stored), start, end)]
+        if items:
+            self._store(key, items, self._expirations.get(key))
+        else:
+            self._remove(key)
+        return True
+
+    def _command_lrange(self, key, start: int, end: int) -> list[bytes]:
+        stored = self._lookup(self._key(key))
+        if stored is None:
+            return []
+        if not isinstance(stored, list):
+            raise ResponseError(_wrong_type_message)
+        return stored[self._slice(len(stored), start, end)]
+
+    def _command_llen(self, key) -> int:
+        stored = self._lookup(self._key(key))
+        if stored is not None and not isinstance(stored, list):
+            raise ResponseError(_wrong_type_message)
+        return len(stored or [])
+
+    @staticmethod
+    def _slice(length: int, start: int, end: int) -> slice:
+        """Converts an inclusive Redis range, with negative indexes from the end, into a slice."""
+
+        if start < 0:
+            start = max(length + start, 0)
+        if end < 0:
+            end = length + end
+        return slice(start, max(end + 1, start))
+
+    def _command_flushdb(self) -> bool:
+        for key in list(self._data):
+            self._remove(key)
+        return True
+
+    def _scan_keys(self, match: str | None = None) -> list[bytes]:
+        keys = []
+        for key in list(self._data):
+            if self._lookup(key) is not None and (match is None or fnmatch.fnmatchcase(key, match)):
+                keys.append(key.encode("utf-8"))
+        return keys
+
+    # Client interface
+
+    async def get(self, key):
+        return self._command_get(key)
+
+    async def mget(self, keys, *args):
+        return self._command_mget(keys, *args)
+
+    async def set(self, key, value, ex: int | None = None, nx: bool = False):
+        return self._command_set(key, value, ex=ex, nx=nx)
+
+    async def mset(self, mapping: dict):
+        return self._command_mset(mapping)
+
+    async def delete(self, *keys):
+        return self._command_delete(*keys)
+
+    async def exists(self, *keys):
+        return self._command_exists(*keys)
+
+    async def expire(self, key, seconds: int, nx: bool = False):
+        return self._command_expire(key, seconds, nx=nx)
+
+    async def ttl(self, key):
+        return self._command_ttl(key)
+
+    async def strlen(self, key):
+        return self._command_strlen(key)
+
+    async def memory_usage(self, key):
+        return self._command_memory_usage(key)
+
+    async def type(self, key):
+        return self._command_type(key)
+
+    async def rpush(self, key, *values):
+        return self._command_rpush(key, *values)
+
+    async def ltrim(self, key, start: int, end: int):
+        return self._command_ltrim(key, start, end)
+
+    async def lrange(self, key, start: int, end: int):
+        return self._command_lrange(key, start, end)
+
+    async def llen(self, key):
+        return self._command_llen(key)
+
+    async def flushdb(self):
+        return self._command_flushdb()
+
+    async def keys(self, pattern: str = "*") -> list[bytes]:
+        return self._scan_keys(pattern)
+
+    async def scan_iter(self, match: str | None = None, count: int | None = None) -> AsyncIterator[bytes]:
+        for key in self._scan_keys(match):
+            yield key
+
+    def pipeline(self, transaction: bool = True) -> "InMemoryPipeline":
+        return InMemoryPipeline(self, transaction)
+
+    async def aclose(self, close_connection_pool: bool = True) -> None:
+        """Closes the snapshot file. The data is kept, as a server's would be."""
+
+        if self._snapshot_file is not None:
+            self._snapshot_file.close()
+            self._snapshot_file = None
+
+
+class InMemoryPipeline:
+    """Pipeline of an InMemoryBackend, with the WATCH/MULTI semantics of a Redis pipeline.
+
+    After watch() commands run immediately, until multi() starts queueing them. execute()
+    fails with WatchError if any watched key was written since it was watched.
+    """
+
+    _commands: frozenset[str] = frozenset(
+        name[len("_command_") :] for name in dir(InMemoryBackend) if name.startswith("_command_")
+    )
+
+    def __init__(self, backend: InMemoryBackend, transaction: bool = True):
+        self._backend = backend
+        self._transaction = transaction
+        self._queued: list[tuple[str, tuple, dict]] = []
+        self._watched: dict[str, int] = {}
+        self._immediate = False
+
+    async def __aenter__(self) -> "InMemoryPipeline":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.reset()
+
+    def __getattr__(self, name: str):
+        if name not in InMemoryPipeline._commands:
+            raise AttributeError(name)
+
+        def command(*args, **kwargs):
+            if self._immediate:
+                return getattr(self._backend, name)(*args, **kwargs)
+            self._queued.append((name, args, kwargs))
+            return self
+
+        return command
+
+    async def watch(self, *keys) -> bool:
+        for key in keys:
+            key = InMemoryBackend._key(key)
+            if key not in self._watched:
+                self._watched[key] = self._backend._watch(key)
+        self._immediate = True
+        return True
+
+    def multi(self) -> None:
+        self._immediate = False
+
+    async def reset(self) -> None:
+        for key in self._watched:
+            self._backend._unwatch(key)
+        self._queued = []
+        self._watched = {}
+        self._immediate = False
+
+    async def execute(self, raise_on_error: bool = True) -> list:
+        try:
+            for key, version in self._watched.items():
+                if self._backend._versions[key] != version:
+                    raise WatchError("Watched variable changed.")
+
+            results = []
+            for name, args, kwargs in self._queued:
+                try:
+                    results.append(self._backend._run(name, *args, **kwargs))
+                except ResponseError as e:
+                    results.append(e)
+
+            if raise_on_error:
+                for result in results:
+                    if isinstance(result, ResponseError):
+                        raise result
+            return results
+        finally:
+            await self.reset()
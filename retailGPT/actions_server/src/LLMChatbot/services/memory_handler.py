@@ -1,52 +1,158 @@
 from typing import List
+import asyncio
 import json
+import os
 
 from openai.types.chat import ChatCompletionMessageToolCall
 
+from ..prompts import conversation_summary_prompt
+from .admission_controller import RequestPriority
 from .database import Database
+from .llm_handler import LLMHandler
+from .token_counter import TokenCounter
+from .user_session import UserSession
 
 class MemoryHandler:
     """Class that handles the interaction with the user's memory."""
 
-    _history_length: int = 6  # Number of messages to keep in the history
+    # Number of entries stored in the history. An assistant message with tool calls is stored
+    # in one entry along with the tool results, so trimming never splits them.
+    _history_length: int = int(os.environ.get("HISTORY_MAX_ENTRIES", 30))
+    # Tokens of history sent in the prompt. The newest entries that fit are sent, and at least the last one.
+    _history_token_budget: int = int(os.environ.get("HISTORY_TOKEN_BUDGET", 2000))
+    # Entries out of the token budget are folded into a running summary, sent after the system prompt
+    _summarize_history: bool = os.environ.get("HISTORY_SUMMARY", "true").lower() == "true"
+    _summary_max_words: int = int(os.environ.get("HISTORY_SUMMARY_MAX_WORDS", 150))
+    # Summaries running in the background, by user
+    _summary_tasks: dict[str, asyncio.Task] = {}
 
     @staticmethod
-    def get_history(user_id: str) -> List:
+    def _group_messages(messages: List[dict]) -> List[dict]:
         """
-        Gets the user's message history.
+        Groups messages into history entries, counting their tokens once so they are not counted on every turn.
 
         Args:
 
-        user_id: The user's ID.
+        messages: The messages, in order.
 
         Returns:
 
-        List of messages representing the user's message history.
+        List of entries, each one a dict with the keys "messages" and "tokens". An assistant message
+        with tool calls shares its entry with the tool results that follow it.
+        """
+        groups = []
+        for message in messages:
+            if message.get("role") == "tool" and groups and groups[-1][0].get("tool_calls"):
+                groups[-1].append(message)
+            else:
+                groups.append([message])
+
+        return [
+            {"messages": group, "tokens": sum(TokenCounter.count_message(message) for message in group)}
+            for group in groups
+        ]
+
+    @staticmethod
+    def _get_entry_messages(entry) -> List[dict]:
+        """Gets the messages of a history entry, including entries stored as a message or a list of messages."""
+
+        if isinstance(entry, list):
+            return entry
+        if "messages" in entry:
+            return entry["messages"]
+        return [entry]
+
+    @staticmethod
+    def _get_entry_tokens(entry) -> int:
+        """Gets the tokens of a history entry, counting them if they were not stored along."""
+
+        if isinstance(entry, dict) and "tokens" in entry:
+            return entry["tokens"]
+        return sum(TokenCounter.count_message(message) for message in MemoryHandler._get_entry_messages(entry))
+
+    @staticmethod
+    def _get_window_start(entries: List) -> int:
         """
-        user_data = Database.get_data(user_id)
-        if "history" in user_data:
-            messages = [message for message in user_data["history"]]
-        else:
-            messages = []
+        Finds the oldest history entry sent in the prompt: the newest entries that fit in the token budget
+        are sent, dropping the oldest first, and at least the last one.
+
+        Args:
 
+        entries: The history entries, in order.
+
+        Returns:
+
+        The index of the first entry of the window.
+        """
+        tokens = 0
+        start = len(entries)
+        while start > 0:
+            tokens += MemoryHandler._get_entry_tokens(entries[start - 1])
+            if start < len(entries) and tokens > MemoryHandler._history_token_budget:
+                break
+            start -= 1
+        return start
+
+    @staticmethod
+    def _get_entries_messages(entries: List) -> List[dict]:
+        """Gets the messages of some history entries, in order."""
+
+        messages = []
+        for entry in entries:
+            messages.extend(MemoryHandler._get_entry_messages(entry))
         return messages
 
     @staticmethod
-    def _set_history(user_id: str, history: List) -> None:
+    def _select_window(entries: List) -> List[dict]:
         """
-        Sets the user's message history.
+        Selects the history entries sent in the prompt.
+
+        Args:
+
+        entries: The history entries, in order.
+
+        Returns:
+
+        List of messages of the selected entries, in order.
+        """
+        return MemoryHandler._get_entries_messages(entries[MemoryHandler._get_window_start(entries) :])
+
+    @staticmethod
+    async def get_history(user_id: str) -> List:
+        """
+        Gets the user's message history.
+
+        Args:
+
+        user_id: The user's ID.
+
+        Returns:
+
+        List of messages representing the user's message history, within the token budget.
+        """
+        entries = await Database.get_field(user_id, "history", [])
+        return MemoryHandler._select_window(entries)
+
+    @staticmethod
+    async def get_history_with_message(user_id: str, message: dict) -> List:
+        """
+        Gets the user's message history as it would be after adding a message, without storing it.
 
         Args:
 
         user_id: The user's ID.
-        history: The user's message history.
+        message: The message to add to the history.
+
+        Returns:
+
+        List of messages representing the user's message history within the token budget, ending with the given message.
         """
-        user_data = Database.get_data(user_id)
-        user_data["history"] = history
-        Database.set_data(user_id, user_data)
+        entries = await Database.get_field(user_id, "history", [])
+        entries += MemoryHandler._group_messages([message])
+        return MemoryHandler._select_window(entries)
 
     @staticmethod
-    def add_message_to_history(user_id: str, message: dict) -> None:
+    async def add_message_to_history(user_id: str, message: dict) -> None:
         """
         Adds a message to the user's message history.
 
@@ -55,12 +161,149 @@ class MemoryHandler:
         user_id: The user's ID.
         message: The message to add to the history.
         """
-        history = MemoryHandler.get_history(user_id)
-        history.append(message)
-        MemoryHandler._set_history(user_id, history[-MemoryHandler._history_length :])
+        await MemoryHandler.add_messages_to_history(user_id, [message])
 
     @staticmethod
-    def add_cached_tool_calls(user_id: str, tool_calls: list[ChatCompletionMessageToolCall]):
+    async def add_messages_to_history(user_id: str, messages: List[dict]) -> None:
+        """
+        Adds some messages to the user's message history, appending them without rewriting it.
+        Tool results must be added along with the assistant message that called the tools.
+
+        Args:
+
+        user_id: The user's ID.
+        messages: The messages to add to the history, in order.
+        """
+        await Database.append_to_list(
+            user_id, "history", MemoryHandler._group_messages(messages), MemoryHandler._history_length
+        )
+
+    @staticmethod
+    async def get_summary(user_id: str) -> str | None:
+        """
+        Gets the summary of the user's messages that no longer fit in the prompt.
+
+        Args:
+
+        user_id: The user's ID.
+
+        Returns:
+
+        The summary, or None if no message was summarized yet.
+        """
+        return await Database.get_field(user_id, "summary")
+
+    @staticmethod
+    def schedule_summary(user_id: str) -> None:
+        """
+        Starts folding the history entries that no longer fit in the prompt into the user's summary,
+        in the background. A user has at most one summary running at a time.
+
+        Args:
+
+        user_id: The user's ID.
+        """
+        if not MemoryHandler._summarize_history:
+            return
+
+        task = MemoryHandler._summary_tasks.get(user_id)
+        if task is not None and not task.done() and task.get_loop() is asyncio.get_running_loop():
+            return
+
+        def forget(done_task: asyncio.Task) -> None:
+            if MemoryHandler._summary_tasks.get(user_id) is done_task:
+                del MemoryHandler._summary_tasks[user_id]
+
+        task = asyncio.create_task(MemoryHandler._update_summary(user_id))
+        MemoryHandler._summary_tasks[user_id] = task
+        task.add_done_callback(forget)
+
+    @staticmethod
+    async def _update_summary(user_id: str) -> None:
+        """
+        Folds the history entries that no longer fit in the prompt into the user's summary,
+        and removes them from the history.
+
+        Args:
+
+        user_id: The user's ID.
+        """
+        # It outlives the turn that started it, so it works on the stored data
+        UserSession.detach()
+
+        try:
+            data = await Database.get_fields(user_id, ["history", "summary"])
+            entries = data.get("history", [])
+            overflow = entries[: MemoryHandler._get_window_start(entries)]
+            if not overflow:
+                return
+
+            summary = await MemoryHandler._summarize(
+                data.get("summary"), MemoryHandler._get_entries_messages(overflow)
+            )
+            if summary is None:
+                return
+
+            def fold_overflow(stored: dict) -> dict:
+                stored_entries = stored.get("history", [])
+                # Discarded if other turns changed the summarized entries or the summary meanwhile
+                if stored_entries[: len(overflow)] != overflow or stored.get("summary") != data.get("summary"):
+                    return {}
+                return {"history": stored_entries[len(overflow) :], "summary": summary}
+
+            if await Database.update_fields(user_id, ["history", "summary"], fold_overflow):
+                print(f"Summarized {len(overflow)} history entries of user {user_id}")
+
+        except Exception as e:
+            print(f"Could not update the summary of user {user_id}: {e}")
+
+    @staticmethod
+    async def _summarize(summary: str | None, messages: List[dict]) -> str | None:
+        """
+        Updates a summary with some messages, using the LLM.
+
+        Args:
+
+        summary: The current summary, if any.
+        messages: The messages to add to the summary.
+
+        Returns:
+
+        The updated summary, or None if the LLM didn't give one.
+        """
+        prompt = conversation_summary_prompt.format(
+            max_words=MemoryHandler._summary_max_words,
+            summary=summary or "No summary yet.",
+            messages=MemoryHandler._format_messages(messages),
+        )
+        response = await LLMHandler.call_completions_api(
+            [{"role": "system", "content": prompt}],
+            priority=RequestPriority.BACKGROUND,
+            response_format={"type": "json_object"},
+        )
+
+        try:
+            return json.loads(response["content"])["summary"]
+        except (TypeError, ValueError, KeyError):
+            # Canned replies of failed requests are not JSON
+            print("Could not parse the summary: ", response["content"])
+            return None
+
+    @staticmethod
+    def _format_messages(messages: List[dict]) -> str:
+        """Formats messages as a transcript, one line per message."""
+
+        lines = []
+        for message in messages:
+            for tool_call in message.get("tool_calls") or []:
+                function = tool_call.get("function", {})
+                lines.append(f"{message['role']}: called {function.get('name')}({function.get('arguments')})")
+            if message.get("content"):
+                lines.append(f"{message['role']}: {message['content']}")
+        return "\n".join(lines)
+
+    @staticmethod
+    async def add_cached_tool_calls(user_id: str, tool_calls: list[ChatCompletionMessageToolCall]):
         """
         Adds generated tool calls to the user's cache
 
@@ -69,19 +312,15 @@ class MemoryHandler:
         user_id: The user's ID
         tool_calls: list of tool calls to be added to the cache
         """
-        user_data = Database.get_data(user_id)
         tool_calls = [tool_call.model_dump_json() for tool_call in tool_calls]
-        if "tool_calls" in user_data:
-            user_data["tool_calls"].extend(tool_calls)
-        else:
-            user_data["tool_calls"] = tool_calls
+        await Database.update_field(
+            user_id, "tool_calls", lambda cached_tool_calls: cached_tool_calls + tool_calls, []
+        )
 
         print("Data added to cache: ", tool_calls)
 
-        Database.set_data(user_id, user_data)
-
     @staticmethod
-    def get_cached_tool_calls(user_id: str) -> list[ChatCompletionMessageToolCall]:
+    async def get_cached_tool_calls(user_id: str) -> list[ChatCompletionMessageToolCall]:
         """
         Gets user's cached tool calls
 
@@ -93,10 +332,7 @@ class MemoryHandler:
 
         List of cached tool calls 
         """
-        user_data = Database.get_data(user_id)
-        if "tool_calls" in user_data:
-            tool_calls = [ChatCompletionMessageToolCall.model_validate_json(tool_call) for tool_call in user_data["tool_calls"]]
-        else:
-            tool_calls = []
+        cached_tool_calls = await Database.get_field(user_id, "tool_calls", [])
+        tool_calls = [ChatCompletionMessageToolCall.model_validate_json(tool_call) for tool_call in cached_tool_calls]
 
         return tool_calls
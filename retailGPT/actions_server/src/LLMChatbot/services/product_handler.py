@@ -1,23 +1,22 @@
 import json
+import os
 from pathlib import Path
 from typing import List
 
 import aiohttp
 from ..prompts import product_search_prompt
 from ..schemas import Product
+from .admission_controller import RequestPriority
+from .catalog_store import CatalogStore
 from .database import Database
+from .embedding_index import EmbeddingIndex
+from .lexical_index import LexicalIndex
 from .llm_handler import LLMHandler
 
 
 class ProductHandler:
     """Handles the product recommendation based on the user's demand."""
 
-    _mocked_products_path: str = (
-        Path(__file__).resolve().parent.parent.parent.parent.parent
-        / "datasets"
-        / "sunglasses_products.json"
-    )
-
     _purchase_history_path: str = (
         Path(__file__).resolve().parent.parent.parent.parent.parent
         / "datasets"
@@ -28,37 +27,242 @@ class ProductHandler:
         "Sorry, we couldn't find any product in the catalog that meets your demand."
     )
     _recommendation_max_size: int = 5
+    # Sunglasses don't have volume like beverages, so every pair counts as 0.001L
+    _unit_volume_liters: float = 0.001
+    # Number of catalog products shortlisted by the lexical index and sent to the search prompt
+    _retrieval_top_k: int = int(os.environ.get("PRODUCT_RETRIEVAL_TOP_K", 15))
+
+    # Search mode: "llm" always asks the LLM, "semantic" answers from the embedding index
+    # and only asks the LLM when no product is similar enough to the demand
+    _search_mode: str = os.environ.get("PRODUCT_SEARCH_MODE", "llm")
+    _semantic_min_score: float = float(os.environ.get("PRODUCT_SEMANTIC_MIN_SCORE", 0.3))
+    # Results less similar than this fraction of the best result's score are discarded
+    _semantic_relative_score: float = 0.75
+
+    # Rendered catalog text per region and lexical index, valid for the catalog version they were built from
+    _regional_catalog_cache: dict[str, str] = {}
+    _regional_catalog_version: int | None = None
+    _lexical_index: LexicalIndex | None = None
+    _lexical_index_version: int | None = None
+    _embedding_index: EmbeddingIndex | None = None
+    _embedding_index_version: int | None = None
+
+    @staticmethod
+    def _get_catalog_region(zipcode: str) -> str:
+        """Gets the catalog region of a zipcode.
+        Only the first digit of the zipcode determines the catalog: '0' has no products,
+        '9' has a limited catalog and every other digit has the full catalog.
+
+        Args:
+
+        zipcode: The user's ZIP code.
+
+        Returns:
+
+        The region key used to cache the regional catalog.
+        """
+
+        if zipcode[0] in ("0", "9"):
+            return zipcode[0]
+        return "*"
+
+    @staticmethod
+    def _get_regional_indexes(region: str) -> range:
+        """Gets the catalog positions of the products available in a catalog region.
+
+        Args:
+
+        region: The region key, as returned by _get_catalog_region.
+
+        Returns:
+
+        The positions of the available products in the catalog.
+        """
+
+        catalog_size = len(CatalogStore.get_products())
+        if region == "0":
+            return range(0)
+        if region == "9":
+            return range(0, catalog_size, 3)
+        return range(catalog_size)
+
+    @staticmethod
+    def _get_regional_products(region: str) -> list[Product]:
+        """Gets the products available in a catalog region.
+
+        Args:
+
+        region: The region key, as returned by _get_catalog_region.
+
+        Returns:
+
+        The products available in the region, in catalog order.
+        """
+
+        products = CatalogStore.get_products()
+        return [products[index] for index in ProductHandler._get_regional_indexes(region)]
+
+    @staticmethod
+    def _format_catalog_line(product: Product) -> str:
+        """Formats a product as a line of the catalog sent to the search prompt.
+
+        Args:
+
+        product: The product to be formatted.
+
+        Returns:
+
+        The catalog line of the product.
+        """
+
+        name = product["product_name"]
+        brand = product["brand"]
+        color = product["color"]
+        style = product["style"]
+        uv_protection = product["uv_protection"]
+        unit_price = round(product["full_price"], 2)
+        return f"Name: {name} - Brand: {brand} - Color: {color} - Style: {style} - UV Protection: {uv_protection} - Price: R${unit_price}\n"
 
     @staticmethod
     def _get_product_catalog(zipcode) -> str:
-        """Gets the product catalog available in the user location from the mocked products dataset.
+        """Gets the product catalog available in the user location from the catalog store.
         Only considers the first digit of the zipcode to determine the catalog.
+        The catalog text is rendered once per region and cached until the catalog is reloaded.
 
         Returns:
 
         The product catalog.
         """
 
-        catalog_string = ""
-        if zipcode[0] == "0":
-            return catalog_string
+        catalog_version = CatalogStore.get_version()
+        if ProductHandler._regional_catalog_version != catalog_version:
+            ProductHandler._regional_catalog_cache = {}
+            ProductHandler._regional_catalog_version = catalog_version
+
+        region = ProductHandler._get_catalog_region(zipcode)
+        catalog_string = ProductHandler._regional_catalog_cache.get(region)
+        if catalog_string is None:
+            catalog_string = "".join(
+                ProductHandler._format_catalog_line(product)
+                for product in ProductHandler._get_regional_products(region)
+            )
+            ProductHandler._regional_catalog_cache[region] = catalog_string
 
-        with open(ProductHandler._mocked_products_path, "r") as file:
-            mocked_products_dataset = json.load(file)
-            products = mocked_products_dataset["products"]
+        return catalog_string
 
-            for index, product in enumerate(products):
-                if zipcode[0] == "9" and index % 3 > 0:
-                    continue
-                name = product["product_name"]
-                brand = product["brand"]
-                color = product["color"]
-                style = product["style"]
-                uv_protection = product["uv_protection"]
-                unit_price = round(product["full_price"], 2)
-                catalog_string += f"Name: {name} - Brand: {brand} - Color: {color} - Style: {style} - UV Protection: {uv_protection} - Price: R${unit_price}\n"
+    @staticmethod
+    def _get_lexical_index() -> LexicalIndex:
+        """Gets the lexical index of the catalog, rebuilding it if the catalog was reloaded.
 
-        return catalog_string
+        Returns:
+
+        The lexical index, whose document positions match the catalog order.
+        """
+
+        catalog_version = CatalogStore.get_version()
+        if ProductHandler._lexical_index_version != catalog_version:
+            ProductHandler._lexical_index = LexicalIndex(CatalogStore.get_products())
+            ProductHandler._lexical_index_version = catalog_version
+
+        return ProductHandler._lexical_index
+
+    @staticmethod
+    def _get_embedding_index() -> EmbeddingIndex:
+        """Gets the embedding index of the catalog, rebuilding it if the catalog was reloaded.
+        When the catalog comes from a dataset file, the embeddings are cached next to it.
+
+        Returns:
+
+        The embedding index, whose rows match the catalog order.
+        """
+
+        catalog_version = CatalogStore.get_version()
+        if ProductHandler._embedding_index_version != catalog_version:
+            products = CatalogStore.get_products()
+            source_path = CatalogStore.get_source_path()
+            if source_path is None:
+                embedding_index = EmbeddingIndex.build(products)
+            else:
+                embedding_index = EmbeddingIndex.load_or_build(
+                    products, source_path.with_suffix(".embeddings.npy")
+                )
+            ProductHandler._embedding_index = embedding_index
+            ProductHandler._embedding_index_version = catalog_version
+
+        return ProductHandler._embedding_index
+
+    @staticmethod
+    def _semantic_search_engine(product_query: str, zipcode: str) -> list[Product]:
+        """Searches the products most similar to the user's demand in the embedding index, without calling the LLM.
+
+        Args:
+
+        product_query: The user's demand for a product, e.g. 'A light beer'.
+        zipcode: The user's ZIP code.
+
+        Returns:
+
+        The products similar enough to the demand, most similar first. Empty if none is.
+        """
+
+        region = ProductHandler._get_catalog_region(zipcode)
+        matches = ProductHandler._get_embedding_index().search(
+            product_query,
+            ProductHandler._recommendation_max_size,
+            candidates=ProductHandler._get_regional_indexes(region),
+        )
+        if not matches:
+            return []
+
+        best_score = matches[0][1]
+        min_score = max(
+            ProductHandler._semantic_min_score,
+            best_score * ProductHandler._semantic_relative_score,
+        )
+
+        products = CatalogStore.get_products()
+        return [products[index] for index, score in matches if score >= min_score]
+
+    @staticmethod
+    def _get_product_shortlist(product_query: str, zipcode: str) -> str:
+        """Gets the catalog text restricted to the products that best match the user's demand.
+        If the regional catalog is small enough, the whole regional catalog is used.
+
+        Args:
+
+        product_query: The user's demand for a product, e.g. 'A light beer'.
+        zipcode: The user's ZIP code.
+
+        Returns:
+
+        The shortlisted product catalog, with at most _retrieval_top_k products.
+        """
+
+        region = ProductHandler._get_catalog_region(zipcode)
+        regional_indexes = ProductHandler._get_regional_indexes(region)
+        top_k = ProductHandler._retrieval_top_k
+
+        if len(regional_indexes) <= top_k:
+            return ProductHandler._get_product_catalog(zipcode)
+
+        matches = ProductHandler._get_lexical_index().search(
+            product_query, top_k, candidates=regional_indexes
+        )
+        shortlist = [index for index, _ in matches]
+
+        # Vague demands match few products, so the shortlist is completed in catalog order
+        if len(shortlist) < top_k:
+            matched = set(shortlist)
+            for index in regional_indexes:
+                if index not in matched:
+                    shortlist.append(index)
+                    if len(shortlist) == top_k:
+                        break
+
+        products = CatalogStore.get_products()
+        return "".join(
+            ProductHandler._format_catalog_line(products[index]) for index in shortlist
+        )
 
     @staticmethod
     def _get_purchase_history_dataset() -> List[str]:
@@ -99,6 +303,29 @@ class ProductHandler:
 
         return purchase_history_dataset[index]
 
+    @staticmethod
+    def _build_search_prompt(product_query: str, zipcode: str) -> str:
+        """Builds the system prompt of the search engine.
+
+        Args:
+
+        product_query: The user's demand for a product, e.g. 'A light beer'.
+        zipcode: The user's ZIP code.
+
+        Returns:
+
+        The search prompt, containing only the shortlisted products.
+        """
+
+        catalog = ProductHandler._get_product_shortlist(product_query, zipcode)
+        purchase_history = ProductHandler._get_purchase_history(zipcode)
+
+        return product_search_prompt.format(
+            product_catalog=catalog,
+            search=product_query,
+            purchase_history=purchase_history,
+        )
+
     @staticmethod
     async def _mocked_search_engine(
         product_query: str,
@@ -111,41 +338,28 @@ class ProductHandler:
 
         product_query: The user's demand for a product, e.g. 'A light beer'.
         zipcode: The user's ZIP code.
-        session: The aiohttp ClientSession used for concurrent searching.
+        session: The aiohttp session to use. Defaults to the LLMHandler's shared session.
 
         Returns:
 
         The product recommendations based on the user's demand, in the form of a list of dicts.
         """
 
-        catalog = ProductHandler._get_product_catalog(zipcode)
-        purchase_history = ProductHandler._get_purchase_history(zipcode)
-
-        system_prompt = product_search_prompt.format(
-            product_catalog=catalog,
-            search=product_query,
-            purchase_history=purchase_history,
-        )
+        system_prompt = ProductHandler._build_search_prompt(product_query, zipcode)
 
         llm_response = await LLMHandler.call_completions_api(
             [{"role": "system", "content": system_prompt}],
             session=session,
+            priority=RequestPriority.SEARCH,
             response_format={"type": "json_object"},
         )
 
         llm_response = json.loads(llm_response["content"])
 
-        with open(ProductHandler._mocked_products_path, "r") as file:
-            mocked_products_dataset = json.load(file)
-
-        available_products = mocked_products_dataset["products"]
-        recommended_products = [
-            product.lower() for product in llm_response["recommended_products"]
-        ]
-
         recommendation = []
-        for product in available_products:
-            if product["product_name"].lower() in recommended_products:
+        for product_name in llm_response["recommended_products"]:
+            product = CatalogStore.get_by_name(product_name)
+            if product is not None and product not in recommendation:
                 recommendation.append(product)
 
         return recommendation[: ProductHandler._recommendation_max_size]
@@ -179,26 +393,61 @@ class ProductHandler:
         return formatted_recommendation
 
     @staticmethod
-    def _add_recommended_product_data(user_id: str, product_data: dict) -> None:
-        """Adds a new recommended product to the database that tracks the user's recommended products.
+    def index_recommendations(recommended_products: dict | list) -> dict[str, int]:
+        """Indexes recommended products by normalized name, converting the product copies stored by older versions.
+        It's meant to run once, when the stored recommendations are read or written back; an index
+        that is already current is returned as is, without going over it.
 
         Args:
 
-        product_data: The product data to be added in the database.
+        recommended_products: The stored recommended products.
+
+        Returns:
+
+        Dict with the row_id of the recommended products by normalized name. Older copies
+        of products that are no longer in the catalog are left out.
         """
 
-        user_data = Database.get_data(user_id)
+        if isinstance(recommended_products, dict):
+            # The recommendations are always written whole, so the first value tells their format
+            if isinstance(next(iter(recommended_products.values()), 0), int):
+                return recommended_products
+            recommended_products = list(recommended_products.values())
 
-        if "recommended_products" in user_data:
-            user_data["recommended_products"].append(product_data)
-        else:
-            user_data["recommended_products"] = [product_data]
+        index = {}
+        for product in recommended_products:
+            row_id = product.get("row_id")
+            if row_id is None:
+                catalog_product = CatalogStore.get_by_name(product["product_name"])
+                if catalog_product is None:
+                    continue
+                row_id = catalog_product["row_id"]
+            index[CatalogStore.normalize_key(product["product_name"])] = row_id
 
-        Database.set_data(user_id, user_data)
+        return index
 
     @staticmethod
-    def _get_recommendations_data(user_id: str) -> list[Product]:
-        """Gets all the data from products that were already recommended to the user.
+    async def _add_recommended_products_data(user_id: str, products: list[Product]) -> None:
+        """Adds recommended products to the database that tracks the user's recommended products.
+        Only the products' row_id is stored, and products recommended again replace their earlier entry.
+
+        Args:
+
+        user_id: The user's ID.
+        products: The data of the recommended products.
+        """
+
+        def add_products(recommended_products: dict | list) -> dict:
+            recommended_products = ProductHandler.index_recommendations(recommended_products)
+            for product in products:
+                recommended_products[CatalogStore.normalize_key(product["product_name"])] = product["row_id"]
+            return recommended_products
+
+        await Database.update_field(user_id, "recommended_products", add_products, {})
+
+    @staticmethod
+    async def _get_recommendations_data(user_id: str) -> dict[str, int]:
+        """Gets the products that were already recommended to the user.
 
         Args:
 
@@ -206,18 +455,15 @@ class ProductHandler:
 
         Returns:
 
-        List containing the recommended products' data stored in the database.
+        Dict with the row_id of the recommended products, by normalized name.
         """
 
-        user_data = Database.get_data(user_id)
-        if "recommended_products" in user_data:
-            return user_data["recommended_products"]
-        else:
-            return []
+        recommended_products = await Database.get_field(user_id, "recommended_products", {})
+        return ProductHandler.index_recommendations(recommended_products)
 
     @staticmethod
-    def _get_product_data(user_id: str, product_name: str) -> dict | None:
-        """Gets the data of a product using the recommendations in the user conversation.
+    async def _get_product_data(user_id: str, product_name: str) -> Product | None:
+        """Gets the catalog data of a product using the recommendations in the user conversation.
 
         Args:
 
@@ -229,16 +475,32 @@ class ProductHandler:
         The data of the product or None, if the product doesn't exist in the recommendations.
         """
 
-        recommended_products = ProductHandler._get_recommendations_data(user_id)
+        recommended_products = await ProductHandler._get_recommendations_data(user_id)
+        return ProductHandler.find_recommended_product(recommended_products, product_name)
 
-        for product in recommended_products:
-            if product["product_name"].lower() == product_name.lower():
-                return product
+    @staticmethod
+    def find_recommended_product(recommended_products: dict[str, int], product_name: str) -> Product | None:
+        """Finds a product in the recommendations of a user, in constant time.
 
-        return None
+        Args:
+
+        recommended_products: The row_id of the recommended products by normalized name, as given by index_recommendations.
+        product_name: The name of the product.
+
+        Returns:
+
+        The catalog product or None, if the product doesn't exist in the recommendations.
+        """
+
+        row_id = recommended_products.get(CatalogStore.normalize_key(product_name))
+
+        if row_id is None:
+            return None
+
+        return CatalogStore.get_by_row_id(row_id)
 
     @staticmethod
-    def product_was_recommended(user_id: str, product_name: str) -> bool:
+    async def product_was_recommended(user_id: str, product_name: str) -> bool:
         """Checks if a product was already recommended to the user.
 
         Args:
@@ -251,12 +513,27 @@ class ProductHandler:
         True if the product was already recommended to the user, False otherwise.
         """
 
-        product_data = ProductHandler._get_product_data(user_id, product_name)
+        product_data = await ProductHandler._get_product_data(user_id, product_name)
 
         return product_data is not None
 
     @staticmethod
-    def get_product_unit_price(user_id: str, product_name: str) -> float | None:
+    async def get_recommended_product(user_id: str, product_name: str) -> Product | None:
+        """Gets a product using the recommendations in the user conversation.
+
+        Args:
+
+        user_id: The user's ID.
+        product_name: The name of the product.
+
+        Returns:
+
+        The catalog product or None, if the product doesn't exist in the recommendations.
+        """
+        return await ProductHandler._get_product_data(user_id, product_name)
+
+    @staticmethod
+    async def get_product_unit_price(user_id: str, product_name: str) -> float | None:
         """Gets the unit price of a product using the recommendations in the user conversation.
 
         Args:
@@ -269,7 +546,7 @@ class ProductHandler:
         The price of the product or None, if the product doesn't exist in the recommendations.
         """
 
-        product_data = ProductHandler._get_product_data(user_id, product_name)
+        product_data = await ProductHandler._get_product_data(user_id, product_name)
 
         if product_data is not None:
             product_price = round(product_data["full_price"], 2)
@@ -278,7 +555,7 @@ class ProductHandler:
         return None
 
     @staticmethod
-    def get_product_unit_volume(user_id: str, product_name: str) -> float | None:
+    async def get_product_unit_volume(user_id: str, product_name: str) -> float | None:
         """Gets the unit volume of a product in liters using the recommendations in the user conversation.
         For sunglasses, we'll use a fixed volume since they don't have volume like beverages.
 
@@ -292,11 +569,10 @@ class ProductHandler:
         The volume of the product in liters or None, if the product doesn't exist in the recommendations.
         """
 
-        product_data = ProductHandler._get_product_data(user_id, product_name)
+        product_data = await ProductHandler._get_product_data(user_id, product_name)
 
         if product_data is not None:
-            # For sunglasses, use a fixed volume (0.001L per pair)
-            return 0.001
+            return ProductHandler._unit_volume_liters
 
         return None
 
@@ -311,7 +587,7 @@ class ProductHandler:
 
         Args:
 
-        session: The aiohttp ClientSession used for concurrent searching.
+        session: The aiohttp session to use. Defaults to the LLMHandler's shared session.
         user_id: The user's ID.
         product_query: The user's demand for a product, e.g. 'A light beer'.
         zipcode: The user's ZIP code.
@@ -321,15 +597,19 @@ class ProductHandler:
         The product recommendation based on the user's demand.
         """
 
-        search_output = await ProductHandler._mocked_search_engine(
-            product_query, zipcode, session
-        )
+        search_output = []
+        if ProductHandler._search_mode == "semantic":
+            search_output = ProductHandler._semantic_search_engine(product_query, zipcode)
+
+        if not search_output:
+            search_output = await ProductHandler._mocked_search_engine(
+                product_query, zipcode, session
+            )
 
         if not search_output:
             return ProductHandler._product_not_found_message
 
-        for product in search_output:
-            ProductHandler._add_recommended_product_data(user_id, product)
+        await ProductHandler._add_recommended_products_data(user_id, search_output)
 
         formatted_recommendation = ProductHandler._format_product_recommendation(
             search_output
@@ -0,0 +1,183 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+
+class ProviderUnavailableError(Exception):
+    """Base of the errors raised when the provider can't serve a request, answered with a canned reply."""
+
+
+class CircuitOpenError(ProviderUnavailableError):
+    """Raised when a request is refused because the circuit breaker is open."""
+
+
+class DeadlineExceededError(ProviderUnavailableError):
+    """Raised when a request can't complete before its deadline."""
+
+
+class RetriesExhaustedError(ProviderUnavailableError):
+    """Raised when a request failed on every attempt allowed by the retry policy."""
+
+
+class RetryPolicy:
+    """Decides if and when a failed provider request is retried.
+
+    Delays follow a capped exponential backoff with full jitter, a Retry-After
+    header sent by the provider takes precedence, and no retry is scheduled
+    past the request deadline.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 20.0,
+        deadline: float = 60.0,
+        retry_statuses: tuple[int, ...] = (429, 500, 502, 503, 504),
+    ):
+        """
+        Args:
+
+        max_attempts: Maximum number of attempts, including the first one.
+        base_delay: Backoff of the first retry before jitter, in seconds.
+        max_delay: Maximum backoff between two attempts, in seconds.
+        deadline: Maximum total time of a request, including its retries, in seconds.
+        retry_statuses: HTTP statuses worth retrying.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.retry_statuses = retry_statuses
+
+    def should_retry_status(self, status: int) -> bool:
+        """Checks if a response status is transient and worth retrying."""
+        return status in self.retry_statuses
+
+    @staticmethod
+    def parse_retry_after(value: str | None) -> float | None:
+        """Parses a Retry-After header.
+
+        Args:
+
+        value: The header value, either a number of seconds or an HTTP date.
+
+        Returns:
+
+        The number of seconds to wait or None, if the header is missing or invalid.
+        """
+
+        if not value:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            pass
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+    def get_delay(self, attempt: int, retry_after: str | None = None) -> float:
+        """Gets how long to wait before retrying.
+
+        Args:
+
+        attempt: The number of failed attempts so far, starting at 1.
+        retry_after: The Retry-After header of the failed response, if any.
+
+        Returns:
+
+        The delay in seconds.
+        """
+
+        server_delay = RetryPolicy.parse_retry_after(retry_after)
+        if server_delay is not None:
+            return server_delay
+
+        backoff = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(0, backoff)
+
+
+class CircuitBreaker:
+    """Stops calling a degraded provider for a while after consecutive failures.
+
+    While closed, requests flow normally. After failure_threshold consecutive
+    failures it opens and refuses requests for reset_timeout seconds. Then it
+    lets a single probe request through (half-open): a success closes it again
+    and a failure reopens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        Args:
+
+        failure_threshold: Consecutive failures that open the circuit.
+        reset_timeout: Time the circuit stays open before a probe request, in seconds.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._state = CircuitBreaker.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._state == CircuitBreaker.OPEN and self._reset_timeout_elapsed():
+            return CircuitBreaker.HALF_OPEN
+        return self._state
+
+    def _reset_timeout_elapsed(self) -> bool:
+        return time.monotonic() - self._opened_at >= self.reset_timeout
+
+    def is_open(self) -> bool:
+        """Checks if requests are currently being refused, without taking the probe slot."""
+        state = self.state
+        return state == CircuitBreaker.OPEN or (
+            state == CircuitBreaker.HALF_OPEN and self._probe_in_flight
+        )
+
+    def allow_request(self) -> bool:
+        """Checks if a request may be sent, taking the probe slot when half-open.
+
+        Returns:
+
+        True if the request may be sent, otherwise False.
+        """
+
+        state = self.state
+        if state == CircuitBreaker.CLOSED:
+            return True
+        if state == CircuitBreaker.HALF_OPEN and not self._probe_in_flight:
+            self._state = CircuitBreaker.HALF_OPEN
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def release_probe(self) -> None:
+        """Frees the probe slot of a request that ended without a result, e.g. when cancelled."""
+        self._probe_in_flight = False
+
+    def record_success(self) -> None:
+        """Records a successful request, closing the circuit."""
+
+        self._state = CircuitBreaker.CLOSED
+        self._failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        """Records a failed request, opening the circuit if needed."""
+
+        self._failures += 1
+        if self._state == CircuitBreaker.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self._state != CircuitBreaker.OPEN:
+                print(f"Circuit breaker opened after {self._failures} consecutive failures")
+            self._state = CircuitBreaker.OPEN
+            self._opened_at = time.monotonic()
+        self._probe_in_flight = False
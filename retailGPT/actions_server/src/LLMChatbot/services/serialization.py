@@ -0,0 +1,184 @@
+import json
+import zlib
+from typing import Any, Callable
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+
+# First byte of the records written by a Codec. Untagged records are legacy JSON,
+# which can't start with this byte as it's not valid UTF-8.
+_record_tag: bytes = b"\xff"
+_record_version: int = 1
+
+
+def _json_dumps(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+
+def _orjson_dumps(value: Any) -> bytes:
+    return orjson.dumps(value)
+
+
+def _msgpack_dumps(value: Any) -> bytes:
+    return msgpack.packb(value, use_bin_type=True)
+
+
+def _msgpack_loads(data: bytes) -> Any:
+    return msgpack.unpackb(data, raw=False)
+
+
+def _zstd_compress(data: bytes) -> bytes:
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+
+def _zstd_decompress(data: bytes) -> bytes:
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+# Name: (ID stored in the record tag, dumps, loads, whether it's available)
+_serializers: dict[str, tuple[int, Callable, Callable, bool]] = {
+    "json": (1, _json_dumps, json.loads, True),
+    "orjson": (2, _orjson_dumps, orjson.loads if orjson else None, orjson is not None),
+    "msgpack": (3, _msgpack_dumps, _msgpack_loads, msgpack is not None),
+}
+
+# Name: (ID stored in the record tag, compress, decompress, whether it's available)
+_compressions: dict[str, tuple[int, Callable, Callable, bool]] = {
+    "none": (0, None, None, True),
+    "zlib": (1, lambda data: zlib.compress(data, 6), zlib.decompress, True),
+    "zstd": (2, _zstd_compress, _zstd_decompress, zstandard is not None),
+    "lz4": (3, lz4_frame.compress if lz4_frame else None, lz4_frame.decompress if lz4_frame else None, lz4_frame is not None),
+}
+
+
+class CodecUnavailableError(Exception):
+    """Raised when a record was written with a serializer or compression that is not installed."""
+
+
+class Codec:
+    """Encodes the stored user data, with a pluggable serializer and optional compression.
+
+    Records are tagged with the format version and the serializer and compression used,
+    so they can be read back whatever the current configuration is. Plain JSON without
+    compression is written untagged, which is the format of the records written before
+    the codecs existed.
+    """
+
+    def __init__(
+        self,
+        serializer: str = "json",
+        compression: str = "none",
+        compression_threshold: int = 1024,
+    ):
+        """
+        Args:
+
+        serializer: The serializer of new records: 'json', 'orjson' or 'msgpack'.
+        compression: The compression of new records: 'none', 'zlib', 'zstd' or 'lz4'.
+        compression_threshold: Minimum size of a serialized record to be compressed, in bytes.
+        """
+
+        if serializer not in _serializers:
+            raise ValueError(f"Unknown serializer: {serializer}")
+        if compression not in _compressions:
+            raise ValueError(f"Unknown compression: {compression}")
+
+        # Optional packages that are not installed fall back to what's always available
+        if not _serializers[serializer][3]:
+            print(f"The {serializer} serializer is not installed, falling back to json")
+            serializer = "json"
+        if not _compressions[compression][3]:
+            print(f"The {compression} compression is not installed, falling back to zlib")
+            compression = "zlib"
+
+        self.serializer = serializer
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+
+    def encode(self, value: Any) -> bytes | str:
+        """Encodes a value to be stored.
+
+        Args:
+
+        value: The value, which must be JSON serializable.
+
+        Returns:
+
+        The record to be stored.
+        """
+
+        if self.serializer == "json" and self.compression == "none":
+            return json.dumps(value)
+
+        serializer_id, dumps, _, _ = _serializers[self.serializer]
+        payload = dumps(value)
+
+        compression_id = 0
+        if self.compression != "none" and len(payload) >= self.compression_threshold:
+            compression_id, compress, _, _ = _compressions[self.compression]
+            payload = compress(payload)
+
+        return _record_tag + bytes((_record_version, serializer_id, compression_id)) + payload
+
+    @staticmethod
+    def decode(record: bytes | str) -> Any:
+        """Decodes a stored record, whatever codec it was written with.
+
+        Args:
+
+        record: The stored record.
+
+        Returns:
+
+        The value.
+
+        Raises:
+
+        CodecUnavailableError: If the record's serializer or compression is not installed.
+        """
+
+        if isinstance(record, str) or not record.startswith(_record_tag):
+            return json.loads(record)
+
+        version, serializer_id, compression_id = record[1], record[2], record[3]
+        if version != _record_version:
+            raise ValueError(f"Unknown record version: {version}")
+        payload = record[4:]
+
+        if compression_id:
+            name, (_, _, decompress, available) = Codec._find(_compressions, compression_id)
+            if not available:
+                raise CodecUnavailableError(f"The {name} compression is not installed")
+            payload = decompress(payload)
+
+        name, (_, _, loads, available) = Codec._find(_serializers, serializer_id)
+        if not available:
+            raise CodecUnavailableError(f"The {name} serializer is not installed")
+        return loads(payload)
+
+    @staticmethod
+    def _find(registry: dict, codec_id: int) -> tuple[str, tuple]:
+        """Finds a serializer or compression by the ID stored in the record tag."""
+
+        for name, entry in registry.items():
+            if entry[0] == codec_id:
+                return name, entry
+        raise ValueError(f"Unknown codec ID: {codec_id}")
@@ -0,0 +1,231 @@
+import asyncio
+import json
+import os
+
+from redis.exceptions import ResponseError
+
+from .database import Database
+
+
+class StorageMonitor:
+    """Reports and bounds the memory used by the stored per-user data.
+
+    Fields written by Database expire on their own, but keys written before the TTLs
+    existed, or with them disabled, are kept forever. The sweeper periodically gives
+    those keys their field's TTL, so idle users stop taking memory.
+
+    The database may be shared with other services, so only the keys of this bot's fields
+    and its legacy user documents are swept. Any other key is reported as 'other' and kept.
+    """
+
+    # Seconds between sweeps of keys without expiration. 0 disables the sweeper.
+    _sweep_interval: float = float(os.environ.get("DATABASE_SWEEP_INTERVAL", 0))
+    # Keys scanned per round-trip
+    _scan_batch_size: int = int(os.environ.get("DATABASE_SCAN_BATCH_SIZE", 500))
+
+    _sweeper: asyncio.Task | None = None
+
+    @staticmethod
+    def _get_field(key: str | bytes) -> str | None:
+        """Gets the field a key stores, 'other' if it's not a field key and None if it may be a legacy document."""
+
+        if isinstance(key, bytes):
+            key = key.decode("utf-8", errors="replace")
+        _, separator, field = key.rpartition(":")
+        if not separator:
+            return None
+        return field if field in Database._field_ttls else "other"
+
+    @staticmethod
+    def _is_legacy_document(value: bytes | str | None) -> bool:
+        """Checks if a value is a single-key user document of older versions: a JSON object of user fields."""
+
+        if value is None:
+            return False
+        try:
+            document = json.loads(value)
+        except ValueError:
+            return False
+        return isinstance(document, dict) and all(field in Database._field_ttls for field in document)
+
+    @staticmethod
+    async def _get_fields(keys: list) -> list[str]:
+        """Gets the field each key stores, reading the keys that may be legacy documents to confirm them.
+
+        Args:
+
+        keys: The keys.
+
+        Returns:
+
+        A list with the field of each key, 'legacy' for the user documents of older versions
+        and 'other' for the keys this bot doesn't own.
+        """
+
+        fields = [StorageMonitor._get_field(key) for key in keys]
+        candidates = [key for key, field in zip(keys, fields) if field is None]
+        if not candidates:
+            return fields
+
+        async with Database.get_client().pipeline(transaction=False) as pipeline:
+            for key in candidates:
+                pipeline.get(key)
+            # Keys holding other types fail with WRONGTYPE, and are not documents
+            values = iter(await pipeline.execute(raise_on_error=False))
+
+        for index, field in enumerate(fields):
+            if field is None:
+                value = next(values)
+                is_legacy = not isinstance(value, Exception) and StorageMonitor._is_legacy_document(value)
+                fields[index] = "legacy" if is_legacy else "other"
+        return fields
+
+    @staticmethod
+    async def _measure(keys: list) -> list[tuple[int, int]]:
+        """Gets the bytes and the TTL of some keys, in a single round-trip.
+
+        Args:
+
+        keys: The keys.
+
+        Returns:
+
+        A list with the bytes and the TTL of each key. The TTL is -1 if the key never expires.
+        """
+
+        client = Database.get_client()
+        try:
+            async with client.pipeline(transaction=False) as pipeline:
+                for key in keys:
+                    pipeline.memory_usage(key)
+                    pipeline.ttl(key)
+                results = await pipeline.execute(raise_on_error=False)
+        except ResponseError:
+            results = None
+
+        # Servers without MEMORY USAGE report the size of the stored value instead
+        if results is None or any(isinstance(result, ResponseError) for result in results[::2]):
+            async with client.pipeline(transaction=False) as pipeline:
+                for key in keys:
+                    pipeline.strlen(key)
+                    pipeline.ttl(key)
+                results = await pipeline.execute(raise_on_error=False)
+
+        return [
+            (
+                size if isinstance(size, int) else 0,
+                ttl if isinstance(ttl, int) else -1,
+            )
+            for size, ttl in zip(results[::2], results[1::2])
+        ]
+
+    @staticmethod
+    async def _scan():
+        """Iterates over the stored keys in batches."""
+
+        batch = []
+        async for key in Database.get_client().scan_iter(count=StorageMonitor._scan_batch_size):
+            batch.append(key)
+            if len(batch) >= StorageMonitor._scan_batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    @staticmethod
+    async def get_report() -> dict[str, dict[str, int]]:
+        """Gets the number of keys and the memory used by each field.
+
+        Returns:
+
+        Dict with the 'keys', 'bytes' and 'without_ttl' counts of each field.
+        """
+
+        report = {}
+        async for keys in StorageMonitor._scan():
+            fields = await StorageMonitor._get_fields(keys)
+            for field, (size, ttl) in zip(fields, await StorageMonitor._measure(keys)):
+                field_report = report.setdefault(field, {"keys": 0, "bytes": 0, "without_ttl": 0})
+                field_report["keys"] += 1
+                field_report["bytes"] += size
+                if ttl == -1:
+                    field_report["without_ttl"] += 1
+
+        return report
+
+    @staticmethod
+    async def sweep() -> int:
+        """Gives the keys without expiration the TTL of their field.
+        Keys that are not this bot's are never given a TTL.
+
+        Returns:
+
+        The number of keys that were given a TTL.
+        """
+
+        swept = 0
+        client = Database.get_client()
+        async for keys in StorageMonitor._scan():
+            async with client.pipeline(transaction=False) as pipeline:
+                for key in keys:
+                    pipeline.ttl(key)
+                ttls = await pipeline.execute()
+
+            expiring = [(key, ttl) for key, ttl in zip(keys, ttls) if ttl == -1]
+            if not expiring:
+                continue
+            fields = await StorageMonitor._get_fields([key for key, _ in expiring])
+
+            async with client.pipeline(transaction=False) as pipeline:
+                for (key, _), field in zip(expiring, fields):
+                    if field == "other":
+                        continue
+                    new_ttl = Database._default_ttl if field == "legacy" else Database.get_ttl(field)
+                    if new_ttl:
+                        # Only if the key is still without expiration, so TTLs renewed meanwhile are kept
+                        pipeline.expire(key, new_ttl, nx=True)
+                        swept += 1
+                await pipeline.execute()
+
+        return swept
+
+    @staticmethod
+    async def _run_sweeper() -> None:
+        """Sweeps the keys without expiration periodically, reporting the memory used."""
+
+        while True:
+            await asyncio.sleep(StorageMonitor._sweep_interval)
+            try:
+                swept = await StorageMonitor.sweep()
+                report = await StorageMonitor.get_report()
+                print(f"Storage sweep: {swept} keys were given a TTL. Usage by field: {report}")
+            except Exception as e:
+                print(f"Storage sweep failed: {e}")
+
+    @staticmethod
+    def start_sweeper() -> None:
+        """Starts the sweeper in the running event loop, if it's enabled and not running yet."""
+
+        if StorageMonitor._sweep_interval <= 0:
+            return
+
+        sweeper = StorageMonitor._sweeper
+        if sweeper is not None and not sweeper.done() and sweeper.get_loop() is asyncio.get_running_loop():
+            return
+
+        StorageMonitor._sweeper = asyncio.create_task(StorageMonitor._run_sweeper())
+
+
+if __name__ == "__main__":
+
+    async def main():
+        report = await StorageMonitor.get_report()
+        print(f"{'field':>26} {'keys':>8} {'bytes':>12} {'without TTL':>12}")
+        for field, field_report in sorted(report.items()):
+            print(
+                f"{field:>26} {field_report['keys']:>8} "
+                f"{field_report['bytes']:>12} {field_report['without_ttl']:>12}"
+            )
+        await Database.close()
+
+    asyncio.run(main())
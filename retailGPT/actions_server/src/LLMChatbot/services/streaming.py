@@ -0,0 +1,87 @@
+import json
+from typing import AsyncIterable, AsyncIterator
+
+
+async def iter_sse_data(lines: AsyncIterable[bytes]) -> AsyncIterator[dict]:
+    """Parses the server-sent events of a streamed completion.
+
+    Args:
+
+    lines: The lines of the response body, as received.
+
+    Returns:
+
+    An async iterator over the JSON payload of each 'data:' event, until the '[DONE]' event.
+    """
+
+    async for raw_line in lines:
+        line = raw_line.decode("utf-8").strip()
+        if not line.startswith("data:"):
+            # Blank separators, comments and other SSE fields
+            continue
+
+        data = line[len("data:") :].strip()
+        if data == "[DONE]":
+            return
+
+        yield json.loads(data)
+
+
+class StreamedCompletion:
+    """Accumulates the chunks of a streamed completion into the complete message."""
+
+    def __init__(self):
+        self.content: str | None = None
+        self._tool_calls: dict[int, dict] = {}
+
+    def add_chunk(self, chunk: dict) -> str:
+        """Merges a completion chunk into the message.
+
+        Args:
+
+        chunk: The JSON payload of a 'data:' event.
+
+        Returns:
+
+        The text added to the message content by the chunk, possibly empty.
+        """
+
+        if not chunk.get("choices"):
+            return ""
+        delta = chunk["choices"][0].get("delta") or {}
+
+        text = delta.get("content") or ""
+        if text:
+            self.content = (self.content or "") + text
+
+        # Tool calls arrive split in fragments, identified by their index
+        for tool_call_delta in delta.get("tool_calls") or []:
+            tool_call = self._tool_calls.setdefault(
+                tool_call_delta["index"],
+                {"id": None, "type": "function", "function": {"name": "", "arguments": ""}},
+            )
+            if tool_call_delta.get("id"):
+                tool_call["id"] = tool_call_delta["id"]
+            if tool_call_delta.get("type"):
+                tool_call["type"] = tool_call_delta["type"]
+            function_delta = tool_call_delta.get("function") or {}
+            tool_call["function"]["name"] += function_delta.get("name") or ""
+            tool_call["function"]["arguments"] += function_delta.get("arguments") or ""
+
+        return text
+
+    def get_message(self) -> dict:
+        """Gets the complete message, in the same format as a non-streamed completion.
+
+        Returns:
+
+        The response message dict.
+        """
+
+        tool_calls = [self._tool_calls[index] for index in sorted(self._tool_calls)]
+        return {
+            "role": "assistant",
+            "content": self.content,
+            "function_call": None,
+            "tool_calls": tool_calls or None,
+        }
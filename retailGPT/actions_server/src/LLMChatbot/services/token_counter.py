@@ -0,0 +1,92 @@
+import json
+import os
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+class TokenCounter:
+    """Counts the tokens of the messages sent to the LLM.
+
+    Uses the model's tokenizer when tiktoken is installed and falls back to an estimate
+    of about 4 characters per token otherwise. Texts are counted once and cached, as the
+    same system prompt and history messages are sent turn after turn.
+    """
+
+    _encoding_name: str = os.environ.get("TOKENIZER_ENCODING", "o200k_base")
+    # Tokens added by the chat format to every message, and to prime the reply
+    _tokens_per_message: int = 3
+    _tokens_per_reply: int = 3
+
+    _encoding = None
+
+    @staticmethod
+    def _get_encoding():
+        """Gets the tokenizer, loading it lazily. None if tiktoken is not installed or the encoding can't be loaded."""
+
+        if TokenCounter._encoding is None and tiktoken is not None:
+            try:
+                TokenCounter._encoding = tiktoken.get_encoding(TokenCounter._encoding_name)
+            except Exception as e:
+                print(f"Could not load the {TokenCounter._encoding_name} tokenizer, estimating tokens instead: {e}")
+                TokenCounter._encoding = False
+        return TokenCounter._encoding or None
+
+    @staticmethod
+    @lru_cache(maxsize=8192)
+    def count_text(text: str) -> int:
+        """Counts the tokens of a text.
+
+        Args:
+
+        text: The text.
+
+        Returns:
+
+        The number of tokens.
+        """
+
+        encoding = TokenCounter._get_encoding()
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+        return (len(text) + 3) // 4
+
+    @staticmethod
+    def count_message(message: dict) -> int:
+        """Counts the tokens of a chat message, including its tool calls.
+
+        Args:
+
+        message: The message dict.
+
+        Returns:
+
+        The number of tokens.
+        """
+
+        tokens = TokenCounter._tokens_per_message
+        for key, value in message.items():
+            if value is None:
+                continue
+            if isinstance(value, str):
+                tokens += TokenCounter.count_text(value)
+            else:
+                tokens += TokenCounter.count_text(json.dumps(value, ensure_ascii=False))
+        return tokens
+
+    @staticmethod
+    def count_messages(messages: list[dict]) -> int:
+        """Counts the prompt tokens of a list of chat messages.
+
+        Args:
+
+        messages: The messages.
+
+        Returns:
+
+        The number of tokens.
+        """
+        return sum(TokenCounter.count_message(message) for message in messages) + TokenCounter._tokens_per_reply
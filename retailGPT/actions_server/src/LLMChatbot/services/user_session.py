@@ -0,0 +1,286 @@
+import asyncio
+import copy
+import inspect
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from .database import Database, FieldsUpdate
+from .storage_monitor import StorageMonitor
+
+
+class UserSession:
+    """Unit of work over a user's stored data during one chatbot turn.
+
+    The user's fields are read from Redis once, on first access, and served from memory
+    afterwards. Changed fields are tracked and written back in a single round-trip when
+    the session is flushed. While a session is active, Database routes the user's reads
+    and writes through it, so the handlers don't need to know about it.
+
+    Atomic updates are recorded along with the plain writes. If there are any, the flush
+    replays the recorded changes, in order, over the stored data inside a single optimistic
+    transaction, so changes made meanwhile by other turns of the same user are not lost.
+    """
+
+    # Fields loaded together on first access. Other fields are read on demand.
+    _preloaded_fields: tuple[str, ...] = (
+        "history",
+        "summary",
+        "cart",
+        "recommended_products",
+        "tool_calls",
+        "should_send_cart_summary",
+        "should_finish_purchase",
+    )
+
+    def __init__(self, user_id: str):
+        """
+        Args:
+
+        user_id: The user's ID.
+        """
+        self.user_id = user_id
+
+        self._data: dict = {}
+        # Fields whose stored value is known, even if the user has no data for them
+        self._known_fields: set[str] = set()
+        self._dirty_fields: set[str] = set()
+        # Changes since the last flush, in order: ("set", data), ("update", fields, update)
+        # or ("append", field, items, max_length)
+        self._changes: list[tuple] = []
+        # Items appended to list fields that are not rewritten, as field: (items, max_length)
+        self._appends: dict[str, tuple[list, int]] = {}
+        self._lock = asyncio.Lock()
+        # Updates with awaits in them must not interleave
+        self._update_lock = asyncio.Lock()
+
+    async def _load(self, fields: list[str]) -> None:
+        """Reads the fields that are not known yet, along with the preloaded fields on the first read."""
+
+        async with self._lock:
+            missing = [field for field in fields if field not in self._known_fields]
+            if not missing:
+                return
+            if not self._known_fields:
+                missing += [
+                    field for field in UserSession._preloaded_fields if field not in missing
+                ]
+
+            data = await Database._read_fields(self.user_id, missing)
+            for field in missing:
+                # Fields set meanwhile are more recent than the stored ones
+                if field not in self._known_fields:
+                    self._known_fields.add(field)
+                    if field in data:
+                        self._data[field] = data[field]
+
+    async def get_fields(self, fields: list[str]) -> dict:
+        """Gets some fields of the user's data.
+
+        Args:
+
+        fields: The names of the fields.
+
+        Returns:
+
+        Dict with copies of the fields' values, so callers can change them freely.
+        Fields the user has no data for are left out.
+        """
+
+        if any(field not in self._known_fields for field in fields):
+            await self._load(fields)
+
+        return {
+            field: copy.deepcopy(self._data[field]) for field in fields if field in self._data
+        }
+
+    def set_fields(self, data: dict) -> None:
+        """Sets some fields of the user's data, to be written when the session is flushed.
+
+        Args:
+
+        data: Dict with the values of the fields to be set.
+        """
+
+        data = copy.deepcopy(data)
+        self._apply(data)
+        self._changes.append(("set", data))
+
+    def _apply(self, data: dict) -> None:
+        """Applies changed fields to the session's data."""
+
+        for field, value in data.items():
+            self._data[field] = copy.deepcopy(value)
+            self._known_fields.add(field)
+            self._dirty_fields.add(field)
+            # The field is rewritten whole, appended items included
+            self._appends.pop(field, None)
+
+    async def append_to_list(self, field: str, items: list, max_length: int = 0) -> None:
+        """Appends some items to a list field, to be pushed when the session is flushed.
+
+        Args:
+
+        field: The name of the list field.
+        items: The items to append.
+        max_length: Number of items to keep. 0 keeps every item.
+        """
+
+        await self.get_fields([field])
+        items = copy.deepcopy(items)
+        self._data[field] = UserSession._append(self._data.get(field, []), items, max_length)
+        self._changes.append(("append", field, items, max_length))
+
+        if field not in self._dirty_fields:
+            pending_items, _ = self._appends.get(field, ([], 0))
+            self._appends[field] = (pending_items + items, max_length)
+
+    @staticmethod
+    def _append(value: list, items: list, max_length: int) -> list:
+        value = value + copy.deepcopy(items)
+        return value[-max_length:] if max_length else value
+
+    async def update_fields(self, fields: list[str], update: FieldsUpdate) -> dict:
+        """Atomically updates some fields of the user's data within the session.
+
+        Args:
+
+        fields: The names of the fields read and written by the update.
+        update: Function, sync or async, that takes a dict with the fields and returns a dict with the changed ones.
+
+        Returns:
+
+        Dict with the changed fields.
+        """
+
+        async with self._update_lock:
+            changes = await UserSession._run_update(update, await self.get_fields(fields))
+            self._apply(changes)
+            self._changes.append(("update", fields, update))
+
+        return changes
+
+    @staticmethod
+    async def _run_update(update: FieldsUpdate, data: dict) -> dict:
+        """Runs an update function, sync or async, over a dict with the fields."""
+
+        changes = update(data)
+        if inspect.isawaitable(changes):
+            changes = await changes
+        return changes or {}
+
+    def is_dirty(self) -> bool:
+        """Checks if the session has changes that were not flushed."""
+        return bool(self._dirty_fields or self._appends)
+
+    async def flush(self) -> None:
+        """Writes the changed fields, in a single round-trip if there were no atomic updates."""
+
+        if not self.is_dirty():
+            return
+
+        dirty_fields = self._dirty_fields
+        changes = self._changes
+        appends = self._appends
+        # The turn is activity on every field it knows of, so their expiration is renewed too
+        touched_fields = sorted(self._known_fields - dirty_fields - set(appends))
+        self._dirty_fields = set()
+        self._changes = []
+        self._appends = {}
+        try:
+            updated_fields = {
+                field for change in changes if change[0] == "update" for field in change[1]
+            }
+            if updated_fields:
+                data = await Database._transact_fields(
+                    self.user_id,
+                    sorted(dirty_fields | updated_fields),
+                    lambda stored: UserSession._replay(changes, stored),
+                    touched_fields,
+                    appends,
+                )
+                for field, value in data.items():
+                    self._data[field] = value
+            else:
+                await Database._write_fields(
+                    self.user_id,
+                    {field: self._data[field] for field in dirty_fields},
+                    touched_fields,
+                    appends,
+                )
+        except BaseException:
+            # Kept, so a later flush can retry them
+            self._dirty_fields |= dirty_fields
+            self._changes = changes + self._changes
+            for field, (items, max_length) in self._appends.items():
+                pending_items, _ = appends.get(field, ([], 0))
+                appends[field] = (pending_items + items, max_length)
+            self._appends = {
+                field: pending for field, pending in appends.items() if field not in self._dirty_fields
+            }
+            raise
+
+    @staticmethod
+    async def _replay(changes: list[tuple], stored: dict) -> dict:
+        """Replays the session's changes over the stored fields.
+
+        Args:
+
+        changes: The recorded changes, in order.
+        stored: Dict with the stored fields.
+
+        Returns:
+
+        Dict with the fields changed by the replay.
+        """
+
+        data = dict(stored)
+        changed = {}
+        for change in changes:
+            if change[0] == "append":
+                # Pushed apart, unless the field is rewritten whole
+                _, field, items, max_length = change
+                data[field] = UserSession._append(data.get(field, []), items, max_length)
+                if field in changed:
+                    changed[field] = data[field]
+                continue
+            if change[0] == "set":
+                new_values = copy.deepcopy(change[1])
+            else:
+                _, fields, update = change
+                new_values = await UserSession._run_update(
+                    update, {field: copy.deepcopy(data[field]) for field in fields if field in data}
+                )
+            data.update(new_values)
+            changed.update(new_values)
+        return changed
+
+    @staticmethod
+    def detach() -> None:
+        """Makes the running task access the storage directly, outside the session it was created in.
+        For background tasks that may outlive the turn.
+        """
+        Database._session.set(None)
+
+    @staticmethod
+    @asynccontextmanager
+    async def start(user_id: str) -> AsyncIterator["UserSession"]:
+        """Runs the context within a session of the user, flushing it at the end, even on errors.
+        Tasks created inside the context share the session.
+
+        Args:
+
+        user_id: The user's ID.
+        """
+
+        StorageMonitor.start_sweeper()
+        session = UserSession(user_id)
+        token = Database._session.set(session)
+        try:
+            yield session
+        finally:
+            try:
+                Database._session.reset(token)
+            except ValueError:
+                # Async generators closed by the garbage collector run in another context
+                pass
+            await session.flush()
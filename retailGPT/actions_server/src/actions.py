@@ -20,6 +20,38 @@ sys.path.append(current_directory)
 
 from LLMChatbot.chatbot import LLMChatbot
 from LLMChatbot.services.cart_handler import CartHandler
+from LLMChatbot.services.database import Database
+from LLMChatbot.services.llm_handler import LLMHandler
+
+
+async def close_connections(app, loop) -> None:
+    """Closes the shared aiohttp session and the Redis connection pool, on the server's loop."""
+
+    await LLMHandler.close_session()
+    await Database.close()
+
+
+def register_shutdown_hook() -> None:
+    """Closes the shared connections when the actions server stops.
+    The actions are imported by rasa_sdk after creating its Sanic app, so the hook is added to it.
+    """
+
+    try:
+        from sanic import Sanic
+        from sanic.exceptions import SanicException
+    except ImportError:
+        return
+
+    try:
+        app = Sanic.get_app("rasa_sdk")
+    except SanicException:
+        # Not running inside the actions server
+        return
+
+    app.register_listener(close_connections, "after_server_stop")
+
+
+register_shutdown_hook()
 
 
 class CartStatus(Action):
@@ -35,7 +67,7 @@ class CartStatus(Action):
         domain: Dict[Text, Any],
     ) -> List[Dict[Text, Any]]:
 
-        cart = CartHandler.get_cart_summary(tracker.sender_id)
+        cart = await CartHandler.get_cart_summary(tracker.sender_id)
         dispatcher.utter_message(text=cart)
 
         return [FollowupAction("action_listen")]
@@ -181,8 +213,8 @@ class LLMProcessing(Action):
 
         if zipcode is None or is_legal_age is None:
             return [FollowupAction("zipcode_form"), ActiveLoop("zipcode_form")]
-        if CartHandler.get_should_finish_purchase(user_id):
-            CartHandler.set_should_finish_purchase(user_id, False)
+        if await CartHandler.get_should_finish_purchase(user_id):
+            await CartHandler.set_should_finish_purchase(user_id, False)
             return [
                 FollowupAction("payment_method_form"),
                 ActiveLoop("payment_method_form"),
@@ -278,7 +310,7 @@ class ActionSummarizeDetails(Action):
         # Retrieve slot values
         zipcode = tracker.get_slot("zipcode")
         payment_method = tracker.get_slot("payment_method")
-        cart = CartHandler.get_cart_summary(tracker.sender_id)
+        cart = await CartHandler.get_cart_summary(tracker.sender_id)
 
         # Create a summary message
         message = (
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Test unitarios para AdmissionController de Óptica Solar
+"""
+
+import asyncio
+import unittest
+import sys
+from pathlib import Path
+
+# Agregar el path del proyecto
+sys.path.append(str(Path(__file__).parent.parent / "retailGPT" / "actions_server" / "src"))
+
+from LLMChatbot.services.admission_controller import AdmissionController, RequestPriority
+
+
+class TestAdmissionController(unittest.IsolatedAsyncioTestCase):
+    """Test para AdmissionController"""
+
+    async def test_admits_up_to_max_in_flight(self):
+        """Test límite de solicitudes simultáneas"""
+        controller = AdmissionController(max_in_flight=2)
+
+        await controller.acquire(RequestPriority.SEARCH)
+        await controller.acquire(RequestPriority.SEARCH)
+        waiter = asyncio.create_task(controller.acquire(RequestPriority.SEARCH))
+        await asyncio.sleep(0)
+
+        self.assertFalse(waiter.done())
+        self.assertEqual(controller.get_metrics()["queue_depth"], 1)
+
+        controller.release()
+        await waiter
+
+        self.assertEqual(controller.get_metrics()["in_flight"], 2)
+        self.assertEqual(controller.get_metrics()["queue_depth"], 0)
+
+    async def test_admits_by_priority(self):
+        """Test orden de admisión por prioridad y llegada"""
+        controller = AdmissionController(max_in_flight=1)
+        order = []
+
+        async def request(priority, name):
+            async with controller.admit(priority):
+                order.append(name)
+                await asyncio.sleep(0)
+
+        await controller.acquire(RequestPriority.USER_FACING)
+        tasks = [
+            asyncio.create_task(request(RequestPriority.SEARCH, "search")),
+            asyncio.create_task(request(RequestPriority.GUARDRAIL, "guardrail")),
+            asyncio.create_task(request(RequestPriority.USER_FACING, "answer 1")),
+            asyncio.create_task(request(RequestPriority.USER_FACING, "answer 2")),
+        ]
+        await asyncio.sleep(0)
+
+        metrics = controller.get_metrics()
+        self.assertEqual(metrics["queue_depth_by_priority"]["USER_FACING"], 2)
+
+        controller.release()
+        await asyncio.gather(*tasks)
+
+        self.assertEqual(order, ["answer 1", "answer 2", "guardrail", "search"])
+        self.assertGreater(controller.get_metrics()["max_wait"]["SEARCH"], 0)
+
+    async def test_token_budget(self):
+        """Test presupuesto de tokens por ventana"""
+        controller = AdmissionController(max_in_flight=10, tokens_per_minute=100)
+        controller._window_seconds = 0.05
+
+        async with controller.admit(RequestPriority.SEARCH, tokens=80):
+            pass
+        waited = await asyncio.wait_for(controller.acquire(RequestPriority.SEARCH, tokens=50), 1)
+        controller.release()
+
+        self.assertGreater(waited, 0)
+
+    async def test_request_larger_than_budget_admitted_on_empty_window(self):
+        """Test solicitud mayor que el presupuesto con ventana vacía"""
+        controller = AdmissionController(max_in_flight=1, tokens_per_minute=10)
+
+        waited = await asyncio.wait_for(controller.acquire(RequestPriority.SEARCH, tokens=50), 1)
+
+        self.assertEqual(waited, 0.0)
+
+    async def test_cancelled_request_refunds_its_tokens(self):
+        """Test devolución de tokens de una solicitud especulativa cancelada"""
+        controller = AdmissionController(max_in_flight=10, tokens_per_minute=100)
+
+        async def request(refund_on_cancel):
+            async with controller.admit(RequestPriority.USER_FACING, 40, refund_on_cancel):
+                await asyncio.sleep(1)
+
+        for refund_on_cancel in (True, False):
+            task = asyncio.create_task(request(refund_on_cancel))
+            await asyncio.sleep(0)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        # Solo la solicitud sin devolución sigue contando
+        self.assertEqual(controller.get_metrics()["window_tokens"], 40)
+        self.assertEqual(controller.get_metrics()["in_flight"], 0)
+
+    async def test_cancelled_waiter_does_not_block_queue(self):
+        """Test cancelación de una solicitud en espera"""
+        controller = AdmissionController(max_in_flight=1)
+        await controller.acquire(RequestPriority.USER_FACING)
+
+        cancelled = asyncio.create_task(controller.acquire(RequestPriority.USER_FACING))
+        waiter = asyncio.create_task(controller.acquire(RequestPriority.SEARCH))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+
+        controller.release()
+        await asyncio.wait_for(waiter, 1)
+
+        self.assertEqual(controller.get_metrics()["in_flight"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Test unitarios para Cart de Óptica Solar
+"""
+
+import unittest
+import sys
+from pathlib import Path
+
+# Agregar el path del proyecto
+sys.path.append(str(Path(__file__).parent.parent / "retailGPT" / "actions_server" / "src"))
+
+from LLMChatbot.services.cart import Cart
+from LLMChatbot.services.catalog_store import CatalogStore
+
+
+class TestCart(unittest.TestCase):
+    """Test para Cart"""
+
+    def setUp(self):
+        """Configuración inicial para cada test"""
+        self.aviator = CatalogStore.get_by_row_id(1)  # 299.99
+        self.holbrook = CatalogStore.get_by_row_id(3)  # 189.99
+
+    def test_add_keeps_running_totals(self):
+        """Test que agregar productos actualiza los totales"""
+        cart = Cart()
+
+        cart.add(self.aviator, 2)
+        cart.add(self.holbrook, 1)
+        cart.add(self.aviator, 1)
+
+        self.assertEqual(len(cart), 2)
+        self.assertEqual(cart.get_units(1), 3)
+        self.assertEqual(cart.total_units, 4)
+        self.assertAlmostEqual(cart.total_price, 299.99 * 3 + 189.99)
+        self.assertAlmostEqual(cart.total_volume, 0.004)
+
+    def test_remove_updates_totals(self):
+        """Test que quitar unidades actualiza los totales"""
+        cart = Cart()
+        cart.add(self.aviator, 3)
+        cart.add(self.holbrook, 1)
+
+        self.assertEqual(cart.remove(1, 2), 2)
+
+        self.assertEqual(cart.get_units(1), 1)
+        self.assertEqual(cart.total_units, 2)
+        self.assertAlmostEqual(cart.total_price, 299.99 + 189.99)
+
+    def test_remove_more_units_than_in_cart(self):
+        """Test que quitar más unidades de las que hay elimina el producto"""
+        cart = Cart()
+        cart.add(self.aviator, 1)
+
+        self.assertEqual(cart.remove(1, 5), 1)
+
+        self.assertNotIn(1, cart)
+        self.assertEqual(cart.total_units, 0)
+        self.assertEqual(cart.total_price, 0)
+        self.assertEqual(cart.total_volume, 0)
+
+    def test_remove_product_not_in_cart(self):
+        """Test que quitar un producto que no está en el carrito no cambia nada"""
+        cart = Cart()
+        cart.add(self.aviator, 1)
+
+        self.assertEqual(cart.remove(3, 1), 0)
+        self.assertEqual(cart.total_units, 1)
+
+    def test_round_trip(self):
+        """Test que el carrito se guarda y se carga sin pérdidas"""
+        cart = Cart()
+        cart.add(self.holbrook, 1)
+        cart.add(self.aviator, 2)
+
+        loaded_cart = Cart.from_dict(cart.to_dict())
+
+        self.assertEqual(loaded_cart.to_dict()["items"], [[3, 1], [1, 2]])
+        self.assertEqual([item.to_dict() for item in loaded_cart], [item.to_dict() for item in cart])
+        self.assertEqual(loaded_cart.total_units, cart.total_units)
+        self.assertAlmostEqual(loaded_cart.total_price, cart.total_price)
+
+    def test_from_dict_of_older_versions(self):
+        """Test que se cargan los carritos guardados por versiones anteriores"""
+        cart = Cart.from_dict([
+            {"row_id": 3, "number_of_units": 1},
+            {
+                "product_name": "Ray-Ban Aviator Classic Gold",
+                "number_of_units": 2,
+                "price_per_unit": 299.99,
+                "volume_per_unit": 0.001,
+            },
+            {
+                "product_name": "Producto Inexistente",
+                "number_of_units": 1,
+                "price_per_unit": 10.0,
+                "volume_per_unit": 0.001,
+            },
+        ])
+
+        self.assertEqual(cart.to_dict()["items"], [[3, 1], [1, 2]])
+
+    def test_changes_bump_the_version(self):
+        """Test que los cambios incrementan la versión y descartan el resumen"""
+        cart = Cart()
+        cart.add(self.aviator, 1)
+        cart.set_summary("resumen")
+
+        self.assertEqual(cart.version, 1)
+        self.assertEqual(Cart.from_dict(cart.to_dict()).get_summary(), "resumen")
+
+        cart.remove(3, 1)
+        self.assertEqual(cart.version, 1)
+        self.assertEqual(cart.get_summary(), "resumen")
+
+        cart.remove(1, 1)
+        self.assertEqual(cart.version, 2)
+        self.assertIsNone(cart.get_summary())
+        self.assertEqual(Cart.from_dict(cart.to_dict()).version, 2)
+
+    def test_items_use_slots(self):
+        """Test que el carrito y sus items no tienen __dict__"""
+        cart = Cart()
+        cart.add(self.aviator, 1)
+
+        self.assertFalse(hasattr(cart, "__dict__"))
+        self.assertFalse(hasattr(next(iter(cart)), "__dict__"))
+
+
+if __name__ == '__main__':
+    unittest.main()
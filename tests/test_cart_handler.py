@@ -6,15 +6,25 @@ Test unitarios para CartHandler de Óptica Solar
 import unittest
 import sys
 from pathlib import Path
-from unittest.mock import patch
+from unittest.mock import ANY, AsyncMock, patch
+
+from fakeredis import FakeAsyncRedis
 
 # Agregar el path del proyecto
 sys.path.append(str(Path(__file__).parent.parent / "retailGPT" / "actions_server" / "src"))
 
+from LLMChatbot.services.cart import Cart
 from LLMChatbot.services.cart_handler import CartHandler
+from LLMChatbot.services.catalog_store import CatalogStore
+from LLMChatbot.services.database import Database
+
 
+def stored_fields(data):
+    """Simula los campos guardados de un usuario"""
+    return lambda user_id, field, default=None: data.get(field, default)
 
-class TestCartHandler(unittest.TestCase):
+
+class TestCartHandler(unittest.IsolatedAsyncioTestCase):
     """Test para CartHandler"""
     
     def setUp(self):
@@ -35,43 +45,40 @@ class TestCartHandler(unittest.TestCase):
             }
         ]
     
-    @patch('LLMChatbot.services.cart_handler.Database')
-    def test_set_cart(self, mock_database):
+    @patch('LLMChatbot.services.cart_handler.Database', new_callable=AsyncMock)
+    async def test_set_cart(self, mock_database):
         """Test establecer carrito"""
-        mock_database.get_data.return_value = {}
-        
-        CartHandler._set_cart(self.user_id, self.sample_cart)
+        await CartHandler._set_cart(self.user_id, Cart.from_dict(self.sample_cart))
         
-        mock_database.set_data.assert_called_once()
-        call_args = mock_database.set_data.call_args[0]
-        self.assertEqual(call_args[0], self.user_id)
-        self.assertEqual(call_args[1]["cart"], self.sample_cart)
+        mock_database.set_field.assert_called_once_with(self.user_id, "cart", {"items": [[1, 2], [3, 1]], "version": 0})
+        mock_database.get_field.assert_not_called()
     
-    @patch('LLMChatbot.services.cart_handler.Database')
-    def test_get_cart(self, mock_database):
+    @patch('LLMChatbot.services.cart_handler.Database', new_callable=AsyncMock)
+    async def test_get_cart(self, mock_database):
         """Test obtener carrito"""
-        mock_database.get_data.return_value = {"cart": self.sample_cart}
+        mock_database.get_field.side_effect = stored_fields({"cart": self.sample_cart})
         
-        cart = CartHandler._get_cart(self.user_id)
+        cart = await CartHandler._get_cart(self.user_id)
         
-        self.assertEqual(cart, self.sample_cart)
-        mock_database.get_data.assert_called_once_with(self.user_id)
+        self.assertEqual(cart.to_dict()["items"], [[1, 2], [3, 1]])
+        self.assertEqual(cart.total_units, 3)
+        mock_database.get_field.assert_called_once_with(self.user_id, "cart", {})
     
-    @patch('LLMChatbot.services.cart_handler.Database')
-    def test_get_cart_empty(self, mock_database):
+    @patch('LLMChatbot.services.cart_handler.Database', new_callable=AsyncMock)
+    async def test_get_cart_empty(self, mock_database):
         """Test obtener carrito vacío"""
-        mock_database.get_data.return_value = {}
+        mock_database.get_field.side_effect = stored_fields({})
         
-        cart = CartHandler._get_cart(self.user_id)
+        cart = await CartHandler._get_cart(self.user_id)
         
-        self.assertEqual(cart, [])
+        self.assertEqual(len(cart), 0)
     
-    @patch('LLMChatbot.services.cart_handler.Database')
-    def test_get_cart_summary(self, mock_database):
+    @patch('LLMChatbot.services.cart_handler.Database', new_callable=AsyncMock)
+    async def test_get_cart_summary(self, mock_database):
         """Test obtener resumen del carrito"""
-        mock_database.get_data.return_value = {"cart": self.sample_cart}
+        mock_database.get_field.side_effect = stored_fields({"cart": self.sample_cart})
         
-        summary = CartHandler.get_cart_summary(self.user_id)
+        summary = await CartHandler.get_cart_summary(self.user_id)
         
         self.assertIn("Your cart summary:", summary)
         self.assertIn("Ray-Ban Aviator Classic Gold", summary)
@@ -82,91 +89,48 @@ class TestCartHandler(unittest.TestCase):
         self.assertIn("Total cart volume: 0.003L", summary)
         self.assertIn("Métodos de pago disponibles", summary)
     
-    @patch('LLMChatbot.services.cart_handler.Database')
-    def test_get_cart_summary_empty(self, mock_database):
+    @patch('LLMChatbot.services.cart_handler.Database', new_callable=AsyncMock)
+    async def test_get_cart_summary_empty(self, mock_database):
         """Test resumen de carrito vacío"""
-        mock_database.get_data.return_value = {}
+        mock_database.get_field.side_effect = stored_fields({})
         
-        summary = CartHandler.get_cart_summary(self.user_id)
+        summary = await CartHandler.get_cart_summary(self.user_id)
         
         self.assertIn("Your cart summary:", summary)
         self.assertIn("Total cart value: R$0.00", summary)
         self.assertIn("Total cart volume: 0L", summary)
     
-    @patch('LLMChatbot.services.cart_handler.Database')
-    def test_get_should_send_cart_summary(self, mock_database):
+    @patch('LLMChatbot.services.cart_handler.Database', new_callable=AsyncMock)
+    async def test_get_should_send_cart_summary(self, mock_database):
         """Test obtener flag de envío de resumen"""
-        mock_database.get_data.return_value = {"should_send_cart_summary": True}
+        mock_database.get_field.side_effect = stored_fields({"should_send_cart_summary": True})
         
-        result = CartHandler.get_should_send_cart_summary(self.user_id)
+        result = await CartHandler.get_should_send_cart_summary(self.user_id)
         
         self.assertTrue(result)
     
-    @patch('LLMChatbot.services.cart_handler.Database')
-    def test_set_should_send_cart_summary(self, mock_database):
+    @patch('LLMChatbot.services.cart_handler.Database', new_callable=AsyncMock)
+    async def test_set_should_send_cart_summary(self, mock_database):
         """Test establecer flag de envío de resumen"""
-        mock_database.get_data.return_value = {}
-        
-        CartHandler.set_should_send_cart_summary(self.user_id, True)
-        
-        mock_database.set_data.assert_called_once()
-        call_args = mock_database.set_data.call_args[0]
-        self.assertEqual(call_args[0], self.user_id)
-        self.assertEqual(call_args[1]["should_send_cart_summary"], True)
-    
-    def test_add_to_cart_new_product(self):
-        """Test agregar producto nuevo al carrito"""
-        cart = []
-        
-        CartHandler._add_to_cart(
-            cart, "Tom Ford FT5235 Negro", 1, 499.99, 0.001
-        )
+        await CartHandler.set_should_send_cart_summary(self.user_id, True)
         
-        self.assertEqual(len(cart), 1)
-        self.assertEqual(cart[0]["product_name"], "Tom Ford FT5235 Negro")
-        self.assertEqual(cart[0]["number_of_units"], 1)
-        self.assertEqual(cart[0]["price_per_unit"], 499.99)
-    
-    def test_add_to_cart_existing_product(self):
-        """Test agregar producto existente al carrito"""
-        cart = [{
-            "product_name": "Ray-Ban Aviator Classic Gold",
-            "number_of_units": 1,
-            "price_per_unit": 299.99,
-            "volume_per_unit": 0.001
-        }]
-        
-        CartHandler._add_to_cart(
-            cart, "Ray-Ban Aviator Classic Gold", 2, 299.99, 0.001
-        )
-        
-        self.assertEqual(len(cart), 1)
-        self.assertEqual(cart[0]["number_of_units"], 3)  # 1 + 2
+        mock_database.set_field.assert_called_once_with(self.user_id, "should_send_cart_summary", True)
+        mock_database.get_field.assert_not_called()
     
     def test_max_volume_exceeded(self):
         """Test verificación de volumen máximo excedido"""
-        cart = [{
-            "product_name": "Ray-Ban Aviator Classic Gold",
-            "number_of_units": 3,
-            "price_per_unit": 299.99,
-            "volume_per_unit": 0.001
-        }]
+        cart = Cart.from_dict({"items": [[1, 3]]})
         
         # Volumen actual: 3 * 0.001 = 0.003
         # Volumen adicional: 3 * 0.001 = 0.003
-        # Total: 0.006, que excede el máximo de 5
+        # Total: 0.006, que no excede el máximo de 5
         result = CartHandler._max_volume_exceeded(cart, 3 * 0.001)
         
         self.assertFalse(result)  # No excede el máximo de 5L
     
     def test_max_volume_exceeded_true(self):
         """Test verificación de volumen máximo excedido (caso verdadero)"""
-        cart = [{
-            "product_name": "Ray-Ban Aviator Classic Gold",
-            "number_of_units": 3000,
-            "price_per_unit": 299.99,
-            "volume_per_unit": 0.001
-        }]
+        cart = Cart.from_dict({"items": [[1, 3000]]})
         
         # Volumen actual: 3000 * 0.001 = 3
         # Volumen adicional: 3000 * 0.001 = 3
@@ -177,12 +141,7 @@ class TestCartHandler(unittest.TestCase):
     
     def test_get_max_allowed_units(self):
         """Test obtener máximo de unidades permitidas"""
-        cart = [{
-            "product_name": "Ray-Ban Aviator Classic Gold",
-            "number_of_units": 2000,
-            "price_per_unit": 299.99,
-            "volume_per_unit": 0.001
-        }]
+        cart = Cart.from_dict({"items": [[1, 2000]]})
         
         # Volumen actual: 2000 * 0.001 = 2
         # Volumen restante: 5 - 2 = 3
@@ -191,60 +150,41 @@ class TestCartHandler(unittest.TestCase):
         
         self.assertEqual(max_units, 3000)
     
-    @patch('LLMChatbot.services.cart_handler.ProductHandler')
-    @patch('LLMChatbot.services.cart_handler.CartHandler._add_to_cart')
-    @patch('LLMChatbot.services.cart_handler.CartHandler._max_volume_exceeded')
-    @patch('LLMChatbot.services.cart_handler.CartHandler._get_max_allowed_units')
-    def test_process_addition_success(self, mock_get_max, mock_volume_exceeded, mock_add_to_cart, mock_product_handler):
+    def test_add_product_success(self):
         """Test procesamiento de adición exitosa"""
-        mock_product_handler.get_product_unit_price.return_value = 299.99
-        mock_product_handler.get_product_unit_volume.return_value = 0.001
-        mock_volume_exceeded.return_value = False
+        cart = Cart()
         
-        result = CartHandler._process_addition(self.user_id, [], "Ray-Ban Aviator", 2)
+        result = CartHandler._add_product(cart, CatalogStore.get_by_row_id(1), 2)
         
         self.assertEqual(result, "Product successfully added to the cart!")
-        mock_add_to_cart.assert_called_once()
+        self.assertEqual(cart.get_units(1), 2)
     
-    @patch('LLMChatbot.services.cart_handler.ProductHandler')
-    @patch('LLMChatbot.services.cart_handler.CartHandler._add_to_cart')
     @patch('LLMChatbot.services.cart_handler.CartHandler._max_volume_exceeded')
     @patch('LLMChatbot.services.cart_handler.CartHandler._get_max_allowed_units')
-    def test_process_addition_volume_exceeded(self, mock_get_max, mock_volume_exceeded, mock_add_to_cart, mock_product_handler):
+    def test_add_product_volume_exceeded(self, mock_get_max, mock_volume_exceeded):
         """Test procesamiento de adición con volumen excedido"""
-        mock_product_handler.get_product_unit_price.return_value = 299.99
-        mock_product_handler.get_product_unit_volume.return_value = 0.001
         mock_volume_exceeded.return_value = True
         mock_get_max.return_value = 1
+        cart = Cart()
         
-        result = CartHandler._process_addition(self.user_id, [], "Ray-Ban Aviator", 5)
+        result = CartHandler._add_product(cart, CatalogStore.get_by_row_id(1), 5)
         
         self.assertIn("The maximum volume of 5 liters per order has been exceeded", result)
         self.assertIn("adjusted to 1", result)
-        mock_add_to_cart.assert_called_once()
+        self.assertEqual(cart.get_units(1), 1)
     
     def test_process_removal_success(self):
         """Test procesamiento de eliminación exitosa"""
-        cart = [{
-            "product_name": "Ray-Ban Aviator Classic Gold",
-            "number_of_units": 3,
-            "price_per_unit": 299.99,
-            "volume_per_unit": 0.001
-        }]
+        cart = Cart.from_dict({"items": [[1, 3]]})
         
         result = CartHandler._process_removal(cart, "Ray-Ban Aviator Classic Gold", 1)
         
         self.assertEqual(result, "Product units successfully removed from the cart!")
-        self.assertEqual(cart[0]["number_of_units"], 2)
+        self.assertEqual(cart.get_units(1), 2)
     
     def test_process_removal_complete(self):
         """Test procesamiento de eliminación completa"""
-        cart = [{
-            "product_name": "Ray-Ban Aviator Classic Gold",
-            "number_of_units": 2,
-            "price_per_unit": 299.99,
-            "volume_per_unit": 0.001
-        }]
+        cart = Cart.from_dict({"items": [[1, 2]]})
         
         result = CartHandler._process_removal(cart, "Ray-Ban Aviator Classic Gold", 2)
         
@@ -253,12 +193,7 @@ class TestCartHandler(unittest.TestCase):
     
     def test_process_removal_below_zero(self):
         """Test procesamiento de eliminación por debajo de cero"""
-        cart = [{
-            "product_name": "Ray-Ban Aviator Classic Gold",
-            "number_of_units": 1,
-            "price_per_unit": 299.99,
-            "volume_per_unit": 0.001
-        }]
+        cart = Cart.from_dict({"items": [[1, 1]]})
         
         result = CartHandler._process_removal(cart, "Ray-Ban Aviator Classic Gold", 3)
         
@@ -267,55 +202,275 @@ class TestCartHandler(unittest.TestCase):
     
     def test_process_removal_product_not_found(self):
         """Test procesamiento de eliminación de producto no encontrado"""
-        cart = [{
-            "product_name": "Ray-Ban Aviator Classic Gold",
-            "number_of_units": 1,
-            "price_per_unit": 299.99,
-            "volume_per_unit": 0.001
-        }]
+        cart = Cart.from_dict({"items": [[1, 1]]})
         
         result = CartHandler._process_removal(cart, "Producto Inexistente", 1)
         
         self.assertEqual(result, "Product not found in the cart.")
+        
+        result = CartHandler._process_removal(cart, "Oakley Holbrook Matte Black", 1)
+        
+        self.assertEqual(result, "Product not found in the cart.")
     
-    @patch('LLMChatbot.services.cart_handler.CartHandler._process_addition')
-    @patch('LLMChatbot.services.cart_handler.CartHandler._process_removal')
-    @patch('LLMChatbot.services.cart_handler.CartHandler._set_cart')
-    def test_process_cart_operation_add(self, mock_set_cart, mock_process_removal, mock_process_addition):
+    @patch.object(Database, 'get_client')
+    async def test_process_cart_operation_add(self, mock_get_client):
         """Test procesamiento de operación de carrito - agregar"""
-        mock_process_addition.return_value = "Product successfully added to the cart!"
+        mock_get_client.return_value = FakeAsyncRedis(decode_responses=True)
+        await Database.set_field(self.user_id, "recommended_products", {"ray-ban aviator classic gold": 1})
         
-        result = CartHandler.process_cart_operation(self.user_id, "add", "Ray-Ban Aviator", 2)
+        result = await CartHandler.process_cart_operation(self.user_id, "add", "Ray-Ban Aviator Classic Gold", 2)
         
         self.assertEqual(result, "Product successfully added to the cart!")
-        mock_process_addition.assert_called_once_with(self.user_id, [], "Ray-Ban Aviator", 2)
-        mock_set_cart.assert_called_once()
+        self.assertEqual((await Database.get_field(self.user_id, "cart"))["items"], [[1, 2]])
+        self.assertTrue(await CartHandler.get_should_send_cart_summary(self.user_id))
+    
+    @patch.object(Database, 'get_client')
+    async def test_process_cart_operation_add_not_recommended(self, mock_get_client):
+        """Test procesamiento de operación de carrito - agregar un producto no recomendado"""
+        mock_get_client.return_value = FakeAsyncRedis(decode_responses=True)
+        
+        result = await CartHandler.process_cart_operation(self.user_id, "add", "Ray-Ban Aviator Classic Gold", 2)
+        
+        self.assertEqual(result, CartHandler._not_recommended_message)
+        self.assertIsNone(await Database.get_field(self.user_id, "cart"))
+        self.assertFalse(await CartHandler.get_should_send_cart_summary(self.user_id))
     
-    @patch('LLMChatbot.services.cart_handler.CartHandler._process_addition')
     @patch('LLMChatbot.services.cart_handler.CartHandler._process_removal')
-    @patch('LLMChatbot.services.cart_handler.CartHandler._set_cart')
-    def test_process_cart_operation_remove(self, mock_set_cart, mock_process_removal, mock_process_addition):
+    @patch.object(Database, 'get_client')
+    async def test_process_cart_operation_remove(self, mock_get_client, mock_process_removal):
         """Test procesamiento de operación de carrito - eliminar"""
+        mock_get_client.return_value = FakeAsyncRedis(decode_responses=True)
         mock_process_removal.return_value = "Product units successfully removed from the cart!"
         
-        result = CartHandler.process_cart_operation(self.user_id, "remove", "Ray-Ban Aviator", 1)
+        result = await CartHandler.process_cart_operation(self.user_id, "remove", "Ray-Ban Aviator", 1)
         
         self.assertEqual(result, "Product units successfully removed from the cart!")
-        mock_process_removal.assert_called_once_with([], "Ray-Ban Aviator", 1)
-        mock_set_cart.assert_called_once()
+        mock_process_removal.assert_called_once_with(ANY, "Ray-Ban Aviator", 1)
+        self.assertEqual((await Database.get_field(self.user_id, "cart"))["items"], [])
     
-    @patch('LLMChatbot.services.cart_handler.CartHandler._process_addition')
+    @patch('LLMChatbot.services.cart_handler.CartHandler._add_product')
     @patch('LLMChatbot.services.cart_handler.CartHandler._process_removal')
-    @patch('LLMChatbot.services.cart_handler.CartHandler._set_cart')
-    def test_process_cart_operation_invalid(self, mock_set_cart, mock_process_removal, mock_process_addition):
+    @patch.object(Database, 'get_client')
+    async def test_process_cart_operation_invalid(self, mock_get_client, mock_process_removal, mock_add_product):
         """Test procesamiento de operación de carrito - operación inválida"""
-        result = CartHandler.process_cart_operation(self.user_id, "invalid", "Ray-Ban Aviator", 1)
+        mock_get_client.return_value = FakeAsyncRedis(decode_responses=True)
+        result = await CartHandler.process_cart_operation(self.user_id, "invalid", "Ray-Ban Aviator", 1)
         
         self.assertEqual(result, "Invalid operation")
-        mock_process_addition.assert_not_called()
+        mock_add_product.assert_not_called()
         mock_process_removal.assert_not_called()
-        mock_set_cart.assert_called_once()
+        self.assertEqual((await Database.get_field(self.user_id, "cart"))["items"], [])
+
+
+
+class TestCartReferences(unittest.IsolatedAsyncioTestCase):
+    """Test para los carritos que guardan referencias (row_id) al catálogo"""
+
+    async def asyncSetUp(self):
+        self.redis = FakeAsyncRedis()
+        self.patcher = patch.object(Database, "get_client", return_value=self.redis)
+        self.patcher.start()
+        self.product = CatalogStore.get_by_name("Ray-Ban Aviator Classic Gold")
+
+    async def asyncTearDown(self):
+        self.patcher.stop()
+        await self.redis.aclose()
 
+    async def test_addition_stores_only_the_reference(self):
+        """Test que agregar un producto guarda solo su row_id y las unidades"""
+        await Database.set_field("user", "recommended_products", {"ray-ban aviator classic gold": self.product["row_id"]})
+
+        await CartHandler.process_cart_operation("user", "add", "Ray-Ban Aviator Classic Gold", 2)
+        await CartHandler.process_cart_operation("user", "add", "ray-ban aviator classic gold", 1)
+
+        self.assertEqual((await Database.get_field("user", "cart"))["items"], [[self.product["row_id"], 3]])
+
+    async def test_summary_resolves_references_from_the_catalog(self):
+        """Test que el resumen obtiene nombre y precio del catálogo"""
+        await Database.set_field("user", "cart", {"items": [[self.product["row_id"], 2]]})
+
+        summary = await CartHandler.get_cart_summary("user")
+
+        self.assertIn("- Ray-Ban Aviator Classic Gold, 2 units, each at R$299.99", summary)
+        self.assertIn("Total cart value: R$599.98", summary)
+        self.assertIn("Total cart volume: 0.002L", summary)
+
+    async def test_products_missing_from_the_catalog_are_skipped(self):
+        """Test que las referencias a productos que ya no están en el catálogo se omiten"""
+        await Database.set_field("user", "cart", {"items": [[999, 1]]})
+
+        self.assertEqual(await CartHandler.get_resolved_cart("user"), [])
+
+    async def test_older_items_are_converted_to_references(self):
+        """Test que los items guardados por versiones anteriores se convierten en referencias"""
+        await Database.set_field("user", "cart", [{
+            "product_name": "Ray-Ban Aviator Classic Gold",
+            "number_of_units": 2,
+            "price_per_unit": 299.99,
+            "volume_per_unit": 0.001
+        }])
+
+        result = await CartHandler.process_cart_operation("user", "remove", "Ray-Ban Aviator Classic Gold", 1)
+
+        self.assertEqual(result, "Product units successfully removed from the cart!")
+        self.assertEqual((await Database.get_field("user", "cart"))["items"], [[self.product["row_id"], 1]])
+
+
+class TestCartBatchOperations(unittest.IsolatedAsyncioTestCase):
+    """Test para las operaciones de carrito aplicadas en lote"""
+
+    async def asyncSetUp(self):
+        self.redis = FakeAsyncRedis()
+        self.patcher = patch.object(Database, "get_client", return_value=self.redis)
+        self.patcher.start()
+        await Database.set_fields("user", {
+            "cart": {"items": [[6, 1]]},
+            "recommended_products": {"oakley holbrook matte black": 3},
+        })
+
+    async def asyncTearDown(self):
+        self.patcher.stop()
+        await self.redis.aclose()
+
+    async def test_operations_are_applied_in_order_with_one_write(self):
+        """Test que las operaciones se aplican en orden y el carrito se escribe una sola vez"""
+        with patch.object(Database, "_transact_fields", wraps=Database._transact_fields) as transact_fields:
+            results = await CartHandler.process_cart_operations("user", [
+                ("remove", "Tom Ford FT5235 Negro", 1),
+                ("add", "Oakley Holbrook Matte Black", 2),
+                ("add", "oakley holbrook matte black", 1),
+            ])
+
+        self.assertEqual(results, [
+            "Product units successfully removed from the cart!",
+            "Product successfully added to the cart!",
+            "Product successfully added to the cart!",
+        ])
+        transact_fields.assert_called_once()
+        self.assertEqual((await Database.get_field("user", "cart"))["items"], [[3, 3]])
+        self.assertTrue(await CartHandler.get_should_send_cart_summary("user"))
+
+    async def test_products_not_recommended_are_not_added(self):
+        """Test que no se agregan productos que no fueron recomendados"""
+        results = await CartHandler.process_cart_operations("user", [
+            ("add", "Gucci GG0061S Negro", 1),
+            ("add", "Oakley Holbrook Matte Black", 1),
+        ])
+
+        self.assertEqual(results, [None, "Product successfully added to the cart!"])
+        self.assertEqual((await Database.get_field("user", "cart"))["items"], [[6, 1], [3, 1]])
+
+    async def test_nothing_is_written_if_no_operation_is_applied(self):
+        """Test que no se escribe nada si ninguna operación se aplica"""
+        results = await CartHandler.process_cart_operations("user", [("add", "Gucci GG0061S Negro", 1)])
+
+        self.assertEqual(results, [None])
+        self.assertEqual((await Database.get_field("user", "cart"))["items"], [[6, 1]])
+        self.assertFalse(await CartHandler.get_should_send_cart_summary("user"))
+
+    async def test_recommendations_of_older_versions_are_converted_once(self):
+        """Test que las recomendaciones guardadas por versiones anteriores se convierten al escribir"""
+        await Database.set_field("user", "recommended_products", [dict(CatalogStore.get_by_row_id(3))])
+
+        results = await CartHandler.process_cart_operations("user", [("add", "Oakley Holbrook Matte Black", 1)])
+
+        self.assertEqual(results, ["Product successfully added to the cart!"])
+        self.assertEqual(
+            await Database.get_field("user", "recommended_products"), {"oakley holbrook matte black": 3}
+        )
+
+    async def test_volume_limit_applies_across_operations(self):
+        """Test que el límite de volumen considera las operaciones anteriores del lote"""
+        with patch.object(CartHandler, "_max_volume_liters", 0.003):
+            results = await CartHandler.process_cart_operations("user", [
+                ("add", "Oakley Holbrook Matte Black", 1),
+                ("add", "Oakley Holbrook Matte Black", 5),
+            ])
+
+        self.assertEqual(results[0], "Product successfully added to the cart!")
+        self.assertIn("adjusted to 1", results[1])
+        self.assertEqual((await Database.get_field("user", "cart"))["items"], [[6, 1], [3, 2]])
+
+
+class TestCartSummaryCache(unittest.IsolatedAsyncioTestCase):
+    """Test para el resumen del carrito guardado por versión"""
+
+    async def asyncSetUp(self):
+        self.redis = FakeAsyncRedis()
+        self.patcher = patch.object(Database, "get_client", return_value=self.redis)
+        self.patcher.start()
+        await Database.set_fields("user", {
+            "cart": {"items": [[1, 2]], "version": 1},
+            "recommended_products": {"oakley holbrook matte black": 3},
+        })
+
+    async def asyncTearDown(self):
+        self.patcher.stop()
+        await self.redis.aclose()
+
+    async def test_summary_is_rendered_once_per_version(self):
+        """Test que el resumen se genera una vez por versión del carrito"""
+        with patch.object(CartHandler, "_render_cart_summary", wraps=CartHandler._render_cart_summary) as render:
+            first_summary = await CartHandler.get_cart_summary("user")
+            second_summary = await CartHandler.get_cart_summary("user")
+
+        self.assertEqual(first_summary, second_summary)
+        self.assertIn("Ray-Ban Aviator Classic Gold, 2 units", first_summary)
+        render.assert_called_once()
+
+    async def test_cart_changes_invalidate_the_summary(self):
+        """Test que los cambios del carrito invalidan el resumen"""
+        await CartHandler.get_cart_summary("user")
+
+        await CartHandler.process_cart_operations("user", [("add", "Oakley Holbrook Matte Black", 1)])
+        summary = await CartHandler.get_cart_summary("user")
+
+        self.assertIn("Oakley Holbrook Matte Black, 1 unit", summary)
+        self.assertEqual((await Database.get_field("user", "cart"))["version"], 2)
+
+    async def test_operations_without_changes_keep_the_summary(self):
+        """Test que las operaciones que no cambian el carrito mantienen el resumen"""
+        await CartHandler.get_cart_summary("user")
+
+        await CartHandler.process_cart_operations("user", [("remove", "Oakley Holbrook Matte Black", 1)])
+
+        self.assertIsNotNone(Cart.get_stored_summary(await Database.get_field("user", "cart")))
+
+    async def test_catalog_reload_invalidates_the_summary(self):
+        """Test que recargar el catálogo invalida el resumen, ya que los precios pueden cambiar"""
+        await CartHandler.get_cart_summary("user")
+        products = CatalogStore.get_products()
+        try:
+            CatalogStore.load_products([{**product, "full_price": 100.0} for product in products])
+
+            summary = await CartHandler.get_cart_summary("user")
+        finally:
+            CatalogStore.load_products(products)
+
+        self.assertIn("each at R$100.00", summary)
+
+    async def test_summary_survives_reloading_the_same_catalog(self):
+        """Test que el resumen guardado sigue siendo válido con el mismo catálogo, como tras reiniciar"""
+        await CartHandler.get_cart_summary("user")
+        CatalogStore.load_products([dict(product) for product in CatalogStore.get_products()])
+
+        with patch.object(CartHandler, "_render_cart_summary") as render:
+            await CartHandler.get_cart_summary("user")
+
+        render.assert_not_called()
+
+    async def test_summary_of_a_changed_cart_is_not_stored(self):
+        """Test que no se guarda el resumen si el carrito cambió mientras se generaba"""
+        stale_cart = await Database.get_field("user", "cart")
+        await Database.set_field("user", "cart", {"items": [[3, 1]], "version": 2})
+
+        with patch.object(Database, "get_field", return_value=stale_cart):
+            summary = await CartHandler.get_cart_summary("user")
+
+        stored_cart = await Database.get_field("user", "cart")
+        self.assertIn("Ray-Ban Aviator Classic Gold", summary)
+        self.assertEqual(stored_cart["items"], [[3, 1]])
+        self.assertIsNone(Cart.get_stored_summary(stored_cart))
 
 if __name__ == '__main__':
     unittest.main()
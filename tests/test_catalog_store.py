@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Test unitarios para CatalogStore de Óptica Solar
+"""
+
+import unittest
+import sys
+from pathlib import Path
+
+# Agregar el path del proyecto
+sys.path.append(str(Path(__file__).parent.parent / "retailGPT" / "actions_server" / "src"))
+
+from LLMChatbot.services.catalog_store import CatalogStore
+
+
+class TestCatalogStore(unittest.TestCase):
+    """Test para CatalogStore"""
+
+    def setUp(self):
+        """Configuración inicial para cada test"""
+        self.original_products = CatalogStore.get_products()
+        self.sample_products = [
+            {
+                "row_id": 1,
+                "product_name": "Ray-Ban Aviator Classic Gold",
+                "brand": "Ray-Ban",
+                "style": "Aviador",
+                "full_price": 299.99,
+            },
+            {
+                "row_id": 2,
+                "product_name": "Ray-Ban Wayfarer Negro",
+                "brand": "Ray-Ban",
+                "style": "Wayfarer",
+                "full_price": 199.99,
+            },
+            {
+                "row_id": 3,
+                "product_name": "Oakley Holbrook Matte Black",
+                "brand": "Oakley",
+                "style": "Wayfarer",
+                "full_price": 189.99,
+            },
+        ]
+        CatalogStore.load_products(self.sample_products)
+
+    def tearDown(self):
+        """Restaura el catálogo original"""
+        CatalogStore.load_products(self.original_products)
+
+    def test_catalog_loaded_at_import(self):
+        """Test que el catálogo real se carga al importar el módulo"""
+        self.assertGreater(len(self.original_products), 0)
+
+    def test_get_products(self):
+        """Test obtener todos los productos en orden"""
+        products = CatalogStore.get_products()
+
+        self.assertEqual([p["row_id"] for p in products], [1, 2, 3])
+
+    def test_get_by_row_id(self):
+        """Test búsqueda por ID"""
+        self.assertEqual(CatalogStore.get_by_row_id(3)["brand"], "Oakley")
+        self.assertIsNone(CatalogStore.get_by_row_id(99))
+
+    def test_get_by_name_ignores_case(self):
+        """Test búsqueda por nombre sin distinguir mayúsculas"""
+        product = CatalogStore.get_by_name("  ray-ban AVIATOR classic gold ")
+
+        self.assertEqual(product["row_id"], 1)
+        self.assertIsNone(CatalogStore.get_by_name("Producto Inexistente"))
+
+    def test_normalize_key(self):
+        """Test normalización de claves de búsqueda"""
+        self.assertEqual(CatalogStore.normalize_key("  Ray-Ban AVIATOR "), "ray-ban aviator")
+
+    def test_get_by_brand_and_style(self):
+        """Test búsqueda por marca y estilo"""
+        self.assertEqual([p["row_id"] for p in CatalogStore.get_by_brand("ray-ban")], [1, 2])
+        self.assertEqual([p["row_id"] for p in CatalogStore.get_by_style("WAYFARER")], [2, 3])
+        self.assertEqual(CatalogStore.get_by_brand("Gucci"), [])
+
+    def test_version_changes_on_reload(self):
+        """Test que la versión cambia al recargar el catálogo"""
+        version = CatalogStore.get_version()
+
+        CatalogStore.load_products(self.sample_products[:1])
+
+        self.assertNotEqual(CatalogStore.get_version(), version)
+        self.assertIsNone(CatalogStore.get_by_row_id(2))
+
+    def test_fingerprint_depends_on_the_content(self):
+        """Test que la huella del catálogo depende solo de los productos"""
+        CatalogStore.load_products(self.sample_products)
+        fingerprint = CatalogStore.get_fingerprint()
+
+        CatalogStore.load_products([{**product, "full_price": 1.0} for product in self.sample_products])
+        self.assertNotEqual(CatalogStore.get_fingerprint(), fingerprint)
+
+        # Recargar los mismos productos, como otro worker o tras reiniciar, da la misma huella
+        CatalogStore.load_products([dict(product) for product in self.sample_products])
+        self.assertEqual(CatalogStore.get_fingerprint(), fingerprint)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Test unitarios para LLMChatbot de Óptica Solar
+"""
+
+import asyncio
+import json
+import unittest
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from fakeredis import FakeAsyncRedis
+
+# Agregar el path del proyecto
+sys.path.append(str(Path(__file__).parent.parent / "retailGPT" / "actions_server" / "src"))
+
+from LLMChatbot.chatbot import LLMChatbot
+from LLMChatbot.services.cart_handler import CartHandler
+from LLMChatbot.services.database import Database
+from LLMChatbot.services.guardrails.guardrails import Guardrails
+from LLMChatbot.services.llm_handler import LLMHandler
+from LLMChatbot.services.memory_handler import MemoryHandler
+
+
+class TestSpeculativeCompletion(unittest.IsolatedAsyncioTestCase):
+    """Test para la completion especulativa en paralelo con los guardrails"""
+
+    async def asyncSetUp(self):
+        self.events = []
+        self.redis = FakeAsyncRedis(decode_responses=True)
+        self.guardrails_result = True
+        self.stream_error = None
+        self.tool_calls = None
+
+        async def stream_completions_api(messages, tools=None, speculative=False):
+            self.events.append(("completion_started", messages[-1]["content"]))
+            self.events.append(("speculative", speculative))
+            try:
+                await asyncio.sleep(0.05)
+            except asyncio.CancelledError:
+                self.events.append(("completion_cancelled", None))
+                raise
+            if self.stream_error is not None:
+                raise self.stream_error
+            if tools is not None and self.tool_calls is not None:
+                yield {"type": "message", "message": {"role": "assistant", "content": None, "tool_calls": self.tool_calls}}
+                return
+            yield {"type": "content", "delta": "Hola"}
+            yield {"type": "message", "message": {"role": "assistant", "content": "Hola", "tool_calls": None}}
+
+        async def run_input_guardrails(text, timings=None):
+            self.events.append(("guardrails_started", text))
+            await asyncio.sleep(0.01)
+            self.events.append(("guardrails_finished", text))
+            return self.guardrails_result
+
+        async def run_output_guardrails(text):
+            return True
+
+        self.patches = [
+            patch.object(LLMChatbot, "_speculative_completion", True),
+            patch.object(LLMHandler, "is_provider_unavailable", return_value=False),
+            patch.object(LLMHandler, "stream_completions_api", stream_completions_api),
+            patch.object(Guardrails, "run_input_guardrails", run_input_guardrails),
+            patch.object(Guardrails, "run_output_guardrails", run_output_guardrails),
+            patch.object(Database, "get_client", return_value=self.redis),
+            patch.object(CartHandler, "get_should_send_cart_summary", return_value=False),
+        ]
+        for patcher in self.patches:
+            patcher.start()
+
+    async def asyncTearDown(self):
+        for patcher in self.patches:
+            patcher.stop()
+        await self.redis.aclose()
+
+    async def test_completion_starts_before_guardrails_finish(self):
+        """Test que la completion empieza junto con los guardrails y se usa si pasan"""
+        events = [
+            event async for event in LLMChatbot.get_response_stream("user", "01000", "Hola", True)
+        ]
+
+        self.assertLess(
+            self.events.index(("completion_started", "Hola")),
+            self.events.index(("guardrails_finished", "Hola")),
+        )
+        self.assertEqual(events[0], {"type": "delta", "text": "Hola"})
+        self.assertEqual(events[-1]["responses"][-1]["text"], "Hola")
+        self.assertEqual(
+            await MemoryHandler.get_history("user"),
+            [{"role": "user", "content": "Hola"}, {"role": "assistant", "content": "Hola"}],
+        )
+
+    async def test_completion_discarded_when_guardrails_trip(self):
+        """Test que la completion especulativa se descarta si un guardrail se activa"""
+        self.guardrails_result = False
+
+        responses = await LLMChatbot.get_response("user", "01000", "Hola", True)
+        await asyncio.sleep(0)
+
+        self.assertEqual(responses, [{"text": LLMChatbot._guardrails_warning, "buttons": None}])
+        self.assertIn(("completion_cancelled", None), self.events)
+        self.assertIn(("speculative", True), self.events)
+        self.assertEqual(await MemoryHandler.get_history("user"), [])
+
+    async def test_stream_error_reaches_the_caller(self):
+        """Test que un error de la completion llega al llamador en vez de bloquearlo"""
+        self.stream_error = ValueError("'choices' not in response JSON")
+
+        with self.assertRaises(ValueError):
+            await asyncio.wait_for(LLMChatbot.get_response("user", "01000", "Hola", True), 1)
+
+        with self.assertRaises(ValueError):
+            await asyncio.wait_for(
+                self.consume(LLMChatbot.get_response_stream("user", "01000", "Hola", True)), 1
+            )
+
+    async def test_tool_round_trip_is_stored_in_history(self):
+        """Test que la llamada a las tools y sus resultados se guardan en el historial"""
+        self.tool_calls = [
+            {"id": "call_0", "type": "function", "function": {"name": "get_cart", "arguments": "{}"}}
+        ]
+        tool_output = {"role": "tool", "content": "Carrito vacío", "tool_call_id": "call_0"}
+
+        with patch.object(LLMChatbot, "_process_tool_calls", return_value=[tool_output]):
+            await LLMChatbot.get_response("user", "01000", "Hola", True)
+
+        self.assertEqual(
+            await MemoryHandler.get_history("user"),
+            [
+                {"role": "user", "content": "Hola"},
+                {"role": "assistant", "tool_calls": self.tool_calls},
+                tool_output,
+                {"role": "assistant", "content": "Hola"},
+            ],
+        )
+
+    @staticmethod
+    async def consume(stream):
+        return [event async for event in stream]
+
+
+def tool_call(call_id, name, arguments):
+    """Simula una tool call de OpenAI"""
+    return SimpleNamespace(
+        id=call_id, type="function", function=SimpleNamespace(name=name, arguments=json.dumps(arguments))
+    )
+
+
+class TestCartToolCalls(unittest.IsolatedAsyncioTestCase):
+    """Test para las llamadas a edit_cart de un mismo mensaje"""
+
+    async def asyncSetUp(self):
+        self.redis = FakeAsyncRedis()
+        self.patcher = patch.object(Database, "get_client", return_value=self.redis)
+        self.patcher.start()
+        await Database.set_fields("user", {
+            "cart": {"items": [[6, 1]]},
+            "recommended_products": {"oakley holbrook matte black": 3},
+        })
+
+    async def asyncTearDown(self):
+        self.patcher.stop()
+        await self.redis.aclose()
+
+    async def test_edit_cart_calls_are_applied_in_one_batch(self):
+        """Test que las llamadas a edit_cart se aplican en un solo lote, quitando primero"""
+        tool_calls = [
+            tool_call("add", "edit_cart", {"operation": "add", "product": "Oakley Holbrook Matte Black", "amount": 2}),
+            tool_call("remove", "edit_cart", {"operation": "remove", "product": "Tom Ford FT5235 Negro", "amount": 1}),
+        ]
+
+        with patch.object(
+            CartHandler, "process_cart_operations", wraps=CartHandler.process_cart_operations
+        ) as process_cart_operations:
+            messages = await LLMChatbot._process_sequential_tool_calls("user", "01000", tool_calls)
+
+        process_cart_operations.assert_called_once_with("user", [
+            ("remove", "Tom Ford FT5235 Negro", 1),
+            ("add", "Oakley Holbrook Matte Black", 2),
+        ])
+        self.assertEqual(
+            [(message["tool_call_id"], message["content"]) for message in messages],
+            [
+                ("remove", "Product units successfully removed from the cart!"),
+                ("add", "Product successfully added to the cart!"),
+            ],
+        )
+        self.assertEqual((await Database.get_field("user", "cart"))["items"], [[3, 2]])
+        self.assertTrue(await CartHandler.get_should_send_cart_summary("user"))
+
+    async def test_products_not_recommended_are_searched(self):
+        """Test que agregar un producto no recomendado lo busca en vez de agregarlo"""
+        tool_calls = [
+            tool_call("add", "edit_cart", {"operation": "add", "product": "Gucci GG0061S Negro", "amount": 1}),
+        ]
+
+        with patch.object(LLMChatbot, "_search_product_recommendation", return_value="Gucci") as search:
+            messages = await LLMChatbot._process_sequential_tool_calls("user", "01000", tool_calls)
+
+        search.assert_called_once_with("user", "Gucci GG0061S Negro", "01000")
+        self.assertEqual(messages[0]["content"], LLMChatbot._early_operation_warning + "Gucci")
+        self.assertEqual((await Database.get_field("user", "cart"))["items"], [[6, 1]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Test unitarios para Database de Óptica Solar
+"""
+
+import asyncio
+import json
+import unittest
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+from fakeredis import FakeAsyncRedis
+
+# Agregar el path del proyecto
+sys.path.append(str(Path(__file__).parent.parent / "retailGPT" / "actions_server" / "src"))
+
+from LLMChatbot.services.database import ConcurrentUpdateError, Database
+from LLMChatbot.services.user_session import UserSession
+
+
+class TestDatabaseClient(unittest.IsolatedAsyncioTestCase):
+    """Test para el cliente Redis compartido de Database"""
+
+    async def asyncTearDown(self):
+        await Database.close()
+
+    async def test_client_is_reused(self):
+        """Test que el cliente se reutiliza dentro del mismo loop"""
+        with patch.object(Database, "_redis_url", None):
+            first = Database.get_client()
+            second = Database.get_client()
+
+        self.assertIs(first, second)
+
+    async def test_pool_uses_configuration(self):
+        """Test que el pool usa la configuración del entorno"""
+        with patch.object(Database, "_redis_url", None), \
+             patch.object(Database, "_redis_host", "redis"), \
+             patch.object(Database, "_redis_port", 6380), \
+             patch.object(Database, "_redis_db", 2), \
+             patch.object(Database, "_pool_size", 7):
+            client = Database.get_client()
+
+        pool = client.connection_pool
+        self.assertEqual(pool.max_connections, 7)
+        self.assertEqual(pool.connection_kwargs["host"], "redis")
+        self.assertEqual(pool.connection_kwargs["port"], 6380)
+        self.assertEqual(pool.connection_kwargs["db"], 2)
+
+    async def test_pool_from_url(self):
+        """Test que REDIS_URL tiene prioridad sobre el host y el puerto"""
+        with patch.object(Database, "_redis_url", "redis://cache:6390/3"):
+            client = Database.get_client()
+
+        self.assertEqual(client.connection_pool.connection_kwargs["host"], "cache")
+        self.assertEqual(client.connection_pool.connection_kwargs["db"], 3)
+
+
+class TestDatabaseFields(unittest.IsolatedAsyncioTestCase):
+    """Test para el almacenamiento de un campo por clave"""
+
+    async def asyncSetUp(self):
+        self.redis = FakeAsyncRedis(decode_responses=True)
+        self.patcher = patch.object(Database, "get_client", return_value=self.redis)
+        self.patcher.start()
+
+    async def asyncTearDown(self):
+        self.patcher.stop()
+        await self.redis.aclose()
+
+    async def test_fields_are_stored_in_separate_keys(self):
+        """Test que cada campo se guarda en su propia clave"""
+        await Database.set_fields("user", {"cart": [], "should_send_cart_summary": True})
+        await Database.set_field("user", "history", [{"role": "user", "content": "Hola"}])
+
+        self.assertEqual(
+            sorted(await self.redis.keys("*")),
+            ["user:cart", "user:history", "user:should_send_cart_summary"],
+        )
+        self.assertTrue(await Database.get_field("user", "should_send_cart_summary"))
+        self.assertEqual(
+            await Database.get_fields("user", ["cart", "tool_calls"]), {"cart": []}
+        )
+        self.assertEqual(await Database.get_field("user", "tool_calls", []), [])
+
+    async def test_fields_expire_with_their_ttl(self):
+        """Test que cada campo expira con su TTL y se renueva con la actividad"""
+        with patch.dict(Database._field_ttls, {"tool_calls": 60, "cart": 3600}):
+            await Database.set_fields("user", {"cart": [], "tool_calls": []})
+
+            self.assertEqual(await self.redis.ttl("user:tool_calls"), 60)
+            self.assertEqual(await self.redis.ttl("user:cart"), 3600)
+
+            await self.redis.expire("user:cart", 10)
+            await Database.touch("user", ["cart"])
+
+            self.assertEqual(await self.redis.ttl("user:cart"), 3600)
+
+    async def test_session_renews_ttl_of_read_fields(self):
+        """Test que la sesión renueva el TTL de los campos leídos aunque no cambien"""
+        await Database.set_fields("user", {"cart": [], "history": []})
+        await self.redis.expire("user:cart", 10)
+
+        async with UserSession.start("user"):
+            await Database.get_field("user", "cart")
+            await Database.set_field("user", "history", [{"role": "user", "content": "Hola"}])
+
+        self.assertEqual(await self.redis.ttl("user:cart"), Database.get_ttl("cart"))
+
+    async def test_ttl_zero_keeps_field(self):
+        """Test que un TTL de 0 guarda el campo sin expiración"""
+        with patch.dict(Database._field_ttls, {"cart": 0}):
+            await Database.set_field("user", "cart", [])
+
+        self.assertEqual(await self.redis.ttl("user:cart"), -1)
+
+    async def test_legacy_document_is_migrated(self):
+        """Test que el documento antiguo se migra al leerlo"""
+        legacy_data = {
+            "cart": [{"product_name": "Ray-Ban Aviator", "number_of_units": 1}],
+            "history": [{"role": "user", "content": "Hola"}],
+            "should_send_cart_summary": False,
+        }
+        await self.redis.set("user", json.dumps(legacy_data))
+        # Escrito después del documento antiguo, así que es más reciente
+        await Database.set_field("user", "should_send_cart_summary", True)
+
+        self.assertEqual(await Database.get_field("user", "cart"), legacy_data["cart"])
+        self.assertTrue(await Database.get_field("user", "should_send_cart_summary"))
+        self.assertEqual(await Database.get_field("user", "history"), legacy_data["history"])
+        self.assertFalse(await self.redis.exists("user"))
+
+
+class TestDatabaseUpdates(unittest.IsolatedAsyncioTestCase):
+    """Test para las actualizaciones atómicas"""
+
+    async def asyncSetUp(self):
+        self.redis = FakeAsyncRedis(decode_responses=True)
+        self.patcher = patch.object(Database, "get_client", return_value=self.redis)
+        self.patcher.start()
+
+    async def asyncTearDown(self):
+        self.patcher.stop()
+        await self.redis.aclose()
+
+    async def test_concurrent_updates_are_not_lost(self):
+        """Test que las actualizaciones concurrentes no se pisan"""
+
+        async def append(history, index):
+            await asyncio.sleep(0)
+            return history + [index]
+
+        await asyncio.gather(
+            *(
+                Database.update_field("user", "history", lambda history, i=i: append(history, i), [])
+                for i in range(10)
+            )
+        )
+
+        self.assertEqual(sorted(await Database.get_field("user", "history")), list(range(10)))
+
+    async def test_update_is_retried_on_conflict(self):
+        """Test que la actualización se repite si el campo cambió entretanto"""
+        await Database.set_field("user", "cart", ["Ray-Ban"])
+        calls = []
+
+        async def add_product(cart):
+            calls.append(list(cart))
+            if len(calls) == 1:
+                # Otra acción del mismo usuario escribe antes del EXEC
+                await self.redis.set("user:cart", json.dumps(["Ray-Ban", "Oakley"]))
+            return cart + ["Prada"]
+
+        cart = await Database.update_field("user", "cart", add_product, [])
+
+        self.assertEqual(calls, [["Ray-Ban"], ["Ray-Ban", "Oakley"]])
+        self.assertEqual(cart, ["Ray-Ban", "Oakley", "Prada"])
+        self.assertEqual(await Database.get_field("user", "cart"), cart)
+
+    async def test_update_gives_up_after_max_attempts(self):
+        """Test que la actualización falla si el campo cambia en cada intento"""
+
+        async def always_conflicting(cart):
+            await self.redis.set("user:cart", json.dumps(["Oakley"]))
+            return ["Prada"]
+
+        with patch.object(Database, "_max_update_attempts", 3):
+            with self.assertRaises(ConcurrentUpdateError):
+                await Database.update_field("user", "cart", always_conflicting, [])
+
+    async def test_session_updates_are_replayed_on_flush(self):
+        """Test que las actualizaciones de la sesión se aplican sobre los datos actuales"""
+        async with UserSession.start("user"):
+            await Database.update_field("user", "history", lambda history: history + ["Hola"], [])
+            await Database.set_field("user", "should_send_cart_summary", True)
+            # Otro turno del mismo usuario guarda un mensaje antes del flush
+            await self.redis.set("user:history", json.dumps(["Buenas"]))
+
+        self.assertEqual(await Database.get_field("user", "history"), ["Buenas", "Hola"])
+        self.assertTrue(await Database.get_field("user", "should_send_cart_summary"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Test unitarios para el índice de embeddings de Óptica Solar
+"""
+
+import tempfile
+import unittest
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# Agregar el path del proyecto
+sys.path.append(str(Path(__file__).parent.parent / "retailGPT" / "actions_server" / "src"))
+
+from LLMChatbot.services.embedding_index import EmbeddingIndex, HashingEmbedder
+
+
+class TestEmbeddingIndex(unittest.TestCase):
+    """Test para EmbeddingIndex"""
+
+    def setUp(self):
+        """Configuración inicial para cada test"""
+        self.products = [
+            {"product_name": "Ray-Ban Aviator Classic Gold", "brand": "Ray-Ban", "style": "Aviador", "color": "Dorado"},
+            {"product_name": "Oakley Radar EV Path Negro", "brand": "Oakley", "style": "Deportivo", "color": "Negro"},
+            {"product_name": "Tom Ford FT5235 Negro", "brand": "Tom Ford", "style": "Cuadrado", "color": "Negro"},
+        ]
+
+    def test_embedder_is_deterministic_and_normalized(self):
+        """Test embeddings deterministas y normalizados"""
+        embedder = HashingEmbedder(dimensions=64)
+
+        first = embedder.embed("Gafas de sol polarizadas")
+        second = HashingEmbedder(dimensions=64).embed("Gafas de sol polarizadas")
+
+        self.assertTrue(np.array_equal(first, second))
+        self.assertAlmostEqual(float(np.linalg.norm(first)), 1.0, places=5)
+        self.assertEqual(first.dtype, np.float32)
+
+    def test_search_ranks_most_similar_first(self):
+        """Test ranking por similitud"""
+        index = EmbeddingIndex.build(self.products)
+
+        results = index.search("tom ford", 2)
+
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0][0], 2)
+        self.assertGreaterEqual(results[0][1], results[1][1])
+
+    def test_search_respects_candidates(self):
+        """Test filtro de candidatos por rango y por lista"""
+        index = EmbeddingIndex.build(self.products)
+
+        rows = [row for row, _ in index.search("tom ford", 3, candidates=range(0, 3, 2))]
+
+        self.assertEqual(rows, [2, 0])
+        self.assertEqual([row for row, _ in index.search("tom ford", 3, candidates=[2])], [2])
+        self.assertEqual(index.search("tom ford", 3, candidates=[]), [])
+
+    def test_load_or_build_uses_memory_mapped_cache(self):
+        """Test caché en disco con memory-map e invalidación"""
+        with tempfile.TemporaryDirectory() as directory:
+            cache_path = Path(directory) / "products.embeddings.npy"
+
+            built = EmbeddingIndex.load_or_build(self.products, cache_path)
+            loaded = EmbeddingIndex.load_or_build(self.products, cache_path)
+
+            self.assertTrue(cache_path.exists())
+            self.assertIsInstance(loaded._matrix, np.memmap)
+            self.assertEqual(built.search("oakley", 1), loaded.search("oakley", 1))
+
+            rebuilt = EmbeddingIndex.load_or_build(self.products[:2], cache_path)
+
+            self.assertEqual(len(rebuilt), 2)
+            self.assertNotIsInstance(rebuilt._matrix, np.memmap)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Test unitarios para Guardrails de Óptica Solar
+"""
+
+import asyncio
+import unittest
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+# Agregar el path del proyecto
+sys.path.append(str(Path(__file__).parent.parent / "retailGPT" / "actions_server" / "src"))
+
+from LLMChatbot.services.guardrails.guardrails import Guardrails
+
+
+def remote_check(result, delay, calls):
+    async def check(text):
+        calls.append("started")
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            calls.append("cancelled")
+            raise
+        return result
+    return check
+
+
+class TestInputGuardrails(unittest.IsolatedAsyncioTestCase):
+    """Test para los guardrails de entrada"""
+
+    async def test_safe_text_runs_remote_checks_concurrently(self):
+        """Test que las verificaciones remotas corren en paralelo"""
+        calls = []
+        timings = {}
+        with patch.object(Guardrails, "check_moderations", remote_check(False, 0.2, calls)), \
+             patch.object(Guardrails, "check_prompt_hack", remote_check(False, 0.2, calls)):
+            start = asyncio.get_running_loop().time()
+            result = await Guardrails.run_input_guardrails("Quiero gafas de sol", timings)
+            elapsed = asyncio.get_running_loop().time() - start
+
+        self.assertTrue(result)
+        self.assertLess(elapsed, 0.35)
+        self.assertEqual(
+            set(timings), {"sensitive_fields", "profanity", "moderation", "prompt_hack"}
+        )
+
+    async def test_local_checks_skip_remote_checks(self):
+        """Test que un dato sensible evita las llamadas remotas"""
+        calls = []
+        timings = {}
+        with patch.object(Guardrails, "check_moderations", remote_check(False, 0, calls)), \
+             patch.object(Guardrails, "check_prompt_hack", remote_check(False, 0, calls)):
+            result = await Guardrails.run_input_guardrails("mi correo es ana@ejemplo.com", timings)
+
+        self.assertFalse(result)
+        self.assertEqual(calls, [])
+        self.assertEqual(list(timings), ["sensitive_fields"])
+
+    async def test_triggered_check_cancels_the_others(self):
+        """Test que la primera verificación activada cancela las pendientes"""
+        calls = []
+        with patch.object(Guardrails, "check_moderations", remote_check(True, 0, calls)), \
+             patch.object(Guardrails, "check_prompt_hack", remote_check(False, 10, calls)):
+            result = await asyncio.wait_for(
+                Guardrails.run_input_guardrails("Quiero gafas de sol"), timeout=1
+            )
+
+        self.assertFalse(result)
+        self.assertEqual(calls, ["started", "started", "cancelled"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Test unitarios para el índice léxico (BM25) de Óptica Solar
+"""
+
+import unittest
+import sys
+from pathlib import Path
+
+# Agregar el path del proyecto
+sys.path.append(str(Path(__file__).parent.parent / "retailGPT" / "actions_server" / "src"))
+
+from LLMChatbot.services.lexical_index import LexicalIndex, analyze, fold_accents, stem
+
+
+class TestLexicalIndex(unittest.TestCase):
+    """Test para LexicalIndex"""
+
+    def setUp(self):
+        """Configuración inicial para cada test"""
+        self.products = [
+            {
+                "product_name": "Ray-Ban Aviator Classic Gold",
+                "brand": "Ray-Ban",
+                "model": "Aviator Classic",
+                "color": "Dorado",
+                "style": "Aviador",
+                "lens_type": "Polarizada",
+                "frame_material": "Metal",
+                "description": "Las clásicas gafas aviador con montura dorada.",
+            },
+            {
+                "product_name": "Oakley Radar EV Path Negro",
+                "brand": "Oakley",
+                "model": "Radar EV Path",
+                "color": "Negro",
+                "style": "Deportivo",
+                "lens_type": "Espejada",
+                "frame_material": "O Matter",
+                "description": "Gafas deportivas para correr y ciclismo.",
+            },
+            {
+                "product_name": "Tom Ford FT5235 Negro",
+                "brand": "Tom Ford",
+                "model": "FT5235",
+                "color": "Negro",
+                "style": "Cuadrado",
+                "lens_type": "Cristal",
+                "frame_material": "Acetato",
+                "description": "Montura de acetato con protección UV.",
+            },
+        ]
+        self.index = LexicalIndex(self.products)
+
+    def test_fold_accents(self):
+        """Test eliminación de acentos"""
+        self.assertEqual(fold_accents("Protección Clásica"), "proteccion clasica")
+
+    def test_stem_plural_and_gender(self):
+        """Test stemming de plurales y género"""
+        self.assertEqual(stem("polarizadas"), stem("polarizado"))
+        self.assertEqual(stem("negras"), stem("negro"))
+        self.assertEqual(stem("lentes"), stem("lente"))
+
+    def test_analyze_removes_stopwords_and_maps_synonyms(self):
+        """Test análisis de consultas en inglés y español"""
+        self.assertEqual(analyze("I want polarized sunglasses"), analyze("polarizadas gafas"))
+
+    def test_search_ranks_best_match_first(self):
+        """Test ranking por relevancia"""
+        results = self.index.search("sport sunglasses", 3)
+
+        self.assertEqual(results[0][0], 1)
+
+    def test_search_accent_insensitive(self):
+        """Test búsqueda sin acentos"""
+        results = self.index.search("proteccion", 3)
+
+        self.assertEqual([index for index, _ in results], [2])
+
+    def test_search_respects_k_and_candidates(self):
+        """Test límite de resultados y filtro de candidatos"""
+        self.assertEqual(len(self.index.search("negro", 1)), 1)
+
+        results = self.index.search("negro", 3, candidates=range(0, 3, 2))
+
+        self.assertEqual([index for index, _ in results], [2])
+
+    def test_search_no_match(self):
+        """Test consulta sin coincidencias"""
+        self.assertEqual(self.index.search("xyz", 3), [])
+
+    def test_empty_documents(self):
+        """Test índice con todos los documentos vacíos"""
+        index = LexicalIndex([{}, {"description": ""}])
+
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.search("gafas", 3), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
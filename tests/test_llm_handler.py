@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Test unitarios para LLMHandler de Óptica Solar
+"""
+
+import asyncio
+import unittest
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+# Agregar el path del proyecto
+sys.path.append(str(Path(__file__).parent.parent / "retailGPT" / "actions_server" / "src"))
+
+from LLMChatbot.services.llm_handler import LLMHandler
+from LLMChatbot.services.resilience import CircuitBreaker, CircuitOpenError, ProviderUnavailableError, RetryPolicy
+
+
+class FakeStream:
+    """Cuerpo de respuesta simulado, leído línea a línea"""
+
+    def __init__(self, lines):
+        self.lines = list(lines)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.lines:
+            raise StopAsyncIteration
+        return self.lines.pop(0)
+
+
+class FakeResponse:
+    """Respuesta HTTP simulada"""
+
+    def __init__(self, status, body=None, headers=None, lines=None):
+        self.status = status
+        self.body = body or {}
+        self.headers = headers or {}
+        self.content = FakeStream(lines or [])
+
+    async def json(self):
+        return self.body
+
+    async def text(self):
+        return str(self.body)
+
+    def raise_for_status(self):
+        raise RuntimeError(f"HTTP {self.status}")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+
+class HangingResponse(FakeResponse):
+    """Respuesta que nunca llega, cortada por el timeout como en aiohttp"""
+
+    def __init__(self):
+        super().__init__(200)
+        self.timeout = None
+
+    async def __aenter__(self):
+        await asyncio.sleep(self.timeout.total)
+        raise asyncio.TimeoutError()
+
+
+class FakeSession:
+    """Sesión HTTP simulada que devuelve respuestas en orden"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+        self.timeouts = []
+
+    def post(self, url, json=None, headers=None, timeout=None):
+        self.calls += 1
+        self.timeouts.append(timeout)
+        response = self.responses.pop(0)
+        response.timeout = timeout
+        return response
+
+
+def completion_response(content):
+    return FakeResponse(200, {"choices": [{"message": {"role": "assistant", "content": content}}]})
+
+
+class TestLLMHandlerSession(unittest.IsolatedAsyncioTestCase):
+    """Test para la sesión compartida de LLMHandler"""
+
+    async def asyncTearDown(self):
+        await LLMHandler.close_session()
+
+    async def test_session_is_reused(self):
+        """Test que la sesión se reutiliza entre llamadas"""
+        first = await LLMHandler.get_session()
+        second = await LLMHandler.get_session()
+
+        self.assertIs(first, second)
+        self.assertEqual(first.connector.limit_per_host, LLMHandler._connection_limit_per_host)
+
+    async def test_session_recreated_after_close(self):
+        """Test que la sesión se recrea después de cerrarla"""
+        first = await LLMHandler.get_session()
+        await LLMHandler.close_session()
+
+        self.assertTrue(first.closed)
+        self.assertIsNot(await LLMHandler.get_session(), first)
+
+    async def test_session_recreated_on_new_loop(self):
+        """Test que la sesión se recrea si cambia el event loop"""
+        first = await LLMHandler.get_session()
+        other_loop = asyncio.new_event_loop()
+        LLMHandler._session_loop = other_loop
+
+        try:
+            self.assertIsNot(await LLMHandler.get_session(), first)
+            self.assertTrue(first.closed)
+        finally:
+            other_loop.close()
+
+    def test_sync_wrapper_closes_its_session_and_loop(self):
+        """Test que el wrapper síncrono cierra su sesión y su event loop"""
+        sessions = []
+
+        async def call_completions_api(messages, tools=None, session=None, use_azure=False, **kwargs):
+            sessions.append(session)
+            return {"role": "assistant", "content": "Hola"}
+
+        with patch.object(LLMHandler, "call_completions_api", call_completions_api):
+            response = LLMHandler.call_completions_api_sync([])
+
+        self.assertEqual(response["content"], "Hola")
+        self.assertTrue(sessions[0].closed)
+        self.assertIsNone(LLMHandler._session)
+
+
+class TestLLMHandlerRetries(unittest.IsolatedAsyncioTestCase):
+    """Test para la política de reintentos de LLMHandler"""
+
+    def setUp(self):
+        self.policy = RetryPolicy(max_attempts=3, base_delay=0.001, max_delay=0.001, deadline=1)
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        self.patches = [
+            patch.object(LLMHandler, "_retry_policy", self.policy),
+            patch.object(LLMHandler, "_circuit_breaker", self.breaker),
+        ]
+        for patcher in self.patches:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patches:
+            patcher.stop()
+
+    async def test_retries_transient_errors(self):
+        """Test reintento tras un 429 con Retry-After"""
+        session = FakeSession([
+            FakeResponse(429, headers={"Retry-After": "0"}),
+            completion_response("Hola"),
+        ])
+
+        response = await LLMHandler.call_completions_api([], session=session)
+
+        self.assertEqual(response["content"], "Hola")
+        self.assertEqual(session.calls, 2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    async def test_deadline_returns_canned_reply(self):
+        """Test que la fecha límite corta los reintentos"""
+        session = FakeSession([FakeResponse(429, headers={"Retry-After": "30"})])
+
+        response = await LLMHandler.call_completions_api([], session=session)
+
+        self.assertEqual(response["content"], LLMHandler._provider_unavailable_message)
+        self.assertEqual(session.calls, 1)
+
+    async def test_retries_count_as_one_failure(self):
+        """Test que los reintentos de una petición cuentan como un solo fallo del circuit breaker"""
+        session = FakeSession([FakeResponse(503) for _ in range(3)])
+
+        response = await LLMHandler.call_completions_api([], session=session)
+
+        self.assertEqual(session.calls, 3)
+        self.assertEqual(response["content"], LLMHandler._provider_unavailable_message)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    async def test_open_circuit_fails_fast(self):
+        """Test que el circuito abierto evita llamar al proveedor"""
+        session = FakeSession([FakeResponse(503) for _ in range(6)])
+
+        await LLMHandler.call_completions_api([], session=session)
+        await LLMHandler.call_completions_api([], session=session)
+        response = await LLMHandler.call_completions_api([], session=session)
+
+        self.assertEqual(session.calls, 6)
+        self.assertTrue(LLMHandler.is_provider_unavailable())
+        self.assertEqual(response["content"], LLMHandler._provider_unavailable_message)
+
+    async def test_client_errors_are_not_retried(self):
+        """Test que los errores del cliente no se reintentan"""
+        session = FakeSession([FakeResponse(400)])
+
+        response = await LLMHandler.call_completions_api([], session=session)
+
+        self.assertEqual(session.calls, 1)
+        self.assertEqual(response["content"], "An unexpected error occurred.")
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    async def test_moderation_retries_transient_errors(self):
+        """Test que la moderación reintenta los errores transitorios"""
+        session = FakeSession([
+            FakeResponse(503),
+            FakeResponse(200, {"results": [{"flagged": True}]}),
+        ])
+
+        self.assertTrue(await LLMHandler.call_moderations_api("Hola", session=session))
+        self.assertEqual(session.calls, 2)
+
+    async def test_hanging_moderation_is_bounded_by_its_deadline(self):
+        """Test que una moderación sin respuesta se corta en su fecha límite"""
+        session = FakeSession([HangingResponse() for _ in range(3)])
+
+        with self.assertRaises(ProviderUnavailableError):
+            await asyncio.wait_for(LLMHandler.call_moderations_api("Hola", session=session, deadline=0.05), 1)
+
+        self.assertLessEqual(session.timeouts[0].total, 0.05)
+
+    async def test_moderation_fails_fast_while_circuit_is_open(self):
+        """Test que la moderación no llama al proveedor con el circuito abierto"""
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        session = FakeSession([])
+
+        with self.assertRaises(CircuitOpenError):
+            await LLMHandler.call_moderations_api("Hola", session=session)
+
+        self.assertEqual(session.calls, 0)
+
+
+class TestLLMHandlerStreaming(unittest.IsolatedAsyncioTestCase):
+    """Test para las respuestas en streaming de LLMHandler"""
+
+    def setUp(self):
+        self.policy = RetryPolicy(max_attempts=3, base_delay=0.001, max_delay=0.001, deadline=1)
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        self.patches = [
+            patch.object(LLMHandler, "_retry_policy", self.policy),
+            patch.object(LLMHandler, "_circuit_breaker", self.breaker),
+        ]
+        for patcher in self.patches:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patches:
+            patcher.stop()
+
+    async def collect(self, session):
+        return [event async for event in LLMHandler.stream_completions_api([], session=session)]
+
+    async def test_stream_yields_deltas_and_message(self):
+        """Test que el streaming entrega el texto parcial y el mensaje completo"""
+        lines = [
+            b'data: {"choices": [{"delta": {"role": "assistant", "content": "Ho"}}]}\n',
+            b"\n",
+            b'data: {"choices": [{"delta": {"content": "la"}}]}\n',
+            b"data: [DONE]\n",
+        ]
+        session = FakeSession([
+            FakeResponse(503),
+            FakeResponse(200, lines=lines),
+        ])
+
+        events = await self.collect(session)
+
+        self.assertEqual(
+            [event["delta"] for event in events if event["type"] == "content"], ["Ho", "la"]
+        )
+        self.assertEqual(events[-1]["type"], "message")
+        self.assertEqual(events[-1]["message"]["content"], "Hola")
+        self.assertIsNone(events[-1]["message"]["tool_calls"])
+        self.assertEqual(session.calls, 2)
+
+    async def test_stream_timeout_bounds_reads_not_the_whole_stream(self):
+        """Test que el timeout del streaming limita la conexión y cada lectura, no el stream completo"""
+        session = FakeSession([FakeResponse(200, lines=[b"data: [DONE]\n"])])
+
+        await self.collect(session)
+
+        timeout = session.timeouts[0]
+        self.assertIsNone(timeout.total)
+        self.assertIsNotNone(timeout.connect)
+        self.assertIsNotNone(timeout.sock_read)
+
+    async def test_stream_open_circuit_yields_canned_reply(self):
+        """Test que el circuito abierto entrega la respuesta de indisponibilidad"""
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        session = FakeSession([])
+
+        events = await self.collect(session)
+
+        self.assertEqual(session.calls, 0)
+        self.assertEqual(events[-1]["message"]["content"], LLMHandler._provider_unavailable_message)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Test unitarios para InMemoryBackend de Óptica Solar
+"""
+
+import asyncio
+import tempfile
+import unittest
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+from redis.exceptions import WatchError
+
+# Agregar el path del proyecto
+sys.path.append(str(Path(__file__).parent.parent / "retailGPT" / "actions_server" / "src"))
+
+from LLMChatbot.services.database import Database
+from LLMChatbot.services.memory_backend import InMemoryBackend
+from LLMChatbot.services.user_session import UserSession
+
+
+class TestInMemoryBackend(unittest.IsolatedAsyncioTestCase):
+    """Test para los comandos del backend en memoria"""
+
+    async def test_set_and_get(self):
+        """Test que guarda y lee valores como bytes"""
+        backend = InMemoryBackend()
+        await backend.set("user:cart", "[]")
+
+        self.assertEqual(await backend.get("user:cart"), b"[]")
+        self.assertEqual(await backend.mget(["user:cart", "user:history"]), [b"[]", None])
+        self.assertIsNone(await backend.set("user:cart", "[1]", nx=True))
+
+    async def test_keys_expire(self):
+        """Test que las claves expiran con su TTL"""
+        backend = InMemoryBackend()
+        with patch("LLMChatbot.services.memory_backend.time.time", return_value=1000):
+            await backend.set("user:tool_calls", "[]", ex=60)
+            self.assertEqual(await backend.ttl("user:tool_calls"), 60)
+
+        with patch("LLMChatbot.services.memory_backend.time.time", return_value=1061):
+            self.assertIsNone(await backend.get("user:tool_calls"))
+            self.assertEqual(await backend.ttl("user:tool_calls"), -2)
+
+    async def test_least_recently_used_keys_are_evicted(self):
+        """Test que se descartan las claves menos usadas al superar el máximo"""
+        backend = InMemoryBackend(max_keys=2)
+        await backend.set("user1:cart", "[]")
+        await backend.set("user2:cart", "[]")
+        await backend.get("user1:cart")
+        await backend.set("user3:cart", "[]")
+
+        self.assertEqual(sorted(await backend.keys()), [b"user1:cart", b"user3:cart"])
+
+    async def test_lists(self):
+        """Test que agrega, recorta y lee listas"""
+        backend = InMemoryBackend()
+        await backend.rpush("user:history", "a", "b", "c")
+        await backend.ltrim("user:history", -2, -1)
+
+        self.assertEqual(await backend.lrange("user:history", 0, -1), [b"b", b"c"])
+
+    async def test_watched_key_changed(self):
+        """Test que la transacción falla si una clave observada cambió"""
+        backend = InMemoryBackend()
+        async with backend.pipeline(transaction=True) as pipeline:
+            await pipeline.watch("user:cart")
+            self.assertEqual(await pipeline.mget(["user:cart"]), [None])
+            await backend.set("user:cart", "[1]")
+            pipeline.multi()
+            pipeline.set("user:cart", "[2]")
+            with self.assertRaises(WatchError):
+                await pipeline.execute()
+
+        self.assertEqual(await backend.get("user:cart"), b"[1]")
+
+    async def test_watched_key_set_and_deleted(self):
+        """Test que la transacción falla si una clave observada se creó y se borró"""
+        backend = InMemoryBackend()
+        async with backend.pipeline(transaction=True) as pipeline:
+            await pipeline.watch("user:cart")
+            await backend.set("user:cart", "[1]")
+            await backend.delete("user:cart")
+            pipeline.multi()
+            pipeline.set("user:cart", "[2]")
+            with self.assertRaises(WatchError):
+                await pipeline.execute()
+
+    async def test_versions_are_not_kept_for_unwatched_keys(self):
+        """Test que las versiones no crecen con las claves escritas y borradas"""
+        backend = InMemoryBackend(max_keys=2)
+        for user in range(10):
+            await backend.set(f"user{user}:cart", "[]")
+        async with backend.pipeline(transaction=True) as pipeline:
+            await pipeline.watch("user9:cart")
+            pipeline.multi()
+            pipeline.set("user9:cart", "[1]")
+            await pipeline.execute()
+
+        self.assertEqual(backend._versions, {})
+        self.assertEqual(backend._watchers, {})
+
+    async def test_snapshot_is_replayed(self):
+        """Test que los datos se recuperan del archivo de snapshot"""
+        with tempfile.TemporaryDirectory() as directory:
+            snapshot_path = str(Path(directory) / "snapshot.jsonl")
+            backend = InMemoryBackend(snapshot_path=snapshot_path)
+            await backend.set("user:cart", "[]", ex=3600)
+            await backend.rpush("user:history", "a", "b")
+            await backend.set("user:tool_calls", "[]")
+            await backend.delete("user:tool_calls")
+            await backend.aclose()
+
+            restored = InMemoryBackend(snapshot_path=snapshot_path)
+
+            self.assertEqual(await restored.get("user:cart"), b"[]")
+            self.assertGreater(await restored.ttl("user:cart"), 3500)
+            self.assertEqual(await restored.lrange("user:history", 0, -1), [b"a", b"b"])
+            self.assertFalse(await restored.exists("user:tool_calls"))
+
+    async def test_snapshot_is_compacted(self):
+        """Test que el archivo de snapshot se reescribe al acumular entradas obsoletas"""
+        with tempfile.TemporaryDirectory() as directory:
+            snapshot_path = Path(directory) / "snapshot.jsonl"
+            backend = InMemoryBackend(snapshot_path=str(snapshot_path))
+            for value in range(1100):
+                await backend.set("user:cart", str(value))
+            await backend.aclose()
+
+            self.assertLess(len(snapshot_path.read_text().splitlines()), 1100)
+            self.assertEqual(await InMemoryBackend(snapshot_path=str(snapshot_path)).get("user:cart"), b"1099")
+
+
+class TestDatabaseInMemory(unittest.IsolatedAsyncioTestCase):
+    """Test para Database sobre el backend en memoria"""
+
+    async def asyncSetUp(self):
+        self.patches = [
+            patch.object(Database, "_backend", "memory"),
+            patch.object(Database, "_memory", None),
+        ]
+        for patcher in self.patches:
+            patcher.start()
+
+    async def asyncTearDown(self):
+        await Database.close()
+        for patcher in self.patches:
+            patcher.stop()
+
+    async def test_fields_with_ttl(self):
+        """Test que los campos se guardan con el TTL de cada uno"""
+        await Database.set_fields("user", {"cart": [], "tool_calls": []})
+
+        self.assertEqual(await Database.get_fields("user", ["cart", "tool_calls"]), {"cart": [], "tool_calls": []})
+        self.assertEqual(await Database.get_client().ttl("user:tool_calls"), Database.get_ttl("tool_calls"))
+
+    async def test_concurrent_updates_are_not_lost(self):
+        """Test que las actualizaciones concurrentes no se pierden"""
+
+        async def add_item(cart):
+            await asyncio.sleep(0)
+            return cart + [len(cart)]
+
+        await asyncio.gather(*[Database.update_field("user", "cart", add_item, []) for _ in range(10)])
+
+        self.assertEqual(await Database.get_field("user", "cart"), list(range(10)))
+
+    async def test_session_flush(self):
+        """Test que la sesión escribe sus cambios al terminar"""
+        async with UserSession.start("user"):
+            await Database.update_field("user", "history", lambda history: history + ["Hola"], [])
+
+        self.assertEqual(await Database.get_field("user", "history"), ["Hola"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Test unitarios para MemoryHandler de Óptica Solar
+"""
+
+import json
+import unittest
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+from fakeredis import FakeAsyncRedis
+
+# Agregar el path del proyecto
+sys.path.append(str(Path(__file__).parent.parent / "retailGPT" / "actions_server" / "src"))
+
+from LLMChatbot.chatbot import LLMChatbot
+from LLMChatbot.prompts import chatbot_system_prompt
+from LLMChatbot.services.database import Database
+from LLMChatbot.services.llm_handler import LLMHandler
+from LLMChatbot.services.memory_handler import MemoryHandler
+from LLMChatbot.services.token_counter import TokenCounter
+from LLMChatbot.services.user_session import UserSession
+
+
+def tool_exchange(call_id: str) -> list[dict]:
+    """Mensaje del asistente con una tool call y su resultado"""
+    return [
+        {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [
+                {"id": call_id, "type": "function", "function": {"name": "get_cart", "arguments": "{}"}}
+            ],
+        },
+        {"role": "tool", "content": "Carrito vacío", "tool_call_id": call_id},
+    ]
+
+
+class TestMemoryHandlerHistory(unittest.IsolatedAsyncioTestCase):
+    """Test para el historial guardado como lista acotada"""
+
+    async def asyncSetUp(self):
+        self.redis = FakeAsyncRedis()
+        self.patcher = patch.object(Database, "get_client", return_value=self.redis)
+        self.patcher.start()
+
+    async def asyncTearDown(self):
+        self.patcher.stop()
+        await self.redis.aclose()
+
+    async def test_messages_are_appended_to_a_capped_list(self):
+        """Test que los mensajes se agregan a una lista recortada al largo del historial"""
+        for index in range(MemoryHandler._history_length + 2):
+            await MemoryHandler.add_message_to_history("user", {"role": "user", "content": f"Mensaje {index}"})
+
+        history = await MemoryHandler.get_history("user")
+
+        self.assertEqual(await self.redis.llen("user:history"), MemoryHandler._history_length)
+        self.assertEqual(history[0]["content"], "Mensaje 2")
+        self.assertEqual(history[-1]["content"], f"Mensaje {MemoryHandler._history_length + 1}")
+
+    async def test_trimming_keeps_tool_results_with_their_call(self):
+        """Test que el recorte no separa los resultados de las tools de su llamada"""
+        await MemoryHandler.add_messages_to_history("user", tool_exchange("call_0"))
+        for index in range(MemoryHandler._history_length - 1):
+            await MemoryHandler.add_message_to_history("user", {"role": "user", "content": f"Mensaje {index}"})
+        await MemoryHandler.add_messages_to_history("user", tool_exchange("call_1"))
+
+        history = await MemoryHandler.get_history("user")
+
+        self.assertNotEqual(history[0]["role"], "tool")
+        self.assertEqual(history[-2:], tool_exchange("call_1"))
+        self.assertNotIn(tool_exchange("call_0")[1], history)
+
+    async def test_window_fits_the_token_budget(self):
+        """Test que el historial enviado entra en el presupuesto de tokens, descartando los más antiguos"""
+        long_message = {"role": "user", "content": "gafas " * 400}
+        await MemoryHandler.add_message_to_history("user", long_message)
+        for index in range(3):
+            await MemoryHandler.add_message_to_history("user", {"role": "user", "content": f"Mensaje {index}"})
+
+        with patch.object(MemoryHandler, "_history_token_budget", 100):
+            history = await MemoryHandler.get_history("user")
+
+        self.assertNotIn(long_message, history)
+        self.assertEqual([message["content"] for message in history], ["Mensaje 0", "Mensaje 1", "Mensaje 2"])
+        self.assertLessEqual(TokenCounter.count_messages(history), 100)
+
+    async def test_window_keeps_the_last_entry(self):
+        """Test que el último mensaje se envía aunque supere el presupuesto"""
+        await MemoryHandler.add_message_to_history("user", {"role": "user", "content": "Hola"})
+
+        with patch.object(MemoryHandler, "_history_token_budget", 0):
+            history = await MemoryHandler.get_history_with_message("user", {"role": "user", "content": "Busco gafas"})
+
+        self.assertEqual(history, [{"role": "user", "content": "Busco gafas"}])
+
+    async def test_entries_store_their_tokens(self):
+        """Test que cada entrada guarda sus tokens para no contarlos en cada turno"""
+        await MemoryHandler.add_messages_to_history("user", tool_exchange("call_0"))
+
+        entries = await Database.get_field("user", "history")
+
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(
+            entries[0]["tokens"], sum(TokenCounter.count_message(message) for message in tool_exchange("call_0"))
+        )
+
+    async def test_single_record_history_is_converted(self):
+        """Test que el historial guardado como un solo registro se convierte en lista"""
+        messages = [{"role": "user", "content": "Hola"}, {"role": "assistant", "content": "¡Hola!"}]
+        await self.redis.set("user:history", json.dumps(messages))
+
+        await MemoryHandler.add_message_to_history("user", {"role": "user", "content": "Busco gafas"})
+
+        self.assertEqual(
+            await MemoryHandler.get_history("user"),
+            messages + [{"role": "user", "content": "Busco gafas"}],
+        )
+
+    async def test_session_appends_without_rewriting(self):
+        """Test que la sesión agrega los mensajes sin reescribir el historial"""
+        await MemoryHandler.add_message_to_history("user", {"role": "user", "content": "Hola"})
+
+        with patch.object(Database, "_queue_set", wraps=Database._queue_set) as queue_set:
+            async with UserSession.start("user"):
+                await MemoryHandler.add_message_to_history("user", {"role": "assistant", "content": "¡Hola!"})
+                self.assertEqual(len(await MemoryHandler.get_history("user")), 2)
+
+        queue_set.assert_not_called()
+        self.assertEqual(await MemoryHandler.get_history("user"), [
+            {"role": "user", "content": "Hola"},
+            {"role": "assistant", "content": "¡Hola!"},
+        ])
+
+
+class TestMemoryHandlerSummary(unittest.IsolatedAsyncioTestCase):
+    """Test para el resumen de los mensajes que ya no entran en el prompt"""
+
+    async def asyncSetUp(self):
+        self.redis = FakeAsyncRedis()
+        self.prompts = []
+
+        async def call_completions_api(messages, **kwargs):
+            self.prompts.append(messages[0]["content"])
+            return {"role": "assistant", "content": json.dumps({"summary": "Busca gafas de sol para conducir"})}
+
+        self.patches = [
+            patch.object(Database, "get_client", return_value=self.redis),
+            patch.object(LLMHandler, "call_completions_api", call_completions_api),
+            patch.object(MemoryHandler, "_history_token_budget", 30),
+        ]
+        for patcher in self.patches:
+            patcher.start()
+
+        for index in range(4):
+            await MemoryHandler.add_message_to_history(
+                "user", {"role": "user", "content": f"Mensaje {index} sobre gafas de sol para conducir"}
+            )
+
+    async def asyncTearDown(self):
+        for patcher in self.patches:
+            patcher.stop()
+        await self.redis.aclose()
+
+    async def test_overflow_is_folded_into_the_summary(self):
+        """Test que los mensajes fuera del presupuesto pasan al resumen y salen del historial"""
+        window = await MemoryHandler.get_history("user")
+
+        await MemoryHandler._update_summary("user")
+
+        self.assertEqual(await MemoryHandler.get_summary("user"), "Busca gafas de sol para conducir")
+        self.assertEqual(len(await Database.get_field("user", "history")), len(window))
+        self.assertEqual(await MemoryHandler.get_history("user"), window)
+        self.assertIn("Mensaje 0", self.prompts[0])
+        self.assertNotIn(window[-1]["content"], self.prompts[0])
+
+    async def test_summary_is_discarded_if_history_changed(self):
+        """Test que el resumen se descarta si otro turno cambió los mensajes resumidos"""
+        summarize = MemoryHandler._summarize
+
+        async def summarize_while_history_changes(summary, messages):
+            await Database.set_field("user", "history", [])
+            return await summarize(summary, messages)
+
+        with patch.object(MemoryHandler, "_summarize", summarize_while_history_changes):
+            await MemoryHandler._update_summary("user")
+
+        self.assertIsNone(await MemoryHandler.get_summary("user"))
+
+    async def test_summary_is_not_updated_on_failed_request(self):
+        """Test que no se guarda resumen si el LLM no devuelve JSON"""
+
+        async def call_completions_api(messages, **kwargs):
+            return {"role": "assistant", "content": LLMHandler._provider_unavailable_message}
+
+        with patch.object(LLMHandler, "call_completions_api", call_completions_api):
+            await MemoryHandler._update_summary("user")
+
+        self.assertIsNone(await MemoryHandler.get_summary("user"))
+        self.assertEqual(len(await Database.get_field("user", "history")), 4)
+
+    async def test_summary_runs_in_background_outside_the_session(self):
+        """Test que el resumen corre en segundo plano sobre los datos guardados"""
+        async with UserSession.start("user"):
+            MemoryHandler.schedule_summary("user")
+            task = MemoryHandler._summary_tasks["user"]
+        await task
+
+        self.assertEqual(await MemoryHandler.get_summary("user"), "Busca gafas de sol para conducir")
+        self.assertNotIn("user", MemoryHandler._summary_tasks)
+
+    async def test_summary_is_sent_after_the_system_prompt(self):
+        """Test que el resumen se envía después del prompt de sistema"""
+        await Database.set_field("user", "summary", "Busca gafas de sol para conducir")
+
+        messages = await LLMChatbot._get_system_messages("user")
+
+        self.assertEqual(messages[0]["content"], chatbot_system_prompt)
+        self.assertIn("Busca gafas de sol para conducir", messages[1]["content"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,13 +9,17 @@ import sys
 from pathlib import Path
 from unittest.mock import patch, mock_open
 
+from fakeredis import FakeAsyncRedis
+
 # Agregar el path del proyecto
 sys.path.append(str(Path(__file__).parent.parent / "retailGPT" / "actions_server" / "src"))
 
+from LLMChatbot.services.catalog_store import CatalogStore
+from LLMChatbot.services.database import Database
 from LLMChatbot.services.product_handler import ProductHandler
 
 
-class TestProductHandler(unittest.TestCase):
+class TestProductHandler(unittest.IsolatedAsyncioTestCase):
     """Test para ProductHandler"""
     
     def setUp(self):
@@ -54,13 +58,15 @@ class TestProductHandler(unittest.TestCase):
                 }
             ]
         }
+        self.original_products = CatalogStore.get_products()
+        CatalogStore.load_products(self.sample_products["products"])
     
-    @patch('builtins.open', new_callable=mock_open)
-    @patch('json.load')
-    def test_get_product_catalog(self, mock_json_load, mock_file):
+    def tearDown(self):
+        """Restaura el catálogo original"""
+        CatalogStore.load_products(self.original_products)
+    
+    def test_get_product_catalog(self):
         """Test obtención de catálogo de productos"""
-        mock_json_load.return_value = self.sample_products
-        
         catalog = ProductHandler._get_product_catalog("12345678")
         
         self.assertIsInstance(catalog, str)
@@ -69,28 +75,56 @@ class TestProductHandler(unittest.TestCase):
         self.assertIn("R$299.99", catalog)
         self.assertIn("R$189.99", catalog)
     
-    @patch('builtins.open', new_callable=mock_open)
-    @patch('json.load')
-    def test_get_product_catalog_empty_zipcode(self, mock_json_load, mock_file):
+    def test_get_product_catalog_empty_zipcode(self):
         """Test catálogo con código postal que empieza en 0"""
-        mock_json_load.return_value = self.sample_products
-        
         catalog = ProductHandler._get_product_catalog("01234567")
         
         self.assertEqual(catalog, "")
     
-    @patch('builtins.open', new_callable=mock_open)
-    @patch('json.load')
-    def test_get_product_catalog_restricted_zipcode(self, mock_json_load, mock_file):
+    def test_get_product_catalog_restricted_zipcode(self):
         """Test catálogo con código postal restringido"""
-        mock_json_load.return_value = self.sample_products
-        
         catalog = ProductHandler._get_product_catalog("91234567")
         
         # Solo debería incluir productos con índice % 3 == 0
         self.assertIn("Ray-Ban", catalog)  # índice 0
         self.assertNotIn("Oakley", catalog)  # índice 1
     
+    def test_get_product_catalog_cached_per_region(self):
+        """Test catálogo regional cacheado e invalidado al recargar el catálogo"""
+        full_catalog = ProductHandler._get_product_catalog("12345678")
+        
+        self.assertIs(ProductHandler._get_product_catalog("22345678"), full_catalog)
+        
+        CatalogStore.load_products(self.sample_products["products"][1:])
+        catalog = ProductHandler._get_product_catalog("12345678")
+        
+        self.assertNotIn("Ray-Ban", catalog)
+        self.assertIn("Oakley", catalog)
+    
+    def test_get_product_shortlist_bounded(self):
+        """Test que el catálogo enviado al prompt se limita a los K mejores productos"""
+        products = []
+        for index in range(100):
+            product = dict(self.sample_products["products"][index % 2])
+            product["row_id"] = index
+            product["product_name"] = f"{product['product_name']} {index}"
+            products.append(product)
+        CatalogStore.load_products(products)
+        
+        with patch.object(ProductHandler, "_retrieval_top_k", 5):
+            shortlist = ProductHandler._get_product_shortlist("oakley wayfarer", "12345678")
+        
+        lines = shortlist.splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertTrue(all("Oakley" in line for line in lines))
+    
+    def test_semantic_search_engine(self):
+        """Test búsqueda semántica sin llamar al LLM"""
+        recommendation = ProductHandler._semantic_search_engine("Oakley Holbrook", "12345678")
+        
+        self.assertEqual([p["row_id"] for p in recommendation], [2])
+        self.assertEqual(ProductHandler._semantic_search_engine("Oakley Holbrook", "01234567"), [])
+    
     @patch('builtins.open', new_callable=mock_open)
     @patch('json.load')
     def test_format_product_recommendation(self, mock_json_load, mock_file):
@@ -156,27 +190,19 @@ class TestProductHandler(unittest.TestCase):
         history_9 = ProductHandler._get_purchase_history("12345679")
         self.assertEqual(history_9, "")
     
-    def test_product_was_recommended(self):
+    async def test_product_was_recommended(self):
         """Test verificación si producto fue recomendado"""
-        # Mock de datos de usuario
-        user_data = {
-            "recommended_products": [
-                {
-                    "product_name": "Ray-Ban Aviator Classic Gold",
-                    "brand": "Ray-Ban",
-                    "full_price": 299.99
-                }
-            ]
-        }
-        
-        with patch.object(ProductHandler, '_get_recommendations_data', return_value=user_data["recommended_products"]):
-            result = ProductHandler.product_was_recommended("user123", "Ray-Ban Aviator Classic Gold")
+        # Recomendaciones guardadas por nombre normalizado
+        recommendations = {"ray-ban aviator classic gold": 1}
+
+        with patch.object(ProductHandler, '_get_recommendations_data', return_value=recommendations):
+            result = await ProductHandler.product_was_recommended("user123", "Ray-Ban Aviator Classic Gold")
             self.assertTrue(result)
             
-            result = ProductHandler.product_was_recommended("user123", "Oakley Holbrook")
+            result = await ProductHandler.product_was_recommended("user123", "Oakley Holbrook")
             self.assertFalse(result)
     
-    def test_get_product_unit_price(self):
+    async def test_get_product_unit_price(self):
         """Test obtención de precio unitario"""
         user_data = {
             "recommended_products": [
@@ -189,13 +215,13 @@ class TestProductHandler(unittest.TestCase):
         }
         
         with patch.object(ProductHandler, '_get_product_data', return_value=user_data["recommended_products"][0]):
-            price = ProductHandler.get_product_unit_price("user123", "Ray-Ban Aviator Classic Gold")
+            price = await ProductHandler.get_product_unit_price("user123", "Ray-Ban Aviator Classic Gold")
             self.assertEqual(price, 299.99)
             
-            price = ProductHandler.get_product_unit_price("user123", "Producto Inexistente")
+            price = await ProductHandler.get_product_unit_price("user123", "Producto Inexistente")
             self.assertIsNone(price)
     
-    def test_get_product_unit_volume(self):
+    async def test_get_product_unit_volume(self):
         """Test obtención de volumen unitario"""
         user_data = {
             "recommended_products": [
@@ -208,13 +234,82 @@ class TestProductHandler(unittest.TestCase):
         }
         
         with patch.object(ProductHandler, '_get_product_data', return_value=user_data["recommended_products"][0]):
-            volume = ProductHandler.get_product_unit_volume("user123", "Ray-Ban Aviator Classic Gold")
+            volume = await ProductHandler.get_product_unit_volume("user123", "Ray-Ban Aviator Classic Gold")
             self.assertEqual(volume, 0.001)  # Volumen fijo para gafas de sol
             
-            volume = ProductHandler.get_product_unit_volume("user123", "Producto Inexistente")
+            volume = await ProductHandler.get_product_unit_volume("user123", "Producto Inexistente")
             self.assertIsNone(volume)
 
 
+class TestRecommendedProducts(unittest.IsolatedAsyncioTestCase):
+    """Test para los productos recomendados guardados por nombre"""
+
+    async def asyncSetUp(self):
+        self.redis = FakeAsyncRedis()
+        self.patcher = patch.object(Database, "get_client", return_value=self.redis)
+        self.patcher.start()
+        self.product = CatalogStore.get_by_name("Ray-Ban Aviator Classic Gold")
+        self.other_product = CatalogStore.get_by_name("Ray-Ban Wayfarer Classic Negro")
+
+    async def asyncTearDown(self):
+        self.patcher.stop()
+        await self.redis.aclose()
+
+    async def test_repeated_recommendations_are_deduplicated(self):
+        """Test que recomendar el mismo producto varias veces no agrega entradas"""
+        for _ in range(3):
+            await ProductHandler._add_recommended_products_data("user", [self.product])
+
+        recommendations = await ProductHandler._get_recommendations_data("user")
+
+        self.assertEqual(recommendations, {"ray-ban aviator classic gold": self.product["row_id"]})
+        self.assertTrue(await ProductHandler.product_was_recommended("user", "  RAY-BAN Aviator Classic Gold"))
+
+    async def test_product_data_comes_from_the_catalog(self):
+        """Test que los datos del producto recomendado se obtienen del catálogo"""
+        await ProductHandler._add_recommended_products_data("user", [self.product])
+
+        self.assertIs(await ProductHandler._get_product_data("user", "Ray-Ban Aviator Classic Gold"), self.product)
+        self.assertIs(await ProductHandler.get_recommended_product("user", "Ray-Ban Aviator Classic Gold"), self.product)
+        self.assertIsNone(await ProductHandler.get_recommended_product("user", "Oakley Holbrook"))
+
+    async def test_list_of_older_versions_is_indexed(self):
+        """Test que la lista guardada por versiones anteriores se indexa por nombre"""
+        legacy_product = {key: value for key, value in self.product.items() if key != "row_id"}
+        await Database.set_field("user", "recommended_products", [legacy_product, legacy_product])
+
+        await ProductHandler._add_recommended_products_data("user", [self.other_product])
+
+        self.assertEqual(
+            await Database.get_field("user", "recommended_products"),
+            {
+                "ray-ban aviator classic gold": self.product["row_id"],
+                "ray-ban wayfarer classic negro": self.other_product["row_id"],
+            },
+        )
+
+    async def test_product_copies_of_older_versions_are_converted(self):
+        """Test que las copias de productos guardadas por versiones anteriores se convierten en row_id"""
+        missing_product = {"product_name": "Producto Inexistente", "full_price": 1.0}
+        await Database.set_field(
+            "user",
+            "recommended_products",
+            {"ray-ban aviator classic gold": dict(self.product), "producto inexistente": missing_product},
+        )
+
+        recommendations = await ProductHandler._get_recommendations_data("user")
+
+        self.assertEqual(recommendations, {"ray-ban aviator classic gold": self.product["row_id"]})
+
+    def test_current_index_is_used_as_is(self):
+        """Test que un índice ya convertido se usa sin recorrerlo ni copiarlo"""
+        recommendations = {"ray-ban aviator classic gold": self.product["row_id"]}
+
+        self.assertIs(ProductHandler.index_recommendations(recommendations), recommendations)
+        self.assertIs(
+            ProductHandler.find_recommended_product(recommendations, "Ray-Ban Aviator Classic Gold"), self.product
+        )
+
 if __name__ == '__main__':
     unittest.main()
 
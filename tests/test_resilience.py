@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Test unitarios para la política de reintentos y el circuit breaker de Óptica Solar
+"""
+
+import unittest
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+# Agregar el path del proyecto
+sys.path.append(str(Path(__file__).parent.parent / "retailGPT" / "actions_server" / "src"))
+
+from LLMChatbot.services.resilience import CircuitBreaker, RetryPolicy
+
+
+class TestRetryPolicy(unittest.TestCase):
+    """Test para RetryPolicy"""
+
+    def test_delay_is_capped_full_jitter(self):
+        """Test backoff exponencial limitado con jitter completo"""
+        policy = RetryPolicy(base_delay=1, max_delay=4)
+
+        with patch("LLMChatbot.services.resilience.random.uniform", side_effect=lambda a, b: b):
+            self.assertEqual(policy.get_delay(1), 1)
+            self.assertEqual(policy.get_delay(3), 4)
+            self.assertEqual(policy.get_delay(10), 4)
+
+        for attempt in range(1, 10):
+            self.assertLessEqual(policy.get_delay(attempt), 4)
+
+    def test_retry_after_header(self):
+        """Test cabecera Retry-After en segundos y como fecha"""
+        policy = RetryPolicy()
+
+        self.assertEqual(policy.get_delay(1, "7"), 7)
+        self.assertEqual(RetryPolicy.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+        self.assertIsNone(RetryPolicy.parse_retry_after("invalid"))
+        self.assertIsNone(RetryPolicy.parse_retry_after(None))
+
+    def test_should_retry_status(self):
+        """Test estados que se reintentan"""
+        policy = RetryPolicy()
+
+        self.assertTrue(policy.should_retry_status(429))
+        self.assertTrue(policy.should_retry_status(503))
+        self.assertFalse(policy.should_retry_status(400))
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """Test para CircuitBreaker"""
+
+    def test_opens_after_threshold(self):
+        """Test apertura tras fallos consecutivos"""
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+
+        breaker.record_failure()
+        self.assertTrue(breaker.allow_request())
+        breaker.record_failure()
+
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertTrue(breaker.is_open())
+        self.assertFalse(breaker.allow_request())
+
+    def test_success_resets_failures(self):
+        """Test que un éxito reinicia el contador"""
+        breaker = CircuitBreaker(failure_threshold=2)
+
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_single_probe(self):
+        """Test estado semiabierto con una sola solicitud de prueba"""
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+
+        breaker.record_success()
+
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_failure_reopens(self):
+        """Test que un fallo en la prueba vuelve a abrir el circuito"""
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        breaker._opened_at -= 60
+
+        self.assertTrue(breaker.allow_request())
+        breaker.record_failure()
+
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+
+if __name__ == '__main__':
+    unittest.main()
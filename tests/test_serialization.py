@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Test unitarios para los codecs de almacenamiento de Óptica Solar
+"""
+
+import json
+import unittest
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+from fakeredis import FakeAsyncRedis
+
+# Agregar el path del proyecto
+sys.path.append(str(Path(__file__).parent.parent / "retailGPT" / "actions_server" / "src"))
+
+from LLMChatbot.services import serialization
+from LLMChatbot.services.database import Database
+from LLMChatbot.services.serialization import Codec, CodecUnavailableError
+
+USER_DATA = {
+    "history": [
+        {"role": "user", "content": "Quiero gafas de sol para la playa"},
+        {"role": "tool", "content": "🕶️ Ray-Ban Aviator Classic Gold\n   Marca: Ray-Ban | Precio: R$299.99\n" * 40},
+    ],
+    "cart": [{"product_name": "Ray-Ban Aviator Classic Gold", "number_of_units": 2, "price_per_unit": 299.99}],
+    "should_send_cart_summary": True,
+}
+
+
+class TestCodec(unittest.TestCase):
+    """Test para la codificación de los datos guardados"""
+
+    def test_roundtrip_of_every_available_codec(self):
+        """Test que cada combinación instalada recupera los datos"""
+        for serializer, (_, _, _, serializer_available) in serialization._serializers.items():
+            for compression, (_, _, _, compression_available) in serialization._compressions.items():
+                if not (serializer_available and compression_available):
+                    continue
+                with self.subTest(serializer=serializer, compression=compression):
+                    codec = Codec(serializer, compression, compression_threshold=64)
+                    self.assertEqual(Codec.decode(codec.encode(USER_DATA)), USER_DATA)
+
+    def test_plain_json_is_untagged(self):
+        """Test que JSON sin compresión se guarda en el formato antiguo"""
+        record = Codec().encode(USER_DATA)
+
+        self.assertEqual(json.loads(record), USER_DATA)
+
+    def test_legacy_json_is_read(self):
+        """Test que los registros JSON antiguos se leen con cualquier codec"""
+        legacy = json.dumps(USER_DATA)
+
+        self.assertEqual(Codec.decode(legacy), USER_DATA)
+        self.assertEqual(Codec.decode(legacy.encode("utf-8")), USER_DATA)
+
+    def test_compression_above_threshold(self):
+        """Test que solo se comprimen los registros grandes"""
+        codec = Codec("json", "zlib", compression_threshold=256)
+
+        small = codec.encode({"should_send_cart_summary": True})
+        large = codec.encode(USER_DATA)
+
+        self.assertEqual(small[3], 0)
+        self.assertEqual(large[3], serialization._compressions["zlib"][0])
+        self.assertLess(len(large), len(json.dumps(USER_DATA).encode("utf-8")))
+
+    def test_unavailable_codec(self):
+        """Test que un registro con un codec no instalado da un error claro"""
+        record = Codec("json", "zlib", compression_threshold=0).encode(USER_DATA)
+        unavailable = dict(serialization._compressions)
+        unavailable["zlib"] = (1, None, None, False)
+
+        with patch.object(serialization, "_compressions", unavailable):
+            with self.assertRaises(CodecUnavailableError):
+                Codec.decode(record)
+
+    def test_unknown_codec_name(self):
+        """Test que un nombre de codec desconocido se rechaza"""
+        with self.assertRaises(ValueError):
+            Codec("pickle")
+
+
+class TestDatabaseCodec(unittest.IsolatedAsyncioTestCase):
+    """Test para el uso del codec en Database"""
+
+    async def asyncSetUp(self):
+        self.redis = FakeAsyncRedis()
+        self.patches = [
+            patch.object(Database, "get_client", return_value=self.redis),
+            patch.object(Database, "_codec", Codec("json", "zlib", compression_threshold=64)),
+        ]
+        for patcher in self.patches:
+            patcher.start()
+
+    async def asyncTearDown(self):
+        for patcher in self.patches:
+            patcher.stop()
+        await self.redis.aclose()
+
+    async def test_reads_records_of_any_codec(self):
+        """Test que se leen los registros antiguos y los nuevos"""
+        await self.redis.set("user:cart", json.dumps(USER_DATA["cart"]))
+        await Database.set_field("user", "history", USER_DATA["history"])
+
+        data = await Database.get_fields("user", ["cart", "history"])
+
+        self.assertEqual(data, {"cart": USER_DATA["cart"], "history": USER_DATA["history"]})
+        # El historial se guarda como lista, con un registro por mensaje
+        records = await self.redis.lrange("user:history", 0, -1)
+        self.assertEqual(len(records), len(USER_DATA["history"]))
+        self.assertTrue(all(record.startswith(b"\xff") for record in records))
+
+
+if __name__ == '__main__':
+    unittest.main()
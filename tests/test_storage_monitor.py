@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Test unitarios para StorageMonitor de Óptica Solar
+"""
+
+import json
+import unittest
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+from fakeredis import FakeAsyncRedis
+
+# Agregar el path del proyecto
+sys.path.append(str(Path(__file__).parent.parent / "retailGPT" / "actions_server" / "src"))
+
+from LLMChatbot.services.database import Database
+from LLMChatbot.services.storage_monitor import StorageMonitor
+
+
+class TestStorageMonitor(unittest.IsolatedAsyncioTestCase):
+    """Test para el reporte y el barrido de los datos de usuario"""
+
+    async def asyncSetUp(self):
+        self.redis = FakeAsyncRedis()
+        self.patcher = patch.object(Database, "get_client", return_value=self.redis)
+        self.patcher.start()
+
+    async def asyncTearDown(self):
+        self.patcher.stop()
+        await self.redis.aclose()
+
+    async def test_report_groups_keys_by_field(self):
+        """Test que el reporte agrupa las claves y los bytes por campo"""
+        await Database.set_field("user1", "cart", [])
+        await Database.set_field("user2", "cart", [{"product_name": "Ray-Ban Aviator"}])
+        await Database.set_field("user1", "history", [{"role": "user", "content": "Hola"}])
+        await self.redis.set("user3", json.dumps({"cart": []}))
+
+        report = await StorageMonitor.get_report()
+
+        self.assertEqual(report["cart"]["keys"], 2)
+        self.assertGreater(report["cart"]["bytes"], 0)
+        self.assertEqual(report["cart"]["without_ttl"], 0)
+        self.assertEqual(report["history"]["keys"], 1)
+        self.assertEqual(report["legacy"], {"keys": 1, "bytes": len(json.dumps({"cart": []})), "without_ttl": 1})
+
+    async def test_sweep_gives_ttl_to_keys_without_expiration(self):
+        """Test que el barrido asigna el TTL del campo a las claves sin expiración"""
+        await self.redis.set("user1:tool_calls", "[]")
+        await self.redis.set("user1", "{}")
+        await Database.set_field("user2", "cart", [])
+        cart_ttl = await self.redis.ttl("user2:cart")
+
+        swept = await StorageMonitor.sweep()
+
+        self.assertEqual(swept, 2)
+        self.assertEqual(await self.redis.ttl("user1:tool_calls"), Database.get_ttl("tool_calls"))
+        self.assertEqual(await self.redis.ttl("user1"), Database._default_ttl)
+        self.assertEqual(await self.redis.ttl("user2:cart"), cart_ttl)
+
+    async def test_sweep_keeps_keys_of_other_services(self):
+        """Test que el barrido no asigna TTL a las claves de otros servicios"""
+        await self.redis.set("celery", "task")
+        await self.redis.set("session", json.dumps({"token": "abc"}))
+        await self.redis.set("app:settings", "{}")
+        await self.redis.rpush("queue", "job")
+        await self.redis.set("user1", json.dumps({"cart": [], "history": []}))
+
+        swept = await StorageMonitor.sweep()
+        report = await StorageMonitor.get_report()
+
+        self.assertEqual(swept, 1)
+        for key in ("celery", "session", "app:settings", "queue"):
+            self.assertEqual(await self.redis.ttl(key), -1)
+        self.assertEqual(await self.redis.ttl("user1"), Database._default_ttl)
+        self.assertEqual(report["other"]["keys"], 4)
+        self.assertEqual(report["legacy"]["keys"], 1)
+
+    async def test_sweeper_disabled_by_default(self):
+        """Test que el barrido periódico no se inicia si está desactivado"""
+        with patch.object(StorageMonitor, "_sweep_interval", 0):
+            StorageMonitor.start_sweeper()
+
+        self.assertIsNone(StorageMonitor._sweeper)
+
+
+if __name__ == "__main__":
+    unittest.main()
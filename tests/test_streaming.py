@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Test unitarios para el streaming de completions de Óptica Solar
+"""
+
+import unittest
+import sys
+from pathlib import Path
+
+# Agregar el path del proyecto
+sys.path.append(str(Path(__file__).parent.parent / "retailGPT" / "actions_server" / "src"))
+
+from LLMChatbot.services.streaming import StreamedCompletion, iter_sse_data
+
+
+async def lines_of(*lines):
+    for line in lines:
+        yield line
+
+
+class TestIterSseData(unittest.IsolatedAsyncioTestCase):
+    """Test para el parser de eventos SSE"""
+
+    async def test_parses_data_events_until_done(self):
+        """Test que solo se leen los eventos 'data:' hasta '[DONE]'"""
+        lines = lines_of(
+            b": keep-alive\n",
+            b'data: {"id": 1}\n',
+            b"\n",
+            b'data:{"id": 2}\n',
+            b"data: [DONE]\n",
+            b'data: {"id": 3}\n',
+        )
+
+        chunks = [chunk async for chunk in iter_sse_data(lines)]
+
+        self.assertEqual(chunks, [{"id": 1}, {"id": 2}])
+
+
+class TestStreamedCompletion(unittest.TestCase):
+    """Test para la acumulación de los chunks de una completion"""
+
+    def test_merges_content(self):
+        """Test que el contenido se concatena y se devuelve el texto de cada chunk"""
+        completion = StreamedCompletion()
+
+        self.assertEqual(completion.add_chunk({"choices": [{"delta": {"role": "assistant"}}]}), "")
+        self.assertEqual(completion.add_chunk({"choices": [{"delta": {"content": "Gafas "}}]}), "Gafas ")
+        self.assertEqual(completion.add_chunk({"choices": [{"delta": {"content": "Ray-Ban"}}]}), "Ray-Ban")
+        self.assertEqual(completion.add_chunk({"choices": []}), "")
+
+        self.assertEqual(completion.get_message()["content"], "Gafas Ray-Ban")
+        self.assertIsNone(completion.get_message()["tool_calls"])
+
+    def test_merges_tool_call_arguments(self):
+        """Test que los fragmentos de las tool calls se unen por índice"""
+        completion = StreamedCompletion()
+        chunks = [
+            {"index": 0, "id": "call_1", "type": "function", "function": {"name": "edit_cart", "arguments": ""}},
+            {"index": 1, "id": "call_2", "type": "function", "function": {"name": "finish_purchase", "arguments": "{}"}},
+            {"index": 0, "function": {"arguments": '{"operation": '}},
+            {"index": 0, "function": {"arguments": '"add"}'}},
+        ]
+        for tool_call in chunks:
+            completion.add_chunk({"choices": [{"delta": {"tool_calls": [tool_call]}}]})
+
+        message = completion.get_message()
+
+        self.assertIsNone(message["content"])
+        self.assertEqual(
+            message["tool_calls"],
+            [
+                {"id": "call_1", "type": "function", "function": {"name": "edit_cart", "arguments": '{"operation": "add"}'}},
+                {"id": "call_2", "type": "function", "function": {"name": "finish_purchase", "arguments": "{}"}},
+            ],
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Test unitarios para TokenCounter de Óptica Solar
+"""
+
+import unittest
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+# Agregar el path del proyecto
+sys.path.append(str(Path(__file__).parent.parent / "retailGPT" / "actions_server" / "src"))
+
+from LLMChatbot.services import token_counter
+from LLMChatbot.services.token_counter import TokenCounter
+
+
+class TestTokenCounter(unittest.TestCase):
+    """Test para el conteo de tokens de los mensajes"""
+
+    def setUp(self):
+        TokenCounter.count_text.cache_clear()
+        self.patches = [
+            patch.object(token_counter, "tiktoken", None),
+            patch.object(TokenCounter, "_encoding", None),
+        ]
+        for patcher in self.patches:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patches:
+            patcher.stop()
+        TokenCounter.count_text.cache_clear()
+
+    def test_estimate_without_tokenizer(self):
+        """Test que sin tokenizador se estiman 4 caracteres por token"""
+        self.assertEqual(TokenCounter.count_text("a" * 40), 10)
+        self.assertEqual(TokenCounter.count_text("abc"), 1)
+
+    def test_texts_are_counted_once(self):
+        """Test que cada texto se cuenta una sola vez"""
+        for _ in range(3):
+            TokenCounter.count_text("Busco gafas de sol polarizadas")
+
+        self.assertEqual(TokenCounter.count_text.cache_info().misses, 1)
+
+    def test_message_includes_tool_calls(self):
+        """Test que el conteo del mensaje incluye sus tool calls"""
+        message = {"role": "assistant", "content": None}
+        message_with_tool_calls = {
+            **message,
+            "tool_calls": [{"id": "call_0", "type": "function", "function": {"name": "get_cart", "arguments": "{}"}}],
+        }
+
+        self.assertGreater(
+            TokenCounter.count_message(message_with_tool_calls), TokenCounter.count_message(message)
+        )
+
+    def test_messages_include_format_overhead(self):
+        """Test que el prompt suma el formato de cada mensaje y de la respuesta"""
+        messages = [{"role": "user", "content": "Hola"}] * 2
+
+        self.assertEqual(
+            TokenCounter.count_messages(messages),
+            2 * TokenCounter.count_message(messages[0]) + TokenCounter._tokens_per_reply,
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
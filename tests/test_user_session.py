@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Test unitarios para UserSession de Óptica Solar
+"""
+
+import asyncio
+import unittest
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+from fakeredis import FakeAsyncRedis
+
+# Agregar el path del proyecto
+sys.path.append(str(Path(__file__).parent.parent / "retailGPT" / "actions_server" / "src"))
+
+from LLMChatbot.services.cart_handler import CartHandler
+from LLMChatbot.services.database import Database
+from LLMChatbot.services.memory_handler import MemoryHandler
+from LLMChatbot.services.user_session import UserSession
+
+
+class TestUserSession(unittest.IsolatedAsyncioTestCase):
+    """Test para la unidad de trabajo por turno"""
+
+    async def asyncSetUp(self):
+        self.redis = FakeAsyncRedis(decode_responses=True)
+        self.reads = []
+        self.writes = []
+        read_fields = Database._read_fields
+        write_fields = Database._write_fields
+        transact_fields = Database._transact_fields
+
+        async def counted_read(user_id, fields):
+            self.reads.append(list(fields))
+            return await read_fields(user_id, fields)
+
+        async def counted_write(user_id, data, touched_fields=(), appends=None):
+            # Los elementos agregados a listas cuentan como campos escritos
+            self.writes.append({**data, **{field: items for field, (items, _) in (appends or {}).items()}})
+            await write_fields(user_id, data, touched_fields, appends)
+
+        async def counted_transaction(user_id, fields, update, touched_fields=(), appends=None):
+            changes = await transact_fields(user_id, fields, update, touched_fields, appends)
+            self.writes.append({**changes, **{field: items for field, (items, _) in (appends or {}).items()}})
+            return changes
+
+        self.patches = [
+            patch.object(Database, "get_client", return_value=self.redis),
+            patch.object(Database, "_read_fields", counted_read),
+            patch.object(Database, "_write_fields", counted_write),
+            patch.object(Database, "_transact_fields", counted_transaction),
+        ]
+        for patcher in self.patches:
+            patcher.start()
+
+    async def asyncTearDown(self):
+        for patcher in self.patches:
+            patcher.stop()
+        await self.redis.aclose()
+
+    async def test_fields_are_read_once_and_written_once(self):
+        """Test que el estado se lee una vez y se escribe en una sola operación"""
+        await Database.set_field("user", "cart", [])
+        self.writes.clear()
+
+        async with UserSession.start("user"):
+            await MemoryHandler.add_message_to_history("user", {"role": "user", "content": "Hola"})
+            await CartHandler.set_should_send_cart_summary("user", True)
+            self.assertTrue(await CartHandler.get_should_send_cart_summary("user"))
+            self.assertEqual(len(await CartHandler._get_cart("user")), 0)
+            history = await MemoryHandler.get_history("user")
+            self.assertEqual(self.writes, [])
+
+        self.assertEqual(len(self.reads), 1)
+        self.assertEqual(len(self.writes), 1)
+        self.assertEqual(set(self.writes[0]), {"history", "should_send_cart_summary"})
+        self.assertEqual(await MemoryHandler.get_history("user"), history)
+
+    async def test_values_are_copies(self):
+        """Test que modificar un valor leído no cambia la sesión"""
+        async with UserSession.start("user"):
+            history = await MemoryHandler.get_history("user")
+            history.append({"role": "user", "content": "Hola"})
+
+            self.assertEqual(await MemoryHandler.get_history("user"), [])
+
+        self.assertEqual(self.writes, [])
+
+    async def test_flushes_on_error(self):
+        """Test que los cambios se escriben aunque el turno falle"""
+        with self.assertRaises(RuntimeError):
+            async with UserSession.start("user"):
+                await CartHandler.set_should_finish_purchase("user", True)
+                raise RuntimeError("Fallo en el turno")
+
+        self.assertTrue(await CartHandler.get_should_finish_purchase("user"))
+
+    async def test_tasks_share_the_session(self):
+        """Test que las tareas creadas en el turno usan la misma sesión"""
+        async with UserSession.start("user") as session:
+            await asyncio.gather(
+                CartHandler.set_should_send_cart_summary("user", True),
+                CartHandler.set_should_finish_purchase("user", True),
+            )
+            self.assertTrue(session.is_dirty())
+
+        self.assertEqual(len(self.writes), 1)
+
+    async def test_other_users_bypass_the_session(self):
+        """Test que los datos de otros usuarios no pasan por la sesión"""
+        async with UserSession.start("user"):
+            await CartHandler.set_should_finish_purchase("other", True)
+            self.assertEqual(self.writes, [{"should_finish_purchase": True}])
+
+
+if __name__ == '__main__':
+    unittest.main()